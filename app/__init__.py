@@ -1,6 +1,7 @@
 import os
-from flask import Flask, session
-from . import db
+from flask import Flask, g, session
+from werkzeug.local import LocalProxy
+from . import assignment, columnar, counters, db, duplicates, events, exports, imports, jobs, migrations, notifications, push, rollups, search, sketches, sla, sqltrace, votes
 from .utils import date_format, time_since, initial_filter, to_ist
 
 def create_app(test_config=None):
@@ -22,7 +23,23 @@ def create_app(test_config=None):
     except OSError:
         pass
 
+    sqltrace.init_app(app)
     db.init_app(app)
+    migrations.init_app(app)
+    search.init_app(app)
+    rollups.init_app(app)
+    sketches.init_app(app)
+    columnar.init_app(app)
+    events.init_app(app)
+    counters.init_app(app)
+    assignment.init_app(app)
+    sla.init_app(app)
+    duplicates.init_app(app)
+    votes.init_app(app)
+    exports.init_app(app)
+    imports.init_app(app)
+    push.init_app(app)
+    jobs.init_app(app)
 
     # Register Filters
     app.jinja_env.filters['to_ist'] = to_ist
@@ -30,24 +47,27 @@ def create_app(test_config=None):
     app.jinja_env.filters['timesince'] = time_since
     app.jinja_env.filters['initials'] = initial_filter
 
-    # Context Processor for Notifications
+    # Context Processor for Notifications. The count is a lazy proxy so the
+    # lookup only runs (once per request) if the template actually uses it.
+    def _unread_count():
+        if 'unread_count' not in g:
+            g.unread_count = notifications.cached_unread_count(
+                db.get_db(), session['user_id'], notifications.current_audiences())
+        return g.unread_count
+
     @app.context_processor
     def inject_notifications():
         if 'user_id' in session:
-            conn = db.get_db()
-            count = conn.execute(
-                "SELECT COUNT(*) FROM notifications WHERE user_id = ? AND is_read = 0",
-                (session['user_id'],)
-            ).fetchone()[0]
-            return dict(unread_count=count)
+            return dict(unread_count=LocalProxy(_unread_count))
         return dict(unread_count=0)
 
     # Register Blueprints
-    from .routes import auth, student, admin, common
+    from .routes import auth, student, admin, common, api
     app.register_blueprint(auth.bp)
     app.register_blueprint(student.bp)
     app.register_blueprint(admin.bp)
     app.register_blueprint(common.bp)
+    app.register_blueprint(api.bp)
 
     # Default route
     @app.route('/')
@@ -0,0 +1,119 @@
+import heapq
+from app import db as database
+from app.db import _extension, data_version
+from app.notifications import CATCH_ALL_DEPARTMENT
+from app.utils import CLOSED_STATUSES
+
+# Load-aware automatic assignment. With AUTO_ASSIGN on, a new issue goes
+# to the staff member of the matching department (category == department,
+# falling back to the catch-all department) with the fewest open issues.
+#
+# Workloads are kept per department in an in-memory min-heap of
+# (open issues, staff id), loaded from issue_counters and adjusted as
+# issues are assigned, reassigned and resolved. Stale heap entries are
+# skipped lazily when they reach the top, so picking and updating are both
+# O(log n). The heap is only used inside write transactions: it is stamped
+# with the issues/users data_versions it reflects and reloaded whenever
+# another process (or any untracked write) has moved them on, so every
+# worker process assigns from the committed state.
+
+DEFAULT_SETTINGS = {
+    'AUTO_ASSIGN': False,
+}
+
+
+class Workloads:
+    def __init__(self, app=None):
+        self.loads = {}
+        self.departments = {}
+        self.heaps = {}
+        self.versions = None
+        # Set by sync(): the heap matches the database as of this transaction
+        self._synced = False
+
+    def _current_versions(self, db):
+        return data_version(db, 'issues'), data_version(db, 'users')
+
+    def invalidate(self):
+        self.versions = None
+        self._synced = False
+
+    def load(self, db):
+        rows = db.execute('''
+            SELECT u.id, u.department, coalesce(c.count, 0) AS active
+            FROM users u
+            LEFT JOIN issue_counters c ON c.kind = 'assignee' AND c.key = CAST(u.id AS TEXT)
+            WHERE u.role = 'staff'
+        ''').fetchall()
+        self.loads = {row['id']: row['active'] for row in rows}
+        self.departments = {row['id']: row['department'] for row in rows}
+        self.heaps = {}
+        for row in rows:
+            self.heaps.setdefault(row['department'], []).append((row['active'], row['id']))
+        for heap in self.heaps.values():
+            heapq.heapify(heap)
+        self.versions = self._current_versions(db)
+
+    def sync(self, db):
+        """Reload unless the heap already reflects the database. Call inside the write transaction."""
+        if self.versions != self._current_versions(db):
+            self.load(db)
+        self._synced = True
+
+    def least_loaded(self, department):
+        heap = self.heaps.get(department)
+        while heap:
+            load, staff_id = heap[0]
+            if self.loads.get(staff_id) == load:
+                return staff_id
+            # Superseded by a later push for the same staff member
+            heapq.heappop(heap)
+        return None
+
+    def pick(self, category):
+        return self.least_loaded(category) or self.least_loaded(CATCH_ALL_DEPARTMENT)
+
+    def _adjust(self, staff_id, delta):
+        if staff_id not in self.loads:
+            return
+        self.loads[staff_id] += delta
+        heap = self.heaps[self.departments[staff_id]]
+        heapq.heappush(heap, (self.loads[staff_id], staff_id))
+        # Lazy deletion leaves stale entries behind; compact once they dominate
+        if len(heap) > 4 * len(self.loads) + 64:
+            self.heaps[self.departments[staff_id]] = heap = [
+                (load, staff) for load, staff in heap if self.loads.get(staff) == load]
+            heapq.heapify(heap)
+
+    def record_change(self, db, before, after):
+        """Apply an issue write to the workloads: call sync() before the write and this after it."""
+        if not self._synced:
+            # Nothing says the heap matched before this write; reload on next use
+            self.invalidate()
+            return
+        self._synced = False
+        for issue, delta in ((before, -1), (after, 1)):
+            if issue is not None and issue['assignee_id'] is not None and issue['status'] not in CLOSED_STATUSES:
+                self._adjust(issue['assignee_id'], delta)
+        self.versions = self._current_versions(db)
+
+
+def get_workloads(app=None):
+    return _extension('smartcampus_workloads', Workloads, app)
+
+def run_write(fn):
+    """database.run_write() for a body that updates workloads: fn(db, workloads).
+
+    The in-memory heap is only right if the transaction commits, so it is
+    dropped (and reloaded on next use) when the write fails.
+    """
+    workloads = get_workloads()
+    try:
+        return database.run_write(lambda db: fn(db, workloads))
+    except BaseException:
+        workloads.invalidate()
+        raise
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
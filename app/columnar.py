@@ -0,0 +1,307 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date
+import click
+from app.db import _extension, get_read_pool
+
+try:
+    import numpy as np
+except ImportError:  # optional: the deeper analytics charts are disabled without it
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Columnar copy of the issues table for vectorized reports. Each column is
+# a NumPy array persisted as a memory-mapped .npy file: ids, created and
+# resolved (or merged) times as int64 epoch seconds, -1 while open, and the text
+# columns as int codes into per-column dictionaries. Refreshes are
+# incremental: rows past the last seen id are appended and rows that were
+# still open are re-read, since those are the ones whose status changes.
+# Edits to already-resolved rows and deletions are picked up by the
+# periodic full rebuild.
+
+DEFAULT_SETTINGS = {
+    # Defaults to <instance>/columnar
+    'COLUMNAR_DIR': None,
+    'COLUMNAR_MAX_AGE': 300,
+    'COLUMNAR_FULL_REFRESH_AGE': 24 * 3600,
+}
+
+DICTIONARY_COLUMNS = ('category', 'location', 'priority', 'status')
+COLUMNS = ('id', 'created', 'resolved') + DICTIONARY_COLUMNS
+
+_SELECT = '''
+    SELECT id,
+           CAST(strftime('%s', created_at) AS INTEGER),
+           CASE WHEN status IN ('Resolved', 'Merged') THEN CAST(strftime('%s', resolved_at) AS INTEGER) END,
+           category, coalesce(location, ''), coalesce(priority, ''), coalesce(status, '')
+    FROM issues
+'''
+
+IST_SECONDS = 5 * 3600 + 30 * 60
+DAY = 86400
+
+
+def available():
+    return np is not None
+
+
+class Frame:
+    """One consistent generation of the columnar snapshot."""
+
+    def __init__(self, columns, dictionaries, generation, max_id):
+        self.columns = columns
+        self.dictionaries = dictionaries
+        self.generation = generation
+        self.max_id = max_id
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def labels(self, name):
+        return self.dictionaries[name]
+
+
+class ColumnarStore:
+    """Builds, persists and incrementally refreshes the columnar snapshot.
+
+    Like the SQLite snapshot, the first load or build is synchronous and
+    later refreshes run in a background thread while readers keep the
+    current Frame. Each generation is written to new files and then
+    published by replacing meta.json, so other processes never see a
+    half-written generation.
+    """
+
+    def __init__(self, app):
+        self.directory = app.config['COLUMNAR_DIR'] or os.path.join(app.instance_path, 'columnar')
+        self.max_age = app.config['COLUMNAR_MAX_AGE']
+        self.full_refresh_age = app.config['COLUMNAR_FULL_REFRESH_AGE']
+        self.pool = get_read_pool(app)
+        self.frame = None
+        self.refreshed_at = 0
+        self.built_at = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    @property
+    def stale(self):
+        return time.time() - self.refreshed_at > self.max_age
+
+    def _path(self, name, generation):
+        return os.path.join(self.directory, f'{name}.{generation}.npy')
+
+    def load(self):
+        """Map the newest persisted generation, if any, without touching the database."""
+        try:
+            with open(os.path.join(self.directory, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            columns = {name: np.load(self._path(name, meta['generation']), mmap_mode='r') for name in COLUMNS}
+        except (OSError, ValueError, KeyError):
+            return None
+        self.frame = Frame(columns, meta['dictionaries'], meta['generation'], meta['max_id'])
+        self.refreshed_at = meta['refreshed_at']
+        self.built_at = meta['built_at']
+        return self.frame
+
+    def _fetch(self, conn, where='', params=()):
+        rows = conn.execute(_SELECT + where + ' ORDER BY id', params).fetchall()
+        if not rows:
+            return None
+        ids, created, resolved, *text = zip(*rows)
+        return {
+            'id': np.array(ids, dtype=np.int64),
+            'created': np.array(created, dtype=np.int64),
+            'resolved': np.array([-1 if value is None else value for value in resolved], dtype=np.int64),
+            **dict(zip(DICTIONARY_COLUMNS, text)),
+        }
+
+    @staticmethod
+    def _encode(values, labels):
+        lookup = {label: code for code, label in enumerate(labels)}
+        return np.array([lookup.setdefault(value, len(lookup)) for value in values], dtype=np.int32), \
+            sorted(lookup, key=lookup.get)
+
+    def refresh(self, full=False):
+        frame = self.frame
+        full = full or frame is None or time.time() - self.built_at > self.full_refresh_age
+        conn = self.pool.acquire()
+        try:
+            # One read transaction, so appended and re-read rows agree
+            conn.execute("BEGIN")
+            if full:
+                fetched = self._fetch(conn)
+                changed = None
+            else:
+                fetched = self._fetch(conn, ' WHERE id > ?', (frame.max_id,))
+                open_ids = frame['id'][frame['resolved'] < 0]
+                changed = self._fetch(conn, ' WHERE id IN (SELECT value FROM json_each(?))',
+                                      (json.dumps(open_ids.tolist()),)) if len(open_ids) else None
+        finally:
+            self.pool.release(conn)
+
+        dictionaries = {name: [] if full else list(frame.labels(name)) for name in DICTIONARY_COLUMNS}
+        if full:
+            columns = {name: np.empty(0, dtype=np.int64 if name in ('id', 'created', 'resolved') else np.int32)
+                       for name in COLUMNS}
+        else:
+            columns = {name: np.array(frame[name]) for name in COLUMNS}
+
+        if changed is not None:
+            positions = np.searchsorted(columns['id'], changed['id'])
+            for name in COLUMNS[1:]:
+                values = changed[name]
+                if name in DICTIONARY_COLUMNS:
+                    values, dictionaries[name] = self._encode(values, dictionaries[name])
+                columns[name][positions] = values
+        if fetched is not None:
+            for name in COLUMNS:
+                values = fetched[name]
+                if name in DICTIONARY_COLUMNS:
+                    values, dictionaries[name] = self._encode(values, dictionaries[name])
+                columns[name] = np.concatenate([columns[name], values])
+
+        now = time.time()
+        built_at = now if full else self.built_at
+        self.frame = self._publish(columns, dictionaries, built_at, now)
+        self.refreshed_at = now
+        self.built_at = built_at
+        return self.frame
+
+    def _publish(self, columns, dictionaries, built_at, refreshed_at):
+        os.makedirs(self.directory, exist_ok=True)
+        generation = time.time_ns()
+        for name, values in columns.items():
+            np.save(self._path(name, generation), values)
+        max_id = int(columns['id'][-1]) if len(columns['id']) else 0
+        meta = {'generation': generation, 'max_id': max_id, 'dictionaries': dictionaries,
+                'built_at': built_at, 'refreshed_at': refreshed_at, 'rows': len(columns['id'])}
+        tmp = os.path.join(self.directory, f'meta.{generation}.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.directory, 'meta.json'))
+        self._remove_old(generation)
+        columns = {name: np.load(self._path(name, generation), mmap_mode='r') for name in COLUMNS}
+        return Frame(columns, dictionaries, generation, max_id)
+
+    def _remove_old(self, current):
+        # Keep the previous generation: readers may still have it mapped
+        generations = sorted({int(name.split('.')[1]) for name in os.listdir(self.directory)
+                              if name.endswith('.npy') and name.split('.')[1].isdigit()})
+        for generation in generations[:-2]:
+            for name in COLUMNS:
+                try:
+                    os.remove(self._path(name, generation))
+                except OSError:
+                    # Still mapped (Windows); retried on the next refresh
+                    pass
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception('Columnar snapshot refresh failed')
+        finally:
+            self._refreshing = False
+
+    def get_frame(self):
+        if self.frame is None:
+            with self._lock:
+                if self.frame is None and (self.load() is None or self.stale):
+                    self.refresh()
+        elif self.stale and not self._refreshing:
+            with self._lock:
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return self.frame
+
+
+def get_store(app=None):
+    return _extension('smartcampus_columnar', ColumnarStore, app)
+
+def epoch_bounds(first_day=None, last_day=None):
+    """Epoch seconds bounding the IST days first_day..last_day (inclusive); None stays open."""
+    def _start(day):
+        return (day - date(1970, 1, 1)).days * DAY - IST_SECONDS
+    return (None if first_day is None else _start(first_day),
+            None if last_day is None else _start(last_day) + DAY)
+
+def _window(frame, since=None, until=None):
+    created = frame['created']
+    mask = np.ones(len(created), dtype=bool)
+    if since is not None:
+        mask &= created >= since
+    if until is not None:
+        mask &= created < until
+    return mask
+
+def hour_of_week(frame, since=None, until=None):
+    """7x24 counts of issues created per IST weekday (Monday first) and hour."""
+    local = frame['created'][_window(frame, since, until)] + IST_SECONDS
+    # 1970-01-01 was a Thursday, weekday 3 counting from Monday
+    weekday = (local // DAY + 3) % 7
+    hour = local % DAY // 3600
+    return np.bincount(weekday * 24 + hour, minlength=168).reshape(7, 24)
+
+def backlog(frame, since, until, step=DAY):
+    """Open-issue count at each step from since to until (epoch seconds).
+
+    An issue is open at t when it was created at or before t and not yet
+    resolved; two binary searches over sorted timestamps give every point.
+    """
+    points = np.arange(since, until + 1, step, dtype=np.int64)
+    created = np.sort(frame['created'])
+    resolved = frame['resolved']
+    resolved = np.sort(resolved[resolved >= 0])
+    opened = np.searchsorted(created, points, side='right')
+    closed = np.searchsorted(resolved, points, side='right')
+    return points, opened - closed
+
+def crosstab(frame, row, column, top=10, since=None, until=None):
+    """Counts of `row` x `column` codes; columns beyond the `top` largest are folded into 'Other'."""
+    mask = _window(frame, since, until)
+    rows = frame[row][mask]
+    cols = frame[column][mask]
+    row_labels = frame.labels(row)
+    col_labels = frame.labels(column)
+
+    totals = np.bincount(cols, minlength=len(col_labels))
+    keep = [code for code in np.argsort(totals)[::-1][:top] if totals[code]]
+    # Map every column code to its kept position, or to the trailing "Other" slot
+    remap = np.full(len(col_labels), len(keep), dtype=np.int64)
+    remap[keep] = np.arange(len(keep))
+    width = len(keep) + 1
+    table = np.bincount(rows * width + remap[cols], minlength=len(row_labels) * width)
+    table = table.reshape(len(row_labels), width)
+
+    labels = [col_labels[code] or 'Unspecified' for code in keep]
+    if table[:, -1].any():
+        labels.append('Other')
+    else:
+        table = table[:, :-1]
+    present = table.sum(axis=1) > 0
+    return [row_labels[code] for code in np.flatnonzero(present)], labels, table[present]
+
+
+@click.command('columnar-refresh')
+@click.option('--full', is_flag=True, help='Rebuild every column instead of refreshing incrementally.')
+def columnar_refresh_command(full):
+    """Refresh the NumPy columnar snapshot used by the deeper analytics charts."""
+    if not available():
+        raise click.ClickException('NumPy is not installed.')
+    store = get_store()
+    if store.frame is None:
+        store.load()
+    frame = store.refresh(full=full)
+    click.echo(f'Columnar snapshot has {len(frame)} issues (generation {frame.generation}).')
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+    app.cli.add_command(columnar_refresh_command)
@@ -0,0 +1,84 @@
+import click
+from app.db import run_write
+from app.utils import CLOSED_STATUSES
+
+# Materialized issue counts for the admin dashboard: issues per status and
+# per category, and open (not resolved or merged) issues per assignee. Rows live in
+# issue_counters keyed by (kind, key) and are adjusted by record_change()
+# inside the same write transaction that inserts or updates an issue, so
+# the header cards and the workload panel read a handful of rows instead
+# of grouping the issues table.
+
+KINDS = ('status', 'category', 'assignee')
+
+_UPSERT = '''
+    INSERT INTO issue_counters (kind, key, count) VALUES (?, ?, ?)
+    ON CONFLICT (kind, key) DO UPDATE SET count = count + excluded.count
+'''
+
+
+def _keys(issue):
+    keys = [('status', issue['status'] or ''), ('category', issue['category'])]
+    if issue['assignee_id'] is not None and issue['status'] not in CLOSED_STATUSES:
+        keys.append(('assignee', str(issue['assignee_id'])))
+    return keys
+
+def record_change(db, before, after):
+    """Move an issue's counts from its `before` state to its `after` state.
+
+    Call inside the write transaction that changes the issue; either side
+    may be None for an insert or delete.
+    """
+    record_changes(db, [(before, after)])
+
+def record_changes(db, changes):
+    """record_change() for many (before, after) pairs, with one upsert per counter touched."""
+    deltas = {}
+    for before, after in changes:
+        for issue, sign in ((before, -1), (after, 1)):
+            if issue is not None:
+                for key in _keys(issue):
+                    deltas[key] = deltas.get(key, 0) + sign
+    db.executemany(_UPSERT, [(kind, key, delta) for (kind, key), delta in deltas.items() if delta])
+
+def rebuild(db):
+    """Recompute every counter from the issues table in the caller's transaction."""
+    db.execute("DELETE FROM issue_counters")
+    db.execute('''
+        INSERT INTO issue_counters (kind, key, count)
+        SELECT 'status', coalesce(status, ''), COUNT(*) FROM issues GROUP BY 2
+    ''')
+    db.execute('''
+        INSERT INTO issue_counters (kind, key, count)
+        SELECT 'category', category, COUNT(*) FROM issues GROUP BY 2
+    ''')
+    db.execute('''
+        INSERT INTO issue_counters (kind, key, count)
+        SELECT 'assignee', CAST(assignee_id AS TEXT), COUNT(*) FROM issues
+        WHERE assignee_id IS NOT NULL AND status NOT IN (?, ?) GROUP BY assignee_id
+    ''', CLOSED_STATUSES)
+    return db.execute("SELECT COALESCE(SUM(count), 0) FROM issue_counters WHERE kind = 'status'").fetchone()[0]
+
+def counts(db, kind):
+    """Return {key: count} for one kind of counter."""
+    rows = db.execute("SELECT key, count FROM issue_counters WHERE kind = ?", (kind,))
+    return {row['key']: row['count'] for row in rows if row['count']}
+
+def workload(db):
+    """Staff with open assigned issues, as rows of id, fullname, department and active_count."""
+    return db.execute('''
+        SELECT u.id, u.fullname, u.department, c.count AS active_count
+        FROM issue_counters c JOIN users u ON u.id = c.key
+        WHERE c.kind = 'assignee' AND c.count > 0
+        ORDER BY u.fullname
+    ''').fetchall()
+
+
+@click.command('counters-rebuild')
+def counters_rebuild_command():
+    """Recompute the dashboard status, category and workload counters."""
+    count = run_write(rebuild)
+    click.echo(f'Rebuilt counters over {count} issues.')
+
+def init_app(app):
+    app.cli.add_command(counters_rebuild_command)
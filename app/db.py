@@ -1,91 +1,369 @@
+import glob
+import logging
+import os
+import queue
 import sqlite3
+import threading
+import time
+from urllib.request import pathname2url
 import click
-from flask import current_app, g
+from flask import current_app, g, has_request_context, request
 from werkzeug.security import generate_password_hash
+from app.sqltrace import TracedConnection
+from app.writer import begin_immediate, create_write_queue
+
+logger = logging.getLogger(__name__)
+
+# Connection tuning defaults, overridable through app.config
+DEFAULT_SETTINGS = {
+    'DB_POOL_SIZE': 8,
+    'DB_POOL_TIMEOUT': 10.0,
+    'DB_JOURNAL_MODE': 'WAL',
+    'DB_SYNCHRONOUS': 'NORMAL',
+    'DB_BUSY_TIMEOUT_MS': 5000,
+    'DB_CACHE_SIZE_KB': 16384,
+    'DB_MMAP_SIZE': 64 * 1024 * 1024,
+    'DB_CACHED_STATEMENTS': 256,
+    'DB_WRITE_RETRIES': 5,
+    'DB_WRITE_RETRY_DELAY': 0.05,
+    # Route all writes through one group-committing writer thread
+    'DB_WRITER_THREAD': True,
+    'DB_WRITER_MAX_BATCH': 64,
+    'DB_WRITE_TIMEOUT': 30,
+    'DB_READ_POOL_SIZE': 4,
+    # Directory for VACUUM INTO snapshots used by heavy reports (None disables)
+    'ANALYTICS_SNAPSHOT_DIR': None,
+    'ANALYTICS_SNAPSHOT_MAX_AGE': 300,
+}
+
+_pool_lock = threading.RLock()
+
+
+def _readonly_uri(path):
+    return 'file:' + pathname2url(os.path.abspath(path)) + '?mode=ro'
+
+
+class ConnectionPool:
+    """Thread-safe pool of long-lived SQLite connections.
+
+    Every connection is tuned once when it is opened, so handing one out
+    for a request costs a queue operation instead of a connect + PRAGMAs.
+    """
+
+    def __init__(self, database, size=8, timeout=10.0, journal_mode='WAL',
+                 synchronous='NORMAL', busy_timeout_ms=5000, cache_size_kb=16384,
+                 mmap_size=0, cached_statements=256, trace=True, slow_query_ms=None,
+                 readonly=False):
+        self.database = database
+        self.readonly = readonly
+        self.size = size
+        self.timeout = timeout
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self.trace = trace
+        self.slow_query_ms = slow_query_ms
+        # LIFO keeps the most recently used (warmest) connections in rotation
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._closed = False
+
+    @classmethod
+    def from_config(cls, config, database=None, readonly=False):
+        return cls(
+            database or config['DATABASE'],
+            readonly=readonly,
+            size=config['DB_READ_POOL_SIZE'] if readonly else config['DB_POOL_SIZE'],
+            timeout=config['DB_POOL_TIMEOUT'],
+            journal_mode=config['DB_JOURNAL_MODE'],
+            synchronous=config['DB_SYNCHRONOUS'],
+            busy_timeout_ms=config['DB_BUSY_TIMEOUT_MS'],
+            cache_size_kb=config['DB_CACHE_SIZE_KB'],
+            mmap_size=config['DB_MMAP_SIZE'],
+            cached_statements=config['DB_CACHED_STATEMENTS'],
+            trace=config['SQL_TRACE'],
+            slow_query_ms=config['SQL_SLOW_QUERY_MS'],
+        )
+
+    def connect(self):
+        """Open a new tuned connection that is not tracked by the pool."""
+        if self.readonly:
+            # mode=ro opens the file without write access; in WAL mode these
+            # readers work off a snapshot and never block the writer
+            database = _readonly_uri(self.database)
+        else:
+            database = self.database
+        conn = sqlite3.connect(
+            database,
+            uri=self.readonly,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            timeout=self.busy_timeout_ms / 1000,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+            # Transactions are explicit (see run_write), no implicit BEGIN
+            isolation_level=None,
+            factory=TracedConnection if self.trace else sqlite3.Connection,
+        )
+        if self.trace:
+            conn.slow_ms = self.slow_query_ms
+        conn.row_factory = sqlite3.Row
+        if self.readonly:
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            conn.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+            conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        # Negative cache_size is interpreted by SQLite as KiB
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self.connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError('Timed out waiting for a database connection') from None
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            if self._closed:
+                raise sqlite3.ProgrammingError('pool closed')
+        except sqlite3.Error:
+            # Broken connection, drop it and let the pool open a fresh one
+            with self._lock:
+                self._opened -= 1
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            return
+        self._idle.put(conn)
+
+    def close(self):
+        # Connections still checked out are closed when they are released
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+
+class SnapshotManager:
+    """Periodically refreshed VACUUM INTO copy of the database for heavy reports.
+
+    Each refresh writes a new timestamped file and swaps in a fresh
+    read-only pool for it, so reports running against the previous snapshot
+    finish undisturbed. Old files are removed once nothing holds them open.
+    """
+
+    def __init__(self, app):
+        self.config = app.config
+        self.directory = app.config['ANALYTICS_SNAPSHOT_DIR']
+        self.max_age = app.config['ANALYTICS_SNAPSHOT_MAX_AGE']
+        self.pool = None
+        self.created_at = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    @property
+    def stale(self):
+        return time.time() - self.created_at > self.max_age
+
+    def refresh(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'snapshot-{time.time_ns()}.sqlite')
+        # query_only would refuse VACUUM INTO, so use a bare mode=ro connection
+        conn = sqlite3.connect(_readonly_uri(self.config['DATABASE']), uri=True, isolation_level=None)
+        try:
+            conn.execute("VACUUM INTO ?", (path,))
+        finally:
+            conn.close()
+
+        old, self.pool = self.pool, ConnectionPool.from_config(self.config, database=path, readonly=True)
+        self.created_at = time.time()
+        if old is not None:
+            old.close()
+        self._remove_old(keep=path)
+        return path
+
+    def _remove_old(self, keep):
+        for path in glob.glob(os.path.join(self.directory, 'snapshot-*.sqlite')):
+            if path != keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Still open by a report (Windows); retried on the next refresh
+                    pass
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception('Analytics snapshot refresh failed')
+        finally:
+            self._refreshing = False
+
+    def get_pool(self):
+        """Return the snapshot pool, refreshing it when it is too old.
+
+        The very first snapshot is taken synchronously; later refreshes run
+        in a background thread while readers keep using the current one.
+        """
+        if self.pool is None:
+            with self._lock:
+                if self.pool is None:
+                    self.refresh()
+        elif self.stale and not self._refreshing:
+            with self._lock:
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return self.pool
+
+
+def _extension(name, factory, app=None):
+    app = app or current_app
+    value = app.extensions.get(name)
+    if value is None:
+        with _pool_lock:
+            value = app.extensions.get(name)
+            if value is None:
+                value = app.extensions[name] = factory(app)
+    return value
+
+def get_pool(app=None):
+    return _extension('smartcampus_db', lambda app: ConnectionPool.from_config(app.config), app)
+
+def get_read_pool(app=None):
+    return _extension('smartcampus_db_ro',
+                      lambda app: ConnectionPool.from_config(app.config, readonly=True), app)
+
+def get_writer(app=None):
+    return _extension('smartcampus_db_writer',
+                      lambda app: create_write_queue(get_pool(app), app.config), app)
+
+def get_snapshot_manager(app=None):
+    return _extension('smartcampus_db_snapshot', SnapshotManager, app)
 
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
-        g.db.execute("PRAGMA foreign_keys = ON")
+        g.db = get_pool().acquire()
     return g.db
 
+def get_read_db(snapshot=False):
+    """Return a read-only connection for reports and dashboards.
+
+    Writes through it fail with "attempt to write a readonly database".
+    With snapshot=True and ANALYTICS_SNAPSHOT_DIR configured, the
+    connection reads a periodically refreshed VACUUM INTO copy instead of
+    the live file; without a snapshot directory it reads the live file.
+    """
+    key = 'snapshot_db' if snapshot else 'read_db'
+    if key not in g:
+        if snapshot and current_app.config['ANALYTICS_SNAPSHOT_DIR']:
+            pool = get_snapshot_manager().get_pool()
+        else:
+            pool = get_read_pool()
+        setattr(g, key, (pool, pool.acquire()))
+    return getattr(g, key)[1]
+
 def close_db(e=None):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        get_pool().release(db)
+    for key in ('read_db', 'snapshot_db'):
+        borrowed = g.pop(key, None)
+        if borrowed is not None:
+            pool, conn = borrowed
+            pool.release(conn)
 
-def init_db():
-    db = get_db()
-    
-    # Create Users Table with department column
-    db.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            fullname TEXT NOT NULL,
-            email TEXT NOT NULL UNIQUE,
-            password_hash TEXT NOT NULL,
-            role TEXT NOT NULL DEFAULT 'student',
-            department TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    # Create Issues Table
-    db.execute('''
-        CREATE TABLE IF NOT EXISTS issues (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            description TEXT,
-            category TEXT NOT NULL,
-            location TEXT,
-            priority TEXT DEFAULT 'Low',
-            status TEXT DEFAULT 'Submitted',
-            image_path TEXT,
-            reporter_id INTEGER NOT NULL,
-            assigned_to TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            resolved_at TIMESTAMP,
-            FOREIGN KEY (reporter_id) REFERENCES users (id)
-        )
-    ''')
-
-    # Create Notifications Table
-    db.execute('''
-        CREATE TABLE IF NOT EXISTS notifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            issue_id INTEGER,
-            message TEXT NOT NULL,
-            is_read BOOLEAN DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (issue_id) REFERENCES issues (id)
-        )
-    ''')
-    
-    # Create Comments Table
-    db.execute('''
-        CREATE TABLE IF NOT EXISTS comments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            issue_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            content TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (issue_id) REFERENCES issues (id),
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
+def data_version(db, name):
+    """Return the change counter that triggers bump on every write to `name`.
+
+    Callers compare it with the value their cached results were built
+    from; it is shared by every process using the database.
+    """
+    row = db.execute("SELECT version FROM data_versions WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+def submit_write(fn):
+    """Queue fn(db) for the writer thread and return a Future for its result.
 
-    # Check/Add department column if missing (for migration)
+    fn runs on the writer's connection in another thread, so it must not
+    touch g, session or request; capture what it needs beforehand.
+    """
+    return get_writer().submit(fn, request.endpoint if has_request_context() else None)
+
+def run_write(fn):
+    """Run fn(db) inside a write transaction, commit it and return its result.
+
+    With DB_WRITER_THREAD (the default) the body is handed to the
+    group-committing writer thread. Otherwise it runs on the request's own
+    connection under BEGIN IMMEDIATE: taking the write lock up front means
+    SQLite never has to upgrade a reader mid-transaction, which is where
+    "database is locked" errors come from.
+    """
+    config = current_app.config
+    if config['DB_WRITER_THREAD']:
+        writer = get_writer()
+        if not writer.in_writer_thread:
+            future = writer.submit(fn, request.endpoint if has_request_context() else None)
+            try:
+                return future.result(timeout=config['DB_WRITE_TIMEOUT'])
+            finally:
+                # The body's statements count towards this request's queries
+                if has_request_context():
+                    g.setdefault('sql_queries', []).extend(future.sql_queries)
+
+    db = get_db()
+    begin_immediate(db, config['DB_WRITE_RETRIES'], config['DB_WRITE_RETRY_DELAY'])
     try:
-        db.execute("SELECT department FROM users LIMIT 1")
-    except sqlite3.OperationalError:
-        db.execute("ALTER TABLE users ADD COLUMN department TEXT")
+        result = fn(db)
+        db.execute("COMMIT")
+        return result
+    except BaseException:
+        if db.in_transaction:
+            db.execute("ROLLBACK")
+        raise
+
+def init_db():
+    from app.migrations import upgrade
+    upgrade()
+    run_write(_seed_accounts)
 
+def _seed_accounts(db):
     # Seed Admin
     cur = db.execute("SELECT id FROM users WHERE email = ?", ('admin@campus.edu',))
     if cur.fetchone() is None:
@@ -111,7 +389,13 @@ def init_db():
                 (name, email, generate_password_hash('staff123'), 'staff', dept)
             )
 
-    db.commit()
+@click.command('db-snapshot')
+def db_snapshot_command():
+    """Refresh the analytics snapshot now."""
+    if not current_app.config['ANALYTICS_SNAPSHOT_DIR']:
+        raise click.ClickException('ANALYTICS_SNAPSHOT_DIR is not configured.')
+    path = get_snapshot_manager().refresh()
+    click.echo(f'Wrote snapshot {path}')
 
 @click.command('init-db')
 def init_db_command():
@@ -120,5 +404,8 @@ def init_db_command():
     click.echo('Initialized the database.')
 
 def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(db_snapshot_command)
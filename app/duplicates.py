@@ -0,0 +1,256 @@
+import hashlib
+import os
+import re
+import struct
+import zlib
+from collections import namedtuple
+import click
+from flask import current_app
+from app import jobs
+from app.db import get_read_db, run_write
+from app.utils import CLOSED_STATUSES
+
+try:
+    from PIL import Image
+except ImportError:  # optional: without Pillow, photos are not compared
+    Image = None
+
+# Duplicate detection for new reports. Every open issue is indexed by a
+# MinHash signature over the character trigrams of its title and
+# description, cut into LSH bands: two texts share at least one band with a
+# probability that rises steeply with their Jaccard similarity, so looking
+# up a report's band keys finds its likely duplicates without comparing it
+# to every open issue. Band keys include the category and the normalized
+# location, so only reports of the same kind of problem in the same place
+# can match. With Pillow installed, photos also get a 64-bit difference
+# hash, compared by Hamming distance within the same category and location.
+#
+# Resolving or merging an issue takes it out of the band index; its
+# signature row stays behind so that reopening puts it straight back. New
+# reports are indexed by the 'index_issue' background job, so hashing a
+# large photo never holds up the report itself; for the second or so until
+# the job runs, a report is not yet offered as a duplicate.
+
+DEFAULT_SETTINGS = {
+    # Estimated Jaccard similarity of the texts at which an open issue is offered as a duplicate
+    'DUPLICATE_SIMILARITY': 0.4,
+    # Photos at most this many bits apart (of 64) show the same thing
+    'DUPLICATE_IMAGE_DISTANCE': 10,
+    'DUPLICATE_LIMIT': 5,
+}
+
+MERGED = 'Merged'
+
+SHINGLE_SIZE = 3
+BANDS = 32
+ROWS = 2
+PERMUTATIONS = BANDS * ROWS
+# Long descriptions add little beyond their opening; this bounds the hashing cost
+MAX_TEXT = 1000
+
+_PRIME = (1 << 61) - 1
+_SIGNATURE = struct.Struct(f'<{PERMUTATIONS}I')
+_NON_WORD_RE = re.compile(r'[\W_]+', re.UNICODE)
+
+Entry = namedtuple('Entry', 'bucket signature image_hash')
+
+
+def _seed(name, n):
+    digest = hashlib.blake2b(f'{name}{n}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % _PRIME
+
+# Signatures are stored, so the hash functions are derived, never randomly drawn
+_HASHES = [(_seed('a', n) or 1, _seed('b', n)) for n in range(PERMUTATIONS)]
+
+
+def normalize_text(text):
+    return _NON_WORD_RE.sub(' ', (text or '').lower()).strip()
+
+def normalize_location(location):
+    """'LH-1', 'lh 1' and 'LH1' are the same place."""
+    return _NON_WORD_RE.sub('', (location or '').lower())
+
+def bucket(category, location):
+    return f'{category}/{normalize_location(location)}'
+
+def signature(title, description):
+    text = normalize_text(f'{title} {description or ""}')[:MAX_TEXT]
+    shingles = {zlib.crc32(text[n:n + SHINGLE_SIZE].encode())
+                for n in range(max(len(text) - SHINGLE_SIZE + 1, 1))}
+    return [min((a * x + b) % _PRIME for x in shingles) & 0xFFFFFFFF for a, b in _HASHES]
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of the texts behind two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / PERMUTATIONS
+
+def band_keys(bucket, signature):
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(f'{bucket}\x1f{band}\x1f{rows}'.encode(), digest_size=8).digest()
+        keys.append(int.from_bytes(digest, 'big', signed=True))
+    return keys
+
+def image_hash(image):
+    """64-bit difference hash of an image path or file, or None without Pillow or for non-images."""
+    if Image is None:
+        return None
+    try:
+        with Image.open(image) as opened:
+            pixels = list(opened.convert('L').resize((9, 8)).getdata())
+    except (OSError, ValueError):
+        # PDFs and unreadable uploads are not compared
+        return None
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = bits << 1 | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    # Stored as a signed 64-bit SQLite integer
+    return bits - (1 << 64) if bits >= 1 << 63 else bits
+
+def hamming(a, b):
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count('1')
+
+def image_file(upload_folder, image_path):
+    """Where an issue's stored image_path ('uploads/<name>') lives on disk."""
+    return os.path.join(upload_folder, os.path.basename(image_path))
+
+def entry(category, location, title, description, image=None):
+    """Compute a report's index entry. This is the expensive part: do it before the write."""
+    return Entry(bucket(category, location), signature(title, description),
+                 image_hash(image) if image is not None else None)
+
+def is_open(issue):
+    return issue is not None and issue['status'] not in CLOSED_STATUSES
+
+
+def add(db, issue_id, entry):
+    """Index an open issue, in the write transaction that reports or reopens it."""
+    db.execute('''
+        INSERT OR REPLACE INTO issue_signatures (issue_id, bucket, signature, image_hash, open)
+        VALUES (?, ?, ?, ?, 1)
+    ''', (issue_id, entry.bucket, _SIGNATURE.pack(*entry.signature), entry.image_hash))
+    db.executemany("INSERT OR IGNORE INTO issue_lsh (band_key, issue_id) VALUES (?, ?)",
+                   [(key, issue_id) for key in band_keys(entry.bucket, entry.signature)])
+
+def _stored(db, issue_id):
+    row = db.execute("SELECT * FROM issue_signatures WHERE issue_id = ?", (issue_id,)).fetchone()
+    if row is None:
+        return None
+    return Entry(row['bucket'], list(_SIGNATURE.unpack(row['signature'])), row['image_hash'])
+
+def record_change(db, before, after):
+    """Take an updated issue out of the index when it closes and back in when it reopens.
+
+    Call inside the write transaction that changes the issue; new issues
+    are indexed with add().
+    """
+    if is_open(before) and not is_open(after):
+        stored = _stored(db, before['id'])
+        if stored is not None:
+            db.execute("UPDATE issue_signatures SET open = 0 WHERE issue_id = ?", (before['id'],))
+            db.executemany("DELETE FROM issue_lsh WHERE band_key = ? AND issue_id = ?",
+                           [(key, before['id']) for key in band_keys(stored.bucket, stored.signature)])
+    elif is_open(after) and not is_open(before):
+        # Issues closed before the index existed get a text-only entry
+        stored = _stored(db, after['id']) or entry(
+            after['category'], after['location'], after['title'], after['description'])
+        add(db, after['id'], stored)
+
+@jobs.handler('index_issue')
+def index_issue(issue_id):
+    """Index a newly reported issue, reading its photo from the upload folder."""
+    issue = get_read_db().execute("SELECT * FROM issues WHERE id = ?", (issue_id,)).fetchone()
+    if not is_open(issue):
+        return
+    image = None
+    if issue['image_path']:
+        path = image_file(current_app.config['UPLOAD_FOLDER'], issue['image_path'])
+        image = path if os.path.exists(path) else None
+    computed = entry(issue['category'], issue['location'], issue['title'], issue['description'], image)
+
+    def _add(db):
+        # Closed while queued: there was nothing yet for record_change() to take out
+        if is_open(db.execute("SELECT status FROM issues WHERE id = ?", (issue_id,)).fetchone()):
+            add(db, issue_id, computed)
+
+    run_write(_add)
+
+def find(db, entry, config, exclude=None):
+    """Open issues likely to duplicate `entry`, most similar first.
+
+    Returns up to DUPLICATE_LIMIT dicts of id, title, status, location,
+    created_at, votes, similarity (estimated Jaccard similarity of the
+    texts) and image_match.
+    """
+    keys = band_keys(entry.bucket, entry.signature)
+    candidates = {row['issue_id'] for row in db.execute(
+        f"SELECT DISTINCT issue_id FROM issue_lsh WHERE band_key IN ({', '.join('?' * len(keys))})", keys)}
+    image_matches = set()
+    if entry.image_hash is not None:
+        rows = db.execute('''
+            SELECT issue_id, image_hash FROM issue_signatures
+            WHERE bucket = ? AND open = 1 AND image_hash IS NOT NULL
+        ''', (entry.bucket,))
+        image_matches = {row['issue_id'] for row in rows
+                         if hamming(row['image_hash'], entry.image_hash) <= config['DUPLICATE_IMAGE_DISTANCE']}
+    candidates = (candidates | image_matches) - {exclude}
+    if not candidates:
+        return []
+
+    rows = db.execute(f'''
+        SELECT i.id, i.title, i.status, i.location, i.created_at, s.signature,
+               i.vote_count AS votes
+        FROM issue_signatures s JOIN issues i ON i.id = s.issue_id
+        WHERE s.issue_id IN ({', '.join('?' * len(candidates))}) AND s.open = 1
+    ''', list(candidates))
+    matches = []
+    for row in rows:
+        score = similarity(entry.signature, _SIGNATURE.unpack(row['signature']))
+        if score >= config['DUPLICATE_SIMILARITY'] or row['id'] in image_matches:
+            match = {key: row[key] for key in ('id', 'title', 'status', 'location', 'created_at', 'votes')}
+            match.update(similarity=round(score, 2), image_match=row['id'] in image_matches)
+            matches.append(match)
+    matches.sort(key=lambda match: (match['similarity'], match['image_match'], match['votes']), reverse=True)
+    return matches[:config['DUPLICATE_LIMIT']]
+
+def similar(db, issue_id, config):
+    """Open issues likely to duplicate an indexed open issue, for admins deciding on a merge."""
+    stored = db.execute("SELECT open FROM issue_signatures WHERE issue_id = ?", (issue_id,)).fetchone()
+    if stored is None or not stored['open']:
+        return []
+    return find(db, _stored(db, issue_id), config, exclude=issue_id)
+
+def rebuild(db, upload_folder=None):
+    """Re-index every open issue in the caller's transaction.
+
+    Photos are hashed only when upload_folder is given. Returns the number
+    of issues indexed.
+    """
+    db.execute("DELETE FROM issue_lsh")
+    db.execute("DELETE FROM issue_signatures")
+    issues = db.execute(f'''
+        SELECT id, category, location, title, description, image_path FROM issues
+        WHERE status NOT IN ({', '.join('?' * len(CLOSED_STATUSES))})
+    ''', CLOSED_STATUSES).fetchall()
+    for issue in issues:
+        image = None
+        if upload_folder and issue['image_path']:
+            path = image_file(upload_folder, issue['image_path'])
+            image = path if os.path.exists(path) else None
+        add(db, issue['id'], entry(issue['category'], issue['location'], issue['title'],
+                                   issue['description'], image))
+    return len(issues)
+
+
+@click.command('duplicates-rebuild')
+def duplicates_rebuild_command():
+    """Rebuild the duplicate-detection index over open issues, hashing their photos."""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    count = run_write(lambda db: rebuild(db, upload_folder))
+    click.echo(f'Indexed {count} open issues.')
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+    app.cli.add_command(duplicates_rebuild_command)
@@ -0,0 +1,142 @@
+import click
+from app.db import get_read_db, run_write
+
+# Append-only issue history. Every change to an issue's lifecycle is one
+# issue_events row written in the same transaction as the change itself:
+# a small code plus an optional value (the new status, or the assignee's
+# user id) and the acting user. Rows are never updated or deleted, and
+# because every write goes through the single writer, ids are handed out
+# in commit order - a consumer that remembers the last id it processed can
+# resume from there and will never miss an event.
+
+REPORTED = 'reported'
+STATUS = 'status'
+ASSIGNED = 'assigned'
+COMMENT = 'comment'
+ESCALATED = 'escalated'
+# On the duplicate (value: canonical issue id) and on the canonical issue (value: duplicate id)
+MERGED = 'merged'
+DUPLICATE = 'duplicate'
+
+REPLAY_BATCH = 500
+MAX_REPLAY_BATCH = 5000
+
+
+def record(db, issue_id, code, value=None, actor_id=None):
+    db.execute(
+        'INSERT INTO issue_events (issue_id, code, value, actor_id) VALUES (?, ?, ?, ?)',
+        (issue_id, code, value, actor_id)
+    )
+
+def record_many(db, rows):
+    """Append (issue_id, code, value, actor_id, created_at) rows in order, for bulk imports."""
+    db.executemany(
+        'INSERT INTO issue_events (issue_id, code, value, actor_id, created_at) VALUES (?, ?, ?, ?, ?)', rows
+    )
+
+def timeline(db, issue_id):
+    """Return an issue's events, oldest first, labelled for display.
+
+    Each item is a dict of the event row plus actor_name, actor_role,
+    assignee_name and a label; the first event by anyone but the reporter is marked as the
+    acknowledgement.
+    """
+    rows = db.execute('''
+        SELECT e.*, u.fullname AS actor_name, u.role AS actor_role, i.reporter_id,
+               coalesce(a.fullname, e.value) AS assignee_name
+        FROM issue_events e
+        JOIN issues i ON i.id = e.issue_id
+        LEFT JOIN users u ON u.id = e.actor_id
+        LEFT JOIN users a ON e.code = 'assigned' AND a.id = e.value
+        WHERE e.issue_id = ?
+        ORDER BY e.id
+    ''', (issue_id,)).fetchall()
+
+    items = []
+    acknowledged = False
+    assignee = None
+    status = 'Submitted'
+    for row in rows:
+        item = dict(row, acknowledgement=False)
+        if row['code'] == REPORTED:
+            item['label'] = 'Issue Submitted'
+        elif row['code'] == STATUS:
+            if row['value'] == 'Resolved':
+                item['label'] = 'Resolved'
+            elif row['value'] == 'In Progress':
+                item['label'] = 'Work Started'
+            elif status in ('Resolved', 'Merged'):
+                item['label'] = 'Reopened'
+            else:
+                item['label'] = f"Status set to {row['value']}"
+            status = row['value']
+        elif row['code'] == ASSIGNED:
+            item['label'] = f"{'Reassigned' if assignee else 'Assigned'} to {row['assignee_name']}"
+            assignee = row['value']
+        elif row['code'] == ESCALATED:
+            item['label'] = f"Escalated to {row['value']} priority (SLA missed)"
+        elif row['code'] == MERGED:
+            item['label'] = f"Merged into Issue #CMP-{row['value']}"
+            status = 'Merged'
+        elif row['code'] == DUPLICATE:
+            item['label'] = f"Duplicate #CMP-{row['value']} merged in"
+        else:
+            item['label'] = 'Staff responded'
+        if not acknowledged and row['actor_id'] is not None and row['actor_id'] != row['reporter_id']:
+            item['acknowledgement'] = acknowledged = True
+        items.append(item)
+    return items
+
+def replay(db, after=0, limit=REPLAY_BATCH):
+    """Return up to `limit` events with ids above `after`, in commit order."""
+    return db.execute(
+        "SELECT * FROM issue_events WHERE id > ? ORDER BY id LIMIT ?", (after, limit)
+    ).fetchall()
+
+def offset(db, consumer):
+    row = db.execute("SELECT position FROM event_offsets WHERE consumer = ?", (consumer,)).fetchone()
+    return row['position'] if row else 0
+
+def save_offset(db, consumer, position):
+    db.execute('''
+        INSERT INTO event_offsets (consumer, position) VALUES (?, ?)
+        ON CONFLICT (consumer) DO UPDATE SET position = MAX(position, excluded.position)
+    ''', (consumer, position))
+
+def consume(consumer, handler, batch_size=REPLAY_BATCH, max_batches=None):
+    """Feed events past `consumer`'s stored offset to handler(db, events).
+
+    Each batch is read, handled and the offset advanced in one write
+    transaction, so whatever the handler writes commits together with the
+    offset and a crash never applies a batch twice. Returns the number of
+    events handled.
+    """
+    def _batch(db):
+        events = replay(db, offset(db, consumer), batch_size)
+        if events:
+            handler(db, events)
+            save_offset(db, consumer, events[-1]['id'])
+        return len(events)
+
+    handled = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        count = run_write(_batch)
+        handled += count
+        batches += 1
+        if count < batch_size:
+            break
+    return handled
+
+
+@click.command('events-status')
+def events_status_command():
+    """Show how far each event consumer has read."""
+    db = get_read_db()
+    latest = db.execute("SELECT COALESCE(MAX(id), 0) FROM issue_events").fetchone()[0]
+    click.echo(f'Latest event id: {latest}')
+    for row in db.execute("SELECT consumer, position FROM event_offsets ORDER BY consumer"):
+        click.echo(f"{row['consumer']}: {row['position']} ({latest - row['position']} behind)")
+
+def init_app(app):
+    app.cli.add_command(events_status_command)
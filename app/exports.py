@@ -0,0 +1,162 @@
+import csv
+import io
+import json
+import zlib
+from datetime import date
+import click
+from app import rollups
+from app.db import get_read_pool
+from app.search import match_expression
+
+# Streaming export of issues as CSV or NDJSON. Rows are read from a
+# dedicated read-only connection with fetchmany() and each batch is
+# encoded (and optionally gzipped) into one chunk before the next is
+# fetched, so memory use is bounded by the batch size however many issues
+# match. The export reads one consistent snapshot of the database.
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+BATCH_SIZE = 1000
+
+COLUMNS = ('id', 'title', 'description', 'category', 'location', 'priority', 'status', 'reporter',
+           'reporter_email', 'assignee', 'vote_count', 'merged_into', 'created_at', 'acknowledged_at',
+           'resolved_at')
+
+_SELECT = '''
+    SELECT i.id, i.title, i.description, i.category, i.location, i.priority, i.status,
+           r.fullname AS reporter, r.email AS reporter_email, a.fullname AS assignee,
+           i.vote_count, i.merged_into, i.created_at, i.acknowledged_at, i.resolved_at
+    FROM issues i
+    JOIN users r ON r.id = i.reporter_id
+    LEFT JOIN users a ON a.id = i.assignee_id
+'''
+
+# Spreadsheets run cells starting with these as formulas
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def parse_filters(args):
+    """Read the admin dashboard filters (status, category, q) plus since/until IST dates.
+
+    Raises ValueError for malformed dates.
+    """
+    filters = {name: args[name] for name in ('status', 'category') if args.get(name)}
+    if args.get('q', '').strip():
+        filters['q'] = args['q'].strip()
+    for name in ('since', 'until'):
+        if args.get(name):
+            value = args[name]
+            filters[name] = value if isinstance(value, date) else date.fromisoformat(value)
+    return filters
+
+def query(filters):
+    """SQL and parameters selecting the filtered issues, oldest first."""
+    where = []
+    params = []
+    for name in ('status', 'category'):
+        if filters.get(name):
+            where.append(f"i.{name} = ?")
+            params.append(filters[name])
+    expression = match_expression(filters.get('q'))
+    if expression:
+        where.append("i.id IN (SELECT rowid FROM issues_fts WHERE issues_fts MATCH ?)")
+        params.append(expression)
+    if filters.get('since'):
+        where.append("i.created_at >= ?")
+        params.append(rollups.utc_bounds(filters['since'], filters['since'])[0])
+    if filters.get('until'):
+        where.append("i.created_at < ?")
+        params.append(rollups.utc_bounds(filters['until'], filters['until'])[1])
+    sql = _SELECT
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    # Every created_at index already holds this order, so only full-text matches ever get sorted
+    return sql + " ORDER BY i.created_at, i.id", params
+
+def _csv_cell(value):
+    """CSV cell for value: text starting with = + - @ tab or CR gets a leading ' so spreadsheets show it as text."""
+    if value is None:
+        return ''
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def _encode_csv(rows, header):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(COLUMNS)
+    writer.writerows([_csv_cell(value) for value in row] for row in rows)
+    return buffer.getvalue()
+
+def _encode_ndjson(rows, header):
+    return ''.join(json.dumps(dict(zip(COLUMNS, row)), default=str, ensure_ascii=False) + '\n'
+                   for row in rows)
+
+def stream(pool, filters, fmt='csv', compress=False, batch_size=BATCH_SIZE):
+    """Yield the export as bytes chunks, one per batch of rows.
+
+    `pool` is the read pool to open the export's own connection from, so a
+    long export does not hold one of the request connections.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    encode = _encode_csv if fmt == 'csv' else _encode_ndjson
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    sql, params = query(filters)
+
+    conn = pool.connect()
+    try:
+        cursor = conn.execute(sql, params)
+        header = True
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            chunk = encode(rows, header).encode()
+            header = False
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+            if len(rows) < batch_size:
+                break
+        if compressor:
+            yield compressor.flush()
+    finally:
+        conn.close()
+
+def filename(fmt, compress=False):
+    return f"issues-{rollups.today_ist().isoformat()}.{FORMATS[fmt][1]}{'.gz' if compress else ''}"
+
+
+@click.command('export-issues')
+@click.option('--format', 'fmt', type=click.Choice(list(FORMATS)), default='csv', show_default=True)
+@click.option('--status', default=None, help='Only issues with this status.')
+@click.option('--category', default=None, help='Only issues in this category.')
+@click.option('-q', '--query', 'q', default=None, help='Only issues matching this full-text search.')
+@click.option('--since', type=click.DateTime(['%Y-%m-%d']), default=None, help='First IST day reported.')
+@click.option('--until', type=click.DateTime(['%Y-%m-%d']), default=None, help='Last IST day reported.')
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip.')
+@click.option('-o', '--output', type=click.Path(dir_okay=False, writable=True), default=None,
+              help='Write to this file instead of standard output.')
+def export_issues_command(fmt, status, category, q, since, until, compress, output):
+    """Export issues as CSV or NDJSON, streaming in constant memory.
+
+    CSV cells starting with = + - @ are prefixed with ' so spreadsheets do
+    not run them as formulas; import-issues strips the prefix again.
+    """
+    filters = parse_filters({'status': status, 'category': category, 'q': q or '',
+                             'since': since and since.date(), 'until': until and until.date()})
+    out = open(output, 'wb') if output else click.get_binary_stream('stdout')
+    try:
+        for chunk in stream(get_read_pool(), filters, fmt, compress):
+            out.write(chunk)
+    finally:
+        if output:
+            out.close()
+        else:
+            out.flush()
+
+def init_app(app):
+    app.cli.add_command(export_issues_command)
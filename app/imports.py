@@ -0,0 +1,305 @@
+import csv
+import gzip
+import os
+from datetime import datetime, timezone
+import click
+from flask import current_app
+from app import counters, duplicates, events, notifications, sketches
+from app.db import get_read_db, run_write
+from app.exports import _FORMULA_PREFIXES
+
+# Bulk import of historical issues from CSV, for moving over from the old
+# helpdesk spreadsheet or another campus. The file is parsed as a stream
+# and committed in batches of IMPORT_BATCH_SIZE rows: each batch is one
+# write transaction that inserts its issues with executemany, appends their
+# events, adjusts the counters, sketches and duplicate index, and advances
+# the job's checkpoint in import_jobs. Running an interrupted import again
+# under the same job name skips the rows its committed batches covered.
+# Reporters and staff are resolved through lookups cached for the whole
+# import, so a reporter with a thousand issues costs one query.
+#
+# Imported issues are history: nothing is broadcast per issue, and admins
+# get one notification when the import finishes. Search, rollups and the
+# data versions follow from their triggers as for any other insert.
+#
+# The columns are those of export-issues; title, category and
+# reporter_email are required and unknown columns are ignored. The ' the
+# export puts before cells that look like formulas is taken off again.
+
+DEFAULT_SETTINGS = {
+    'IMPORT_BATCH_SIZE': 1000,
+    # The admin upload may be far larger than MAX_CONTENT_LENGTH allows a photo
+    'IMPORT_MAX_CONTENT_LENGTH': 256 * 1024 * 1024,
+}
+
+REQUIRED_COLUMNS = ('title', 'category', 'reporter_email')
+STATUSES = ('Submitted', 'In Progress', 'Resolved')
+PRIORITIES = ('Low', 'Medium', 'High')
+RUNNING = 'running'
+DONE = 'done'
+# Problems reported back in full; the rest are only counted
+MAX_ERRORS = 20
+# No password hash matches this, so accounts created for reporters cannot log in
+LOCKED_PASSWORD = '!'
+_LOOKUP_CHUNK = 500
+
+_INSERT = '''
+    INSERT INTO issues (title, description, category, location, priority, status, reporter_id,
+                        assignee_id, created_at, acknowledged_at, resolved_at)
+    VALUES (:title, :description, :category, :location, :priority, :status, :reporter_id,
+            :assignee_id, :created_at, :acknowledged_at, :resolved_at)
+'''
+
+_CHECKPOINT = '''
+    INSERT INTO import_jobs (name, rows_read, imported, rejected, status) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (name) DO UPDATE SET
+        rows_read = excluded.rows_read, imported = excluded.imported, rejected = excluded.rejected,
+        status = excluded.status, updated_at = CURRENT_TIMESTAMP
+'''
+
+
+def parse_timestamp(value):
+    """Stored-format UTC text for an ISO 8601 timestamp (offsets are converted), or None if blank."""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+def _unescape(value):
+    """Undo the export's formula escaping: '=SUM(A1) back to =SUM(A1), other text unchanged."""
+    if value.startswith("'") and value[1:].startswith(_FORMULA_PREFIXES):
+        return value[1:]
+    return value
+
+def parse_row(row, now):
+    """Validate one CSV row (stripped values by lower-case column) into an issue dict.
+
+    User ids are filled in later. Raises ValueError saying what is wrong.
+    """
+    row = {column: _unescape(value) for column, value in row.items()}
+    for column in REQUIRED_COLUMNS:
+        if not row.get(column):
+            raise ValueError(f'missing {column}')
+    status = row.get('status') or 'Submitted'
+    if status == duplicates.MERGED:
+        # The id of the issue it was merged into means nothing here
+        status = 'Resolved'
+    if status not in STATUSES:
+        raise ValueError(f'unknown status {status!r}')
+    priority = row.get('priority') or 'Low'
+    if priority not in PRIORITIES:
+        raise ValueError(f'unknown priority {priority!r}')
+
+    times = {}
+    for column in ('created_at', 'acknowledged_at', 'resolved_at'):
+        try:
+            times[column] = parse_timestamp(row.get(column))
+        except ValueError:
+            raise ValueError(f'{column} {row[column]!r} is not an ISO 8601 timestamp') from None
+    created_at = times['created_at'] or now
+    acknowledged_at = times['acknowledged_at']
+    if acknowledged_at is None and status != 'Submitted':
+        # As for issues that predate acknowledgement times (migration 11)
+        acknowledged_at = created_at
+    return {
+        'title': row['title'], 'description': row.get('description') or None, 'category': row['category'],
+        'location': row.get('location') or None, 'priority': priority, 'status': status,
+        'reporter_email': row['reporter_email'], 'reporter': row.get('reporter') or None,
+        'assignee': row.get('assignee') or None, 'reporter_id': None, 'assignee_id': None,
+        'created_at': created_at, 'acknowledged_at': acknowledged_at,
+        'resolved_at': times['resolved_at'] if status == 'Resolved' else None,
+    }
+
+def _rows(reader, header):
+    """The reader's rows with lower-cased column names and stripped values."""
+    columns = [column.strip().lower() for column in header]
+    for values in reader:
+        yield {column: (value or '').strip() for column, value in zip(columns, values)}
+
+def lookup_users(db, emails):
+    """{email: id} for the accounts among `emails`, in a few IN queries."""
+    emails = list(emails)
+    found = {}
+    for start in range(0, len(emails), _LOOKUP_CHUNK):
+        chunk = emails[start:start + _LOOKUP_CHUNK]
+        rows = db.execute(f"SELECT id, email FROM users WHERE email IN ({', '.join('?' * len(chunk))})", chunk)
+        found.update((row['email'], row['id']) for row in rows)
+    return found
+
+def staff_lookup(db):
+    """Staff ids by email and by lower-cased full name, the two ways an assignee is written."""
+    staff = {}
+    for row in db.execute("SELECT id, fullname, email FROM users WHERE role = 'staff'"):
+        staff[row['email'].lower()] = row['id']
+        staff.setdefault(row['fullname'].lower(), row['id'])
+    return staff
+
+def _sequence(db):
+    row = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'issues'").fetchone()
+    return row['seq'] if row else 0
+
+def _create_reporters(db, reporters):
+    """Create locked student accounts for {email: fullname}; returns {email: id}."""
+    db.executemany(
+        "INSERT OR IGNORE INTO users (fullname, email, password_hash, role) VALUES (?, ?, ?, 'student')",
+        [(fullname, email, LOCKED_PASSWORD) for email, fullname in reporters.items()])
+    return lookup_users(db, reporters)
+
+def write_batch(db, issues, entries, new_reporters, checkpoint):
+    """Insert one batch of parsed issues and advance the job's checkpoint, in the caller's transaction.
+
+    `entries` are the duplicate-index entries of the open issues by
+    position in `issues`; `checkpoint` is the import_jobs row as it stands
+    after this batch. Returns {email: id} of the reporters created.
+    """
+    created = _create_reporters(db, new_reporters) if new_reporters else {}
+    for issue in issues:
+        if issue['reporter_id'] is None:
+            issue['reporter_id'] = created[issue['reporter_email']]
+
+    # Nothing else writes inside this transaction, so AUTOINCREMENT hands
+    # the batch consecutive ids in row order
+    first = _sequence(db) + 1
+    db.executemany(_INSERT, issues)
+    if issues and _sequence(db) != first + len(issues) - 1:
+        raise RuntimeError('Imported issues were not given consecutive ids')
+
+    history = []
+    for issue_id, issue in enumerate(issues, first):
+        issue['id'] = issue_id
+        # Only the report and resolution times are known, as for migrated issues (migration 8)
+        history.append((issue_id, events.REPORTED, None, issue['reporter_id'], issue['created_at']))
+        if issue['assignee_id']:
+            history.append((issue_id, events.ASSIGNED, str(issue['assignee_id']), None, None))
+        if issue['status'] != 'Submitted':
+            history.append((issue_id, events.STATUS, issue['status'], None, issue['resolved_at']))
+    events.record_many(db, history)
+    for position, entry in entries.items():
+        duplicates.add(db, issues[position]['id'], entry)
+    counters.record_changes(db, [(None, issue) for issue in issues])
+    sketches.record_changes(db, [(None, issue) for issue in issues])
+    db.execute(_CHECKPOINT, checkpoint)
+    return created
+
+def finish(db, name, summary):
+    """Mark the job done and tell admins what it brought in."""
+    db.execute(_CHECKPOINT, (name, summary['rows_read'], summary['imported'], summary['rejected'], DONE))
+    if summary['imported']:
+        notifications.notify(db, 'role', 'admin', None, 'issues_imported', count=summary['imported'], source=name)
+
+def import_issues(lines, name, config, create_reporters=False, batch_size=None, on_batch=None):
+    """Import issues from CSV text as job `name`, resuming after its last committed batch.
+
+    `lines` is any iterable of CSV lines, read once. Rows whose reporter
+    has no account are rejected unless create_reporters is set; unknown
+    assignees are imported unassigned. on_batch(summary) is called after
+    each commit. Returns a summary dict of rows_read, imported, rejected,
+    skipped (rows committed by an earlier run) and errors, up to MAX_ERRORS
+    (line, message) pairs. Raises ValueError if the job already finished
+    or the header lacks a required column.
+    """
+    batch_size = batch_size or config['IMPORT_BATCH_SIZE']
+    db = get_read_db()
+    job = db.execute("SELECT * FROM import_jobs WHERE name = ?", (name,)).fetchone()
+    if job is not None and job['status'] == DONE:
+        raise ValueError(f'Import {name!r} already finished; import under another name to load the file again.')
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if not header:
+        raise ValueError('The file is empty.')
+    missing = [column for column in REQUIRED_COLUMNS if column not in {found.strip().lower() for found in header}]
+    if missing:
+        raise ValueError(f"Missing column{'s' if len(missing) > 1 else ''}: {', '.join(missing)}")
+
+    skip = job['rows_read'] if job else 0
+    summary = {'rows_read': skip, 'imported': job['imported'] if job else 0,
+               'rejected': job['rejected'] if job else 0, 'skipped': skip, 'errors': []}
+    staff = staff_lookup(db)
+    reporters = {}
+    now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+    def _problem(line, message):
+        if len(summary['errors']) < MAX_ERRORS:
+            summary['errors'].append((line, message))
+
+    def _flush(batch, read):
+        unknown = {issue['reporter_email'] for _, issue in batch} - reporters.keys()
+        if unknown:
+            reporters.update(lookup_users(get_read_db(), unknown))
+        issues = []
+        new_reporters = {}
+        for line, issue in batch:
+            issue['reporter_id'] = reporters.get(issue['reporter_email'])
+            if issue['reporter_id'] is None:
+                if not create_reporters:
+                    summary['rejected'] += 1
+                    _problem(line, f"no account for reporter {issue['reporter_email']}")
+                    continue
+                new_reporters.setdefault(issue['reporter_email'],
+                                         issue['reporter'] or issue['reporter_email'].split('@')[0])
+            if issue['assignee']:
+                issue['assignee_id'] = staff.get(issue['assignee'].lower())
+                if issue['assignee_id'] is None:
+                    _problem(line, f"no staff member {issue['assignee']!r}; imported unassigned")
+            issues.append(issue)
+        # Signatures are the costly part of indexing, so they are computed outside the write
+        entries = {position: duplicates.entry(issue['category'], issue['location'], issue['title'],
+                                              issue['description'])
+                   for position, issue in enumerate(issues) if duplicates.is_open(issue)}
+        checkpoint = (name, read, summary['imported'] + len(issues), summary['rejected'], RUNNING)
+        reporters.update(run_write(lambda db: write_batch(db, issues, entries, new_reporters, checkpoint)))
+        summary.update(rows_read=read, imported=checkpoint[2])
+        if on_batch:
+            on_batch(summary)
+
+    batch = []
+    read = 0
+    for row in _rows(reader, header):
+        read += 1
+        if read <= skip:
+            continue
+        try:
+            batch.append((reader.line_num, parse_row(row, now)))
+        except ValueError as error:
+            summary['rejected'] += 1
+            _problem(reader.line_num, str(error))
+        if read - summary['rows_read'] >= batch_size:
+            _flush(batch, read)
+            batch = []
+    if read > summary['rows_read']:
+        _flush(batch, read)
+    run_write(lambda db: finish(db, name, summary))
+    return summary
+
+
+@click.command('import-issues')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--name', default=None, help='Job name to checkpoint under and resume (default: the file name).')
+@click.option('--batch-size', type=click.IntRange(1), default=None,
+              help='Rows per transaction (default: IMPORT_BATCH_SIZE).')
+@click.option('--create-reporters', is_flag=True,
+              help='Create locked student accounts for reporters without one, instead of rejecting their rows.')
+def import_issues_command(path, name, batch_size, create_reporters):
+    """Import historical issues from a CSV file (optionally gzipped) in resumable batches."""
+    name = name or os.path.basename(path)
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8-sig', newline='') as lines:
+        try:
+            summary = import_issues(
+                lines, name, current_app.config, create_reporters, batch_size,
+                on_batch=lambda summary: click.echo(f"{summary['rows_read']:,} rows read, "
+                                                    f"{summary['imported']:,} imported", err=True))
+        except ValueError as error:
+            raise click.ClickException(str(error))
+    if summary['skipped']:
+        click.echo(f"Resumed after {summary['skipped']:,} rows committed earlier.")
+    click.echo(f"Imported {summary['imported']:,} issues; rejected {summary['rejected']:,} rows.")
+    for line, message in summary['errors']:
+        click.echo(f'  line {line}: {message}')
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+    app.cli.add_command(import_issues_command)
@@ -0,0 +1,246 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+import click
+from flask import current_app
+from app import leases
+from app.db import _extension, get_read_db, run_write
+
+logger = logging.getLogger(__name__)
+
+# Durable background jobs. Slow side effects of a request are queued as
+# rows in the jobs table, in the same write transaction as the change that
+# causes them, so a job exists exactly when its change committed and
+# survives restarts. Worker threads claim the most urgent due job (highest
+# priority, then oldest run_at) by marking it running until now +
+# JOBS_VISIBILITY_TIMEOUT; a job whose worker died or outran that timeout
+# is taken back and run again, so handlers must be safe to repeat. A
+# failed job is retried after an exponential, jittered backoff, and after
+# its last attempt it is left in the table as 'dead' for `flask jobs` to
+# show and `flask jobs-retry` to requeue. Successful jobs are deleted.
+#
+# Each web process runs JOBS_WORKER_THREADS workers, started by its first
+# request, and routes call wake() after committing to have one pick the
+# job up at once. Set it to 0 and run `flask worker` to keep jobs out of
+# the web processes; idle workers then find new jobs within
+# JOBS_POLL_INTERVAL, checking on a read-only connection so that an empty
+# queue costs no write transactions.
+
+DEFAULT_SETTINGS = {
+    'JOBS_WORKER_THREADS': 2,
+    'JOBS_POLL_INTERVAL': 1.0,
+    'JOBS_VISIBILITY_TIMEOUT': 300,
+    # Seconds before the first retry, doubling with every further attempt up to JOBS_RETRY_MAX
+    'JOBS_RETRY_DELAY': 10,
+    'JOBS_RETRY_MAX': 3600,
+}
+
+HIGH = 10
+NORMAL = 0
+LOW = -10
+
+MAX_ATTEMPTS = 5
+
+_HANDLERS = {}
+
+
+def handler(name):
+    """Register the decorated function to run jobs called `name`, with the job's payload as keyword arguments."""
+    def register(fn):
+        _HANDLERS[name] = fn
+        return fn
+    return register
+
+def enqueue(db, name, payload=None, priority=NORMAL, delay=0, max_attempts=MAX_ATTEMPTS):
+    """Queue a job in the caller's write transaction; workers see it once that commits.
+
+    Call wake() after the commit. Returns the job id.
+    """
+    cur = db.execute('''
+        INSERT INTO jobs (name, payload, priority, max_attempts, run_at) VALUES (?, ?, ?, ?, ?)
+    ''', (name, json.dumps(payload or {}, separators=(',', ':')), priority, max_attempts, time.time() + delay))
+    return cur.lastrowid
+
+def wake():
+    """Tell this process's workers a job was just committed."""
+    get_worker().wake()
+
+def retry_delay(attempts, config):
+    """Seconds to wait after a job's attempts-th failure: exponential, capped and jittered."""
+    delay = min(config['JOBS_RETRY_DELAY'] * 2 ** (attempts - 1), config['JOBS_RETRY_MAX'])
+    # Jobs that failed together should not all come back together
+    return delay * random.uniform(0.5, 1.0)
+
+
+def is_due(db, now):
+    """True if a job is ready to claim, checked without taking the write lock."""
+    return db.execute('''
+        SELECT EXISTS (SELECT 1 FROM jobs WHERE status = 'queued' AND run_at <= ?)
+            OR EXISTS (SELECT 1 FROM jobs WHERE status = 'running' AND locked_until <= ?)
+    ''', (now, now)).fetchone()[0]
+
+def claim(db, holder, now, visibility_timeout):
+    """Take back expired jobs, then mark the most urgent due job running for `holder`.
+
+    Returns the job row, or None if nothing is due.
+    """
+    db.execute('''
+        UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END,
+                        last_error = 'Visibility timeout expired', locked_by = NULL, locked_until = NULL
+        WHERE status = 'running' AND locked_until <= ?
+    ''', (now,))
+    rows = db.execute('''
+        UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_by = ?, locked_until = ?
+        WHERE id = (SELECT id FROM jobs WHERE status = 'queued' AND run_at <= ?
+                    ORDER BY priority DESC, run_at LIMIT 1)
+        RETURNING id, name, payload, attempts, max_attempts
+    ''', (holder, now + visibility_timeout, now)).fetchall()
+    return rows[0] if rows else None
+
+def complete(db, job_id, holder):
+    # Only while still ours: a job taken back after its timeout belongs to another worker now
+    db.execute("DELETE FROM jobs WHERE id = ? AND locked_by = ?", (job_id, holder))
+
+def fail(db, job_id, holder, error, run_at):
+    """Requeue a failed job to run at run_at, or mark it dead after its last attempt."""
+    db.execute('''
+        UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END,
+                        run_at = ?, last_error = ?, locked_by = NULL, locked_until = NULL
+        WHERE id = ? AND locked_by = ?
+    ''', (run_at, error, job_id, holder))
+
+def run_next(holder):
+    """Claim the next due job and run it. Returns False if no job was due."""
+    config = current_app.config
+    if not is_due(get_read_db(), time.time()):
+        return False
+    job = run_write(lambda db: claim(db, holder, time.time(), config['JOBS_VISIBILITY_TIMEOUT']))
+    if job is None:
+        # Another worker got there first
+        return False
+
+    try:
+        if job['name'] not in _HANDLERS:
+            raise LookupError(f"No handler for job {job['name']!r}")
+        _HANDLERS[job['name']](**json.loads(job['payload']))
+    except Exception as error:
+        logger.exception('Job %s (%s) failed on attempt %s of %s',
+                         job['id'], job['name'], job['attempts'], job['max_attempts'])
+        run_at = time.time() + retry_delay(job['attempts'], config)
+        run_write(lambda db: fail(db, job['id'], holder, f'{type(error).__name__}: {error}', run_at))
+    else:
+        run_write(lambda db: complete(db, job['id'], holder))
+    return True
+
+
+class Worker:
+    """This process's pool of job worker threads.
+
+    Embedded in each web process, started by its first request, or run on
+    its own by `flask worker`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def ensure_started(self, threads=None):
+        if self._threads and self._pid == os.getpid():
+            return
+        with self._lock:
+            if not self._threads or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._stopping.clear()
+                self._threads = [threading.Thread(target=self._run, name=f'job-worker-{n}', daemon=True)
+                                 for n in range(threads or self.app.config['JOBS_WORKER_THREADS'])]
+                for thread in self._threads:
+                    thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        """Stop taking jobs and wait for the ones running to finish."""
+        self._stopping.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        holder = f'{leases.holder_id()}:{threading.current_thread().name}'
+        while not self._stopping.is_set():
+            ran = False
+            try:
+                with self.app.app_context():
+                    ran = run_next(holder)
+            except Exception:
+                logger.exception('Job worker failed')
+            if not ran:
+                self._wake.wait(self.app.config['JOBS_POLL_INTERVAL'])
+                self._wake.clear()
+
+
+def get_worker(app=None):
+    # Worker threads outlive the request, so they keep the app itself rather than the proxy
+    return _extension('smartcampus_job_worker', Worker, app or current_app._get_current_object())
+
+
+@click.command('worker')
+@click.option('--threads', type=click.IntRange(min=1), default=None,
+              help='Worker threads [default: JOBS_WORKER_THREADS, at least 1].')
+def worker_command(threads):
+    """Run queued background jobs until interrupted."""
+    threads = threads or max(current_app.config['JOBS_WORKER_THREADS'], 1)
+    worker = get_worker()
+    worker.ensure_started(threads)
+    click.echo(f'Running jobs with {threads} threads. Press Ctrl+C to stop.')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        click.echo('Finishing running jobs...')
+        worker.stop(current_app.config['JOBS_VISIBILITY_TIMEOUT'])
+
+@click.command('jobs')
+def jobs_command():
+    """Show queued, running and dead jobs, with the errors that killed the dead ones."""
+    db = get_read_db()
+    rows = db.execute("SELECT name, status, COUNT(*) AS jobs FROM jobs GROUP BY name, status ORDER BY name, status")
+    counts = [f"{row['name']:<24} {row['status']:<8} {row['jobs']}" for row in rows]
+    click.echo('\n'.join(counts) if counts else 'No jobs queued.')
+    for row in db.execute("SELECT id, name, attempts, last_error FROM jobs WHERE status = 'dead' ORDER BY id"):
+        click.echo(f"dead #{row['id']} {row['name']} after {row['attempts']} attempts: {row['last_error']}")
+
+@click.command('jobs-retry')
+@click.argument('job_ids', nargs=-1, type=int)
+def jobs_retry_command(job_ids):
+    """Requeue dead jobs (all of them, or the JOB_IDS given) for a fresh set of attempts."""
+    def _retry(db):
+        sql = "UPDATE jobs SET status = 'queued', attempts = 0, run_at = ? WHERE status = 'dead'"
+        params = [time.time()]
+        if job_ids:
+            sql += f" AND id IN ({', '.join('?' * len(job_ids))})"
+            params.extend(job_ids)
+        return db.execute(sql, params).rowcount
+
+    click.echo(f'Requeued {run_write(_retry)} dead jobs.')
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+    app.cli.add_command(worker_command)
+    app.cli.add_command(jobs_command)
+    app.cli.add_command(jobs_retry_command)
+
+    @app.before_request
+    def _start_workers():
+        if app.config['JOBS_WORKER_THREADS']:
+            get_worker(app).ensure_started()
@@ -0,0 +1,31 @@
+import os
+import socket
+import time
+import uuid
+
+# Named, expiring leases stored in the database. Every worker process may
+# try to take a lease; exactly one holds it at a time, and if the holder
+# dies the lease lapses after its ttl and another process takes over.
+# Acquire and renew inside the same write transaction as the work the
+# lease protects, so a holder whose lease has lapsed never commits it.
+
+_TOKEN = uuid.uuid4().hex[:8]
+
+
+def holder_id():
+    """Identify this process; forked workers get distinct ids through their pid."""
+    return f'{socket.gethostname()}:{os.getpid()}:{_TOKEN}'
+
+def acquire(db, name, holder, ttl):
+    """Take or renew lease `name` for ttl seconds. Returns True if `holder` now holds it."""
+    now = time.time()
+    db.execute('''
+        INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+        WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+    ''', (name, holder, now + ttl, now))
+    row = db.execute("SELECT holder FROM leases WHERE name = ?", (name,)).fetchone()
+    return row['holder'] == holder
+
+def release(db, name, holder):
+    db.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
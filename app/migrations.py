@@ -0,0 +1,750 @@
+import sqlite3
+import click
+from app.db import get_db, run_write
+
+# Numbered schema migrations. Each entry is (version, description, steps)
+# where steps is a tuple of SQL statements or a callable taking the
+# connection. Applied versions are tracked in PRAGMA user_version, and every
+# migration runs in its own write transaction together with the version bump.
+
+
+def _base_schema(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fullname TEXT NOT NULL,
+            email TEXT NOT NULL UNIQUE,
+            password_hash TEXT NOT NULL,
+            role TEXT NOT NULL DEFAULT 'student',
+            department TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS issues (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT,
+            category TEXT NOT NULL,
+            location TEXT,
+            priority TEXT DEFAULT 'Low',
+            status TEXT DEFAULT 'Submitted',
+            image_path TEXT,
+            reporter_id INTEGER NOT NULL,
+            assigned_to TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            resolved_at TIMESTAMP,
+            FOREIGN KEY (reporter_id) REFERENCES users (id)
+        )
+    ''')
+
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            issue_id INTEGER,
+            message TEXT NOT NULL,
+            is_read BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (issue_id) REFERENCES issues (id)
+        )
+    ''')
+
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            issue_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (issue_id) REFERENCES issues (id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Databases created before departments existed lack this column
+    columns = [row['name'] for row in db.execute("PRAGMA table_info(users)")]
+    if 'department' not in columns:
+        db.execute("ALTER TABLE users ADD COLUMN department TEXT")
+
+
+def _broadcast_notifications(db):
+    db.execute('''
+        CREATE TABLE notification_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            audience_type TEXT NOT NULL,
+            audience_key TEXT NOT NULL,
+            issue_id INTEGER,
+            code TEXT NOT NULL,
+            params TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (issue_id) REFERENCES issues (id)
+        )
+    ''')
+    db.execute("CREATE INDEX idx_notification_events_audience ON notification_events (audience_type, audience_key, id)")
+    # Catch-all staff read every department's events in id order
+    db.execute("CREATE INDEX idx_notification_events_type ON notification_events (audience_type, id)")
+    db.execute("CREATE INDEX idx_notification_events_issue ON notification_events (issue_id)")
+    db.execute('''
+        CREATE TABLE notification_cursors (
+            user_id INTEGER PRIMARY KEY,
+            read_through INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE notification_reads (
+            user_id INTEGER NOT NULL,
+            event_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, event_id),
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (event_id) REFERENCES notification_events (id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Carry over the per-recipient rows as user-addressed events, keeping their ids
+    db.execute('''
+        INSERT INTO notification_events (id, audience_type, audience_key, issue_id, code, params, created_at)
+        SELECT id, 'user', CAST(user_id AS TEXT), issue_id, 'legacy', json_object('message', message), created_at
+        FROM notifications
+    ''')
+    db.execute("INSERT INTO notification_reads (user_id, event_id) SELECT user_id, id FROM notifications WHERE is_read = 1")
+    db.execute('''
+        INSERT INTO notification_cursors (user_id, read_through)
+        SELECT id, 0 FROM users
+    ''')
+    db.execute("DROP TABLE notifications")
+
+
+def _issue_search(db):
+    from app.search import index_issues
+
+    # Matches the shortest prefix search.match_expression() issues
+    db.execute('''
+        CREATE VIRTUAL TABLE issues_fts USING fts5(
+            title, description, location, reporter, comments,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '3'
+        )
+    ''')
+    # Titles count most, then description, location and reporter, then comments
+    db.execute("INSERT INTO issues_fts (issues_fts, rank) VALUES ('rank', 'bm25(10.0, 4.0, 3.0, 3.0, 1.0)')")
+
+    db.execute('''
+        CREATE TRIGGER issues_fts_insert AFTER INSERT ON issues BEGIN
+            INSERT INTO issues_fts (rowid, title, description, location, reporter, comments)
+            VALUES (new.id, new.title, new.description, new.location,
+                    (SELECT fullname FROM users WHERE id = new.reporter_id), NULL);
+        END
+    ''')
+    # Status and assignment changes do not touch the indexed text
+    db.execute('''
+        CREATE TRIGGER issues_fts_update AFTER UPDATE OF title, description, location, reporter_id ON issues BEGIN
+            UPDATE issues_fts SET title = new.title, description = new.description, location = new.location,
+                reporter = (SELECT fullname FROM users WHERE id = new.reporter_id)
+            WHERE rowid = new.id;
+        END
+    ''')
+    db.execute('''
+        CREATE TRIGGER issues_fts_delete AFTER DELETE ON issues BEGIN
+            DELETE FROM issues_fts WHERE rowid = old.id;
+        END
+    ''')
+    db.execute('''
+        CREATE TRIGGER issues_fts_comment_insert AFTER INSERT ON comments BEGIN
+            UPDATE issues_fts SET comments = coalesce(comments || ' ', '') || new.content
+            WHERE rowid = new.issue_id;
+        END
+    ''')
+    for event, issue_id in (('UPDATE OF content', 'new.issue_id'), ('DELETE', 'old.issue_id')):
+        db.execute(f'''
+            CREATE TRIGGER issues_fts_comment_{event.split()[0].lower()} AFTER {event} ON comments BEGIN
+                UPDATE issues_fts SET comments =
+                    (SELECT group_concat(content, ' ') FROM comments WHERE issue_id = {issue_id})
+                WHERE rowid = {issue_id};
+            END
+        ''')
+    db.execute('''
+        CREATE TRIGGER issues_fts_reporter_update AFTER UPDATE OF fullname ON users BEGIN
+            UPDATE issues_fts SET reporter = new.fullname
+            WHERE rowid IN (SELECT id FROM issues WHERE reporter_id = new.id);
+        END
+    ''')
+
+    index_issues(db)
+
+
+def _rollup_upserts(row, sign):
+    """Trigger statements adding (sign 1) or removing (sign -1) one issue row's contribution."""
+    from app.rollups import RESOLUTION_SECONDS, ist_day
+
+    resolved = f"({row}.status = 'Resolved' AND {row}.resolved_at IS NOT NULL)"
+    seconds = RESOLUTION_SECONDS.replace('resolved_at', f'{row}.resolved_at').replace('created_at', f'{row}.created_at')
+    dims = (f"{row}.category, coalesce({row}.status, ''), coalesce({row}.priority, ''), "
+            f"coalesce({row}.location, '')")
+    sums = ("issues = issues + excluded.issues, resolved = resolved + excluded.resolved, "
+            "resolution_seconds = resolution_seconds + excluded.resolution_seconds")
+    return f'''
+        INSERT INTO issue_rollup_daily (day, category, status, priority, location, issues, resolved, resolution_seconds)
+        VALUES ({ist_day(f'{row}.created_at')}, {dims}, {sign}, {sign} * {resolved},
+                CASE WHEN {resolved} THEN {sign} * {seconds} ELSE 0 END)
+        ON CONFLICT (day, category, status, priority, location) DO UPDATE SET {sums};
+        INSERT INTO issue_rollup_totals (category, status, priority, location, issues, resolved, resolution_seconds)
+        VALUES ({dims}, {sign}, {sign} * {resolved}, CASE WHEN {resolved} THEN {sign} * {seconds} ELSE 0 END)
+        ON CONFLICT (category, status, priority, location) DO UPDATE SET {sums};
+        INSERT INTO issue_rollup_resolved (day, category, priority, location, resolved, resolution_seconds)
+        SELECT {ist_day(f'{row}.resolved_at')}, {row}.category, coalesce({row}.priority, ''),
+               coalesce({row}.location, ''), {sign}, {sign} * {seconds}
+        WHERE {resolved}
+        ON CONFLICT (day, category, priority, location) DO UPDATE SET
+            resolved = resolved + excluded.resolved,
+            resolution_seconds = resolution_seconds + excluded.resolution_seconds;
+    '''
+
+def _analytics_rollups(db):
+    from app.rollups import rebuild_all
+
+    measures = "issues INTEGER NOT NULL DEFAULT 0, resolved INTEGER NOT NULL DEFAULT 0, " \
+               "resolution_seconds REAL NOT NULL DEFAULT 0"
+    db.execute(f'''
+        CREATE TABLE issue_rollup_daily (
+            day TEXT NOT NULL, category TEXT NOT NULL, status TEXT NOT NULL,
+            priority TEXT NOT NULL, location TEXT NOT NULL, {measures},
+            PRIMARY KEY (day, category, status, priority, location)
+        ) WITHOUT ROWID
+    ''')
+    db.execute(f'''
+        CREATE TABLE issue_rollup_totals (
+            category TEXT NOT NULL, status TEXT NOT NULL, priority TEXT NOT NULL,
+            location TEXT NOT NULL, {measures},
+            PRIMARY KEY (category, status, priority, location)
+        ) WITHOUT ROWID
+    ''')
+    db.execute('''
+        CREATE TABLE issue_rollup_resolved (
+            day TEXT NOT NULL, category TEXT NOT NULL, priority TEXT NOT NULL, location TEXT NOT NULL,
+            resolved INTEGER NOT NULL DEFAULT 0, resolution_seconds REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, category, priority, location)
+        ) WITHOUT ROWID
+    ''')
+
+    db.execute(f"CREATE TRIGGER issue_rollup_insert AFTER INSERT ON issues BEGIN {_rollup_upserts('new', 1)} END")
+    db.execute(f"CREATE TRIGGER issue_rollup_delete AFTER DELETE ON issues BEGIN {_rollup_upserts('old', -1)} END")
+    # Only changes to the grouped or measured columns move an issue between rollup rows
+    db.execute(f'''
+        CREATE TRIGGER issue_rollup_update
+        AFTER UPDATE OF category, status, priority, location, created_at, resolved_at ON issues BEGIN
+            {_rollup_upserts('old', -1)}
+            {_rollup_upserts('new', 1)}
+        END
+    ''')
+
+    rebuild_all(db)
+
+
+def _data_versions(db):
+    db.execute('''
+        CREATE TABLE data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    db.execute("INSERT INTO data_versions (name, version) VALUES ('issues', 0)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        db.execute(f'''
+            CREATE TRIGGER issues_version_{event.lower()} AFTER {event} ON issues BEGIN
+                UPDATE data_versions SET version = version + 1 WHERE name = 'issues';
+            END
+        ''')
+
+
+def _resolution_sketches(db):
+    db.execute('''
+        CREATE TABLE resolution_sketch (
+            dimension TEXT NOT NULL,
+            day TEXT NOT NULL,
+            key TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dimension, day, key, bucket)
+        ) WITHOUT ROWID
+    ''')
+    # Filled by migration 9, once assignees are user ids
+
+
+def _issue_events(db):
+    db.execute('''
+        CREATE TABLE issue_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            issue_id INTEGER NOT NULL,
+            code TEXT NOT NULL,
+            value TEXT,
+            actor_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (issue_id) REFERENCES issues (id),
+            FOREIGN KEY (actor_id) REFERENCES users (id)
+        )
+    ''')
+    db.execute("CREATE INDEX idx_issue_events_issue ON issue_events (issue_id, id)")
+    db.execute('''
+        CREATE TABLE event_offsets (
+            consumer TEXT PRIMARY KEY,
+            position INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+
+    # Only report and resolution times are known for existing issues; their
+    # current status and assignee are recorded without a timestamp
+    db.execute('''
+        INSERT INTO issue_events (issue_id, code, value, actor_id, created_at)
+        SELECT id, 'reported', NULL, reporter_id, created_at FROM issues ORDER BY id
+    ''')
+    db.execute('''
+        INSERT INTO issue_events (issue_id, code, value, actor_id, created_at)
+        SELECT id, 'assigned', assigned_to, NULL, NULL FROM issues
+        WHERE assigned_to IS NOT NULL AND assigned_to != '' ORDER BY id
+    ''')
+    db.execute('''
+        INSERT INTO issue_events (issue_id, code, value, actor_id, created_at)
+        SELECT id, 'status', status, NULL, CASE WHEN status = 'Resolved' THEN resolved_at END FROM issues
+        WHERE status != 'Submitted' ORDER BY id
+    ''')
+
+
+def _issue_counters(db):
+    from app.counters import rebuild as rebuild_counters
+    from app.sketches import rebuild as rebuild_sketches
+
+    # Point assignments at the staff account instead of a copy of its name.
+    # Names that match no staff account are left unassigned; the event log
+    # still has them.
+    db.execute("ALTER TABLE issues ADD COLUMN assignee_id INTEGER REFERENCES users (id)")
+    db.execute('''
+        UPDATE issues SET assignee_id =
+            (SELECT MIN(id) FROM users WHERE role = 'staff' AND fullname = issues.assigned_to)
+        WHERE assigned_to IS NOT NULL
+    ''')
+    db.execute('''
+        UPDATE issue_events SET value =
+            (SELECT CAST(MIN(id) AS TEXT) FROM users WHERE role = 'staff' AND fullname = issue_events.value)
+        WHERE code = 'assigned' AND value IN (SELECT fullname FROM users WHERE role = 'staff')
+    ''')
+    db.execute("DROP INDEX IF EXISTS idx_issues_open_assignee")
+    db.execute("ALTER TABLE issues DROP COLUMN assigned_to")
+    db.execute("CREATE INDEX idx_issues_assignee_status ON issues (assignee_id, status)")
+
+    db.execute('''
+        CREATE TABLE issue_counters (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID
+    ''')
+    rebuild_counters(db)
+    rebuild_sketches(db)
+
+
+def _users_version(db):
+    db.execute("INSERT INTO data_versions (name, version) VALUES ('users', 0)")
+    for event in ('INSERT', 'UPDATE OF role, department', 'DELETE'):
+        db.execute(f'''
+            CREATE TRIGGER users_version_{event.split()[0].lower()} AFTER {event} ON users BEGIN
+                UPDATE data_versions SET version = version + 1 WHERE name = 'users';
+            END
+        ''')
+
+
+def _sla_tracking(db):
+    db.execute("ALTER TABLE issues ADD COLUMN acknowledged_at TIMESTAMP")
+    # First action by anyone but the reporter; issues that moved on without a
+    # recorded action count as acknowledged when reported
+    db.execute('''
+        UPDATE issues SET acknowledged_at = (
+            SELECT MIN(e.created_at) FROM issue_events e
+            WHERE e.issue_id = issues.id AND e.actor_id IS NOT NULL AND e.actor_id != issues.reporter_id
+        )
+    ''')
+    db.execute("UPDATE issues SET acknowledged_at = created_at WHERE acknowledged_at IS NULL AND status != 'Submitted'")
+    # SLA scanner: open issues of one status and priority that crossed a target
+    db.execute("CREATE INDEX idx_issues_status_priority_created ON issues (status, priority, created_at)")
+    db.execute('''
+        CREATE TABLE sla_breaches (
+            issue_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            breached_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (issue_id, kind),
+            FOREIGN KEY (issue_id) REFERENCES issues (id)
+        ) WITHOUT ROWID
+    ''')
+    db.execute('''
+        CREATE TABLE sla_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        ) WITHOUT ROWID
+    ''')
+    db.execute('''
+        CREATE TABLE leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+def _duplicate_detection(db):
+    from app.duplicates import rebuild as rebuild_duplicates
+
+    db.execute("ALTER TABLE issues ADD COLUMN merged_into INTEGER REFERENCES issues (id)")
+    db.execute('''
+        CREATE TABLE issue_signatures (
+            issue_id INTEGER PRIMARY KEY,
+            bucket TEXT NOT NULL,
+            signature BLOB NOT NULL,
+            image_hash INTEGER,
+            open INTEGER NOT NULL DEFAULT 1,
+            FOREIGN KEY (issue_id) REFERENCES issues (id)
+        )
+    ''')
+    # Photo comparison reads the open issues with a photo in one bucket
+    db.execute('''
+        CREATE INDEX idx_issue_signatures_images ON issue_signatures (bucket)
+        WHERE open = 1 AND image_hash IS NOT NULL
+    ''')
+    db.execute('''
+        CREATE TABLE issue_lsh (
+            band_key INTEGER NOT NULL,
+            issue_id INTEGER NOT NULL,
+            PRIMARY KEY (band_key, issue_id),
+            FOREIGN KEY (issue_id) REFERENCES issues (id)
+        ) WITHOUT ROWID
+    ''')
+    db.execute('''
+        CREATE TABLE issue_votes (
+            issue_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (issue_id, user_id),
+            FOREIGN KEY (issue_id) REFERENCES issues (id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        ) WITHOUT ROWID
+    ''')
+    # Text only: photos of existing issues are hashed by duplicates-rebuild
+    rebuild_duplicates(db)
+
+
+def _vote_counts(db):
+    db.execute("ALTER TABLE issues ADD COLUMN vote_count INTEGER NOT NULL DEFAULT 0")
+    db.execute('''
+        UPDATE issues SET vote_count = (SELECT COUNT(*) FROM issue_votes v WHERE v.issue_id = issues.id)
+        WHERE id IN (SELECT issue_id FROM issue_votes)
+    ''')
+    db.execute('''
+        CREATE TABLE issue_vote_deltas (
+            id INTEGER PRIMARY KEY,
+            issue_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            FOREIGN KEY (issue_id) REFERENCES issues (id)
+        )
+    ''')
+    db.execute("CREATE INDEX idx_issue_vote_deltas_issue ON issue_vote_deltas (issue_id)")
+    # Admin dashboard sorted by votes, unfiltered and by status
+    db.execute("CREATE INDEX idx_issues_votes_created ON issues (vote_count, created_at)")
+    db.execute("CREATE INDEX idx_issues_status_votes_created ON issues (status, vote_count, created_at)")
+    # Folding votes into vote_count is not a change to the issue itself; no
+    # other write touches vote_count
+    db.execute("DROP TRIGGER issues_version_update")
+    db.execute('''
+        CREATE TRIGGER issues_version_update AFTER UPDATE ON issues
+        WHEN old.vote_count = new.vote_count BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'issues';
+        END
+    ''')
+
+
+def _import_jobs(db):
+    # Progress of each bulk import, advanced in the transaction that commits each batch
+    db.execute('''
+        CREATE TABLE import_jobs (
+            name TEXT PRIMARY KEY,
+            rows_read INTEGER NOT NULL DEFAULT 0,
+            imported INTEGER NOT NULL DEFAULT 0,
+            rejected INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'running',
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    ''')
+
+
+# Columns whose change is a change to the issue as API clients see it
+_REVISED_COLUMNS = ('title', 'description', 'category', 'location', 'priority', 'status', 'image_path',
+                    'reporter_id', 'assignee_id', 'vote_count', 'merged_into', 'resolved_at', 'acknowledged_at')
+
+def _issue_revisions(db):
+    db.execute("ALTER TABLE issues ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    # NULL until the issue first changes: read as coalesce(updated_at, created_at)
+    db.execute("ALTER TABLE issues ADD COLUMN updated_at TIMESTAMP")
+    db.execute('''
+        UPDATE issues SET updated_at = max(
+            coalesce(resolved_at, created_at), coalesce(acknowledged_at, created_at),
+            coalesce((SELECT MAX(e.created_at) FROM issue_events e WHERE e.issue_id = issues.id), created_at),
+            coalesce((SELECT MAX(c.created_at) FROM comments c WHERE c.issue_id = issues.id), created_at))
+    ''')
+    db.execute('''
+        UPDATE issues SET updated_at = NULL WHERE updated_at = created_at
+    ''')
+    # Only version and updated_at change here, so the trigger does not fire itself
+    db.execute(f'''
+        CREATE TRIGGER issues_revision_update AFTER UPDATE OF {', '.join(_REVISED_COLUMNS)} ON issues BEGIN
+            UPDATE issues SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = new.id;
+        END
+    ''')
+    # An issue's comments are part of it
+    for event, issue_ids in (('INSERT', ('new',)), ('DELETE', ('old',)), ('UPDATE OF issue_id', ('old', 'new'))):
+        db.execute(f'''
+            CREATE TRIGGER comments_revision_{event.split()[0].lower()} AFTER {event} ON comments BEGIN
+                UPDATE issues SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id IN ({', '.join(f'{row}.issue_id' for row in issue_ids)});
+            END
+        ''')
+    # Stamping a revision is not a change of its own
+    db.execute("DROP TRIGGER issues_version_update")
+    db.execute('''
+        CREATE TRIGGER issues_version_update AFTER UPDATE ON issues
+        WHEN old.vote_count = new.vote_count AND old.version = new.version BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'issues';
+        END
+    ''')
+
+
+def _job_queue(db):
+    # Jobs are deleted when they succeed; times are Unix timestamps, like leases
+    db.execute('''
+        CREATE TABLE jobs (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            payload TEXT NOT NULL DEFAULT '{}',
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            run_at REAL NOT NULL,
+            locked_by TEXT,
+            locked_until REAL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Workers take the most urgent due job, and take back those whose worker outran its visibility timeout
+    db.execute("CREATE INDEX idx_jobs_queued ON jobs (priority DESC, run_at) WHERE status = 'queued'")
+    db.execute("CREATE INDEX idx_jobs_running ON jobs (locked_until) WHERE status = 'running'")
+
+
+MIGRATIONS = [
+    (1, 'base schema', _base_schema),
+    (2, 'indexes for dashboard, notification and comment queries', (
+        # Role lookups for notification fan-out and the staff dropdown
+        "CREATE INDEX IF NOT EXISTS idx_users_role_department ON users (role, department)",
+        # Student dashboard: WHERE reporter_id = ? ORDER BY created_at
+        "CREATE INDEX IF NOT EXISTS idx_issues_reporter_created ON issues (reporter_id, created_at)",
+        # Admin dashboard: unfiltered, status and category filters, all newest first
+        "CREATE INDEX IF NOT EXISTS idx_issues_created ON issues (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_issues_status_created ON issues (status, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_issues_category_created ON issues (category, created_at)",
+        # Analytics: resolved issues by resolution time, open critical issues, locations
+        "CREATE INDEX IF NOT EXISTS idx_issues_status_resolved ON issues (status, resolved_at, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_issues_priority_status ON issues (priority, status)",
+        "CREATE INDEX IF NOT EXISTS idx_issues_location ON issues (location) WHERE location IS NOT NULL AND location != ''",
+        # Staff workload only ever looks at open, assigned issues
+        "CREATE INDEX IF NOT EXISTS idx_issues_open_assignee ON issues (assigned_to) "
+        "WHERE assigned_to IS NOT NULL AND status != 'Resolved'",
+        # Notification list, and unread lookups by user / by user and issue
+        "CREATE INDEX IF NOT EXISTS idx_notifications_user_created ON notifications (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_notifications_unread ON notifications (user_id, issue_id) WHERE is_read = 0",
+        # Comment thread on the issue page
+        "CREATE INDEX IF NOT EXISTS idx_comments_issue_created ON comments (issue_id, created_at)",
+    )),
+    (3, 'broadcast notification events with per-user read cursors', _broadcast_notifications),
+    (4, 'full-text search index over issues and comments', _issue_search),
+    (5, 'trigger-maintained analytics rollup tables', _analytics_rollups),
+    (6, 'change counters for cache invalidation', _data_versions),
+    (7, 'resolution-time quantile sketches', _resolution_sketches),
+    (8, 'append-only issue event log', _issue_events),
+    (9, 'materialized counters and staff assignee foreign key', _issue_counters),
+    (10, 'change counter for staff membership', _users_version),
+    (11, 'SLA acknowledgement times, breaches and scanner lease', _sla_tracking),
+    (12, 'duplicate detection index, me-too votes and merged issues', _duplicate_detection),
+    (13, 'batched vote counts on issues', _vote_counts),
+    (14, 'resumable bulk import checkpoints', _import_jobs),
+    (15, 'issue revision numbers and update times for API caching', _issue_revisions),
+    (16, 'durable background job queue', _job_queue),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Queries issued on every page view. check_query_plans() runs EXPLAIN QUERY
+# PLAN on each one and reports any that fall back to a full table scan.
+HOT_QUERIES = {
+    'auth.login': ("SELECT * FROM users WHERE email = ?", ('a@b.c',)),
+    'student.dashboard': (
+        "SELECT * FROM issues i WHERE i.reporter_id = ? AND (i.created_at, i.id) < (?, ?) "
+        "ORDER BY i.created_at DESC, i.id DESC LIMIT ?", (1, '2024-01-01 00:00:00', 1, 26)),
+    'student.dashboard.counts': (
+        "SELECT status, COUNT(*) AS cnt FROM issues WHERE reporter_id = ? GROUP BY status", (1,)),
+    'student.issue_detail.comments': (
+        "SELECT c.*, u.fullname, u.role FROM comments c JOIN users u ON c.user_id = u.id "
+        "WHERE c.issue_id = ? ORDER BY c.created_at DESC", (1,)),
+    'admin.dashboard': (
+        "SELECT i.*, u.fullname as reporter_name FROM issues i JOIN users u ON i.reporter_id = u.id "
+        "WHERE (i.created_at, i.id) < (?, ?) ORDER BY i.created_at DESC, i.id DESC LIMIT ?",
+        ('2024-01-01 00:00:00', 1, 26)),
+    'admin.dashboard.status': (
+        "SELECT i.*, u.fullname as reporter_name FROM issues i JOIN users u ON i.reporter_id = u.id "
+        "WHERE i.status = ? AND (i.created_at, i.id) < (?, ?) ORDER BY i.created_at DESC, i.id DESC LIMIT ?",
+        ('Submitted', '2024-01-01 00:00:00', 1, 26)),
+    'admin.dashboard.votes': (
+        "SELECT i.*, u.fullname as reporter_name FROM issues i JOIN users u ON i.reporter_id = u.id "
+        "WHERE (i.vote_count, i.created_at, i.id) < (?, ?, ?) "
+        "ORDER BY i.vote_count DESC, i.created_at DESC, i.id DESC LIMIT ?", (3, '2024-01-01 00:00:00', 1, 26)),
+    'admin.dashboard.status.votes': (
+        "SELECT i.*, u.fullname as reporter_name FROM issues i JOIN users u ON i.reporter_id = u.id "
+        "WHERE i.status = ? AND (i.vote_count, i.created_at, i.id) < (?, ?, ?) "
+        "ORDER BY i.vote_count DESC, i.created_at DESC, i.id DESC LIMIT ?",
+        ('Submitted', 3, '2024-01-01 00:00:00', 1, 26)),
+    'admin.dashboard.category': (
+        "SELECT i.*, u.fullname as reporter_name FROM issues i JOIN users u ON i.reporter_id = u.id "
+        "WHERE i.category = ? AND (i.created_at, i.id) > (?, ?) ORDER BY i.created_at ASC, i.id ASC LIMIT ?",
+        ('Safety', '2024-01-01 00:00:00', 1, 26)),
+    'admin.dashboard.counts': ("SELECT key, count FROM issue_counters WHERE kind = ?", ('status',)),
+    'admin.dashboard.workload': (
+        "SELECT u.id, u.fullname, u.department, c.count AS active_count "
+        "FROM issue_counters c JOIN users u ON u.id = c.key "
+        "WHERE c.kind = 'assignee' AND c.count > 0 ORDER BY u.fullname", ()),
+    'admin.dashboard.staff': ("SELECT id, fullname, department FROM users WHERE role = 'staff'", ()),
+    'admin.analytics.totals': (
+        "SELECT category, status, priority, location, issues, resolved, resolution_seconds "
+        "FROM issue_rollup_totals WHERE issues != 0", ()),
+    'admin.analytics.resolved_today': (
+        "SELECT COALESCE(SUM(resolved), 0) FROM issue_rollup_resolved WHERE day = ?", ('2024-01-01',)),
+    'admin.analytics.percentiles': (
+        "SELECT key, bucket, SUM(count) AS count FROM resolution_sketch WHERE dimension = ? AND day >= ? "
+        "GROUP BY key, bucket HAVING SUM(count) > 0 ORDER BY key, bucket", ('category', '2024-01-01')),
+    'student.issue_detail.timeline': (
+        "SELECT e.*, u.fullname AS actor_name, u.role AS actor_role, i.reporter_id, "
+        "coalesce(a.fullname, e.value) AS assignee_name FROM issue_events e "
+        "JOIN issues i ON i.id = e.issue_id LEFT JOIN users u ON u.id = e.actor_id "
+        "LEFT JOIN users a ON e.code = 'assigned' AND a.id = e.value "
+        "WHERE e.issue_id = ? ORDER BY e.id", (1,)),
+    'admin.events.replay': ("SELECT * FROM issue_events WHERE id > ? ORDER BY id LIMIT ?", (0, 500)),
+    'admin.dashboard.sla': ("SELECT key, value FROM sla_state", ()),
+    'sla.scan': (
+        "SELECT id FROM issues WHERE status IN (?, ?) AND priority = ? AND created_at <= ? AND created_at > ?",
+        ('Submitted', 'In Progress', 'High', '2024-01-02 00:00:00', '2024-01-01 00:00:00')),
+    'student.report.duplicates': (
+        "SELECT DISTINCT issue_id FROM issue_lsh WHERE band_key IN (?, ?)", (1, 2)),
+    'student.report.duplicates.images': (
+        "SELECT issue_id, image_hash FROM issue_signatures "
+        "WHERE bucket = ? AND open = 1 AND image_hash IS NOT NULL", ('Electrical/lh1',)),
+    'student.issue_detail.votes': (
+        "SELECT COALESCE(SUM(delta), 0) FROM issue_vote_deltas WHERE issue_id = ?", (1,)),
+    'admin.dashboard.search': (
+        "SELECT i.*, u.fullname AS reporter_name FROM issues_fts JOIN issues i ON i.id = issues_fts.rowid "
+        "JOIN users u ON u.id = i.reporter_id WHERE issues_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?",
+        ('"projector"*', 26, 0)),
+    'api.issues.batch': ("SELECT i.id, i.version FROM issues i WHERE i.id IN (?, ?)", (1, 2)),
+    'api.notifications.older': (
+        "SELECT * FROM notification_events WHERE audience_type = ? AND audience_key = ? AND id < ? "
+        "ORDER BY id DESC LIMIT ?", ('user', '1', 100, 50)),
+    'jobs.claim': (
+        "SELECT id FROM jobs WHERE status = 'queued' AND run_at <= ? ORDER BY priority DESC, run_at LIMIT 1",
+        (0.0,)),
+    'jobs.expired': ("SELECT id FROM jobs WHERE status = 'running' AND locked_until <= ?", (0.0,)),
+    'common.notifications.user': (
+        "SELECT * FROM notification_events WHERE audience_type = ? AND audience_key = ? "
+        "ORDER BY id DESC LIMIT ?", ('user', '1', 50)),
+    'common.notifications.department': (
+        "SELECT * FROM notification_events WHERE audience_type = ? ORDER BY id DESC LIMIT ?", ('department', 50)),
+    'common.unread_count': (
+        "SELECT COUNT(*) FROM notification_events e WHERE audience_type = ? AND audience_key = ? AND id > ? "
+        "AND NOT EXISTS (SELECT 1 FROM notification_reads r WHERE r.user_id = ? AND r.event_id = e.id)",
+        ('role', 'admin', 0, 1)),
+    'common.mark_issue_read': (
+        "SELECT id FROM notification_events WHERE audience_type = ? AND audience_key = ? "
+        "AND issue_id = ? AND id > ?", ('user', '1', 1, 0)),
+}
+
+# Tables whose size does not grow with history; reading them whole is expected
+SMALL_TABLES = {'issue_rollup_totals', 'sla_state'}
+
+
+def current_version(db):
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+def upgrade(target=None):
+    """Apply pending migrations up to target (default: latest).
+
+    Returns the list of versions applied.
+    """
+    target = LATEST_VERSION if target is None else target
+    applied = []
+
+    for version, description, steps in MIGRATIONS:
+        if version > target:
+            break
+
+        def _apply(db, version=version, steps=steps):
+            # Re-check under the write lock in case another process got here first
+            if current_version(db) >= version:
+                return False
+            if callable(steps):
+                steps(db)
+            else:
+                for statement in steps:
+                    db.execute(statement)
+            db.execute(f"PRAGMA user_version = {int(version)}")
+            return True
+
+        if run_write(_apply):
+            applied.append((version, description))
+
+    return applied
+
+def check_query_plans(db, queries=None):
+    """Return {name: [plan rows]} for every hot query that does a full table scan."""
+    offenders = {}
+    for name, (sql, params) in (queries or HOT_QUERIES).items():
+        plan = [row['detail'] for row in db.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        # "SCAN t USING [COVERING] INDEX" walks an index, a bare "SCAN t" reads every row
+        scans = [detail for detail in plan
+                 if detail.startswith('SCAN') and 'INDEX' not in detail and 'CONSTANT ROW' not in detail
+                 and detail.split()[1] not in SMALL_TABLES]
+        if scans:
+            offenders[name] = plan
+    return offenders
+
+
+@click.command('db-upgrade')
+@click.option('--to', 'target', type=int, default=None, help='Stop at this schema version.')
+def db_upgrade_command(target):
+    """Apply pending schema migrations."""
+    applied = upgrade(target)
+    for version, description in applied:
+        click.echo(f'Applied migration {version}: {description}')
+    click.echo(f'Database is at schema version {current_version(get_db())}.')
+
+@click.command('db-check-plans')
+def db_check_plans_command():
+    """Fail if any registered hot query does a full table scan."""
+    offenders = check_query_plans(get_db())
+    for name, plan in offenders.items():
+        click.echo(f'{name}: ' + ' | '.join(plan), err=True)
+    if offenders:
+        raise click.ClickException(f'{len(offenders)} hot queries do a full table scan.')
+    click.echo(f'All {len(HOT_QUERIES)} hot queries use an index.')
+
+def init_app(app):
+    app.cli.add_command(db_upgrade_command)
+    app.cli.add_command(db_check_plans_command)
@@ -0,0 +1,187 @@
+import json
+from flask import session
+from app.cache import TTLCache
+
+# Audience-scoped notifications. One notification_events row is written
+# per event and addressed to a user, a role or a staff department; the
+# message is stored as a code plus JSON parameters and rendered on display.
+# Read state is a per-user cursor (everything up to read_through is read)
+# plus sparse notification_reads markers for events opened individually.
+
+MESSAGES = {
+    'issue_reported': "New {priority} priority issue reported: {title}",
+    'department_issue': "New issue assigned to your department: {title}",
+    'status_changed': "Issue #{issue_id} status updated to {status}",
+    'assigned': "Issue #{issue_id} assigned to {assignee}",
+    'auto_assigned': "Issue #{issue_id} was assigned to you: {title}",
+    'comment': "New comment on Issue #{issue_id}",
+    'merged': "Your Issue #{duplicate} was merged into Issue #{issue_id}, which is tracked instead",
+    'issues_imported': "{count} historical issues imported from {source}",
+    'sla_breached': "Issue #{issue_id} missed its {target} target; priority is now {priority}",
+    # Rows migrated from the old per-recipient table keep their text
+    'legacy': "{message}",
+}
+
+# Staff in this department hear about every department's issues
+CATCH_ALL_DEPARTMENT = 'Others'
+
+# Unread badges stop counting here so the query cost stays bounded
+UNREAD_CAP = 99
+
+# user_id -> (high-water event id, unread count). Entries are validated
+# against MAX(id) of notification_events, so new events from any process
+# are picked up; read-state changes are dropped explicitly via forget_unread
+# and the TTL bounds staleness when they happen in another process.
+_unread_cache = TTLCache(ttl=60)
+
+def audiences_for(user_id, role, department=None):
+    """Return the (audience_type, audience_key) pairs a user receives.
+
+    A key of None matches every key of that type.
+    """
+    audiences = [('user', str(user_id)), ('role', role)]
+    if role == 'staff' and department:
+        audiences.append(('department', None if department == CATCH_ALL_DEPARTMENT else department))
+    return audiences
+
+def current_audiences():
+    return audiences_for(session['user_id'], session.get('role'), session.get('department'))
+
+def _audience_branches(audiences, where, limit=None):
+    """Build one index-friendly SELECT per audience, joined with UNION ALL.
+
+    Each branch is a range scan on (audience_type, audience_key, id) or
+    (audience_type, id), so the total cost is bounded by the LIMIT per
+    branch rather than by the size of the events table.
+    """
+    branches = []
+    params = []
+    for audience_type, audience_key in audiences:
+        sql = "SELECT * FROM notification_events WHERE audience_type = ?"
+        params.append(audience_type)
+        if audience_key is not None:
+            sql += " AND audience_key = ?"
+            params.append(audience_key)
+        sql += f" AND {where[0]}"
+        params.extend(where[1])
+        if limit is not None:
+            sql += " ORDER BY id DESC LIMIT ?"
+            params.append(limit)
+        branches.append(f"SELECT * FROM ({sql})")
+    return " UNION ALL ".join(branches), params
+
+def notify(db, audience_type, audience_key, issue_id, code, **params):
+    notify_many(db, [(audience_type, audience_key, issue_id, code, params)])
+
+def notify_many(db, notices):
+    """notify() for many (audience_type, audience_key, issue_id, code, params) tuples at once."""
+    db.executemany(
+        'INSERT INTO notification_events (audience_type, audience_key, issue_id, code, params) VALUES (?, ?, ?, ?, ?)',
+        [(audience_type, str(audience_key), issue_id, code, json.dumps(params, separators=(',', ':')))
+         for audience_type, audience_key, issue_id, code, params in notices]
+    )
+
+def render(event):
+    values = {'issue_id': event['issue_id']}
+    if event['params']:
+        values.update(json.loads(event['params']))
+    try:
+        return MESSAGES[event['code']].format(**values)
+    except (KeyError, IndexError):
+        return event['code']
+
+def read_through(db, user_id):
+    row = db.execute("SELECT read_through FROM notification_cursors WHERE user_id = ?", (user_id,)).fetchone()
+    return row['read_through'] if row else 0
+
+def start_cursor(db, user_id):
+    """Treat everything broadcast before the account existed as already read."""
+    db.execute('''
+        INSERT OR IGNORE INTO notification_cursors (user_id, read_through)
+        SELECT ?, COALESCE(MAX(id), 0) FROM notification_events
+    ''', (user_id,))
+
+def latest_event_id(db):
+    return db.execute("SELECT COALESCE(MAX(id), 0) FROM notification_events").fetchone()[0]
+
+def unread_count(db, user_id, audiences, cap=UNREAD_CAP, after=0, through=None):
+    """Count unread events in (after, through], stopping at cap."""
+    cursor = max(read_through(db, user_id), after)
+    where = "id > ?" if through is None else "id > ? AND id <= ?"
+    bounds = (cursor,) if through is None else (cursor, through)
+    union, params = _audience_branches(audiences, (where, bounds))
+    return db.execute(f'''
+        SELECT COUNT(*) FROM (
+            SELECT 1 FROM ({union}) e
+            WHERE NOT EXISTS (SELECT 1 FROM notification_reads r WHERE r.user_id = ? AND r.event_id = e.id)
+            LIMIT ?
+        )
+    ''', params + [user_id, cap]).fetchone()[0]
+
+def cached_unread_count(db, user_id, audiences):
+    """unread_count() kept in an in-process cache and updated incrementally.
+
+    A cache hit costs one MAX(id) lookup; when new events have arrived
+    only those are examined and added to the cached count.
+    """
+    latest = latest_event_id(db)
+    entry = _unread_cache.get(user_id)
+    if entry is not None and entry[0] == latest:
+        return entry[1]
+
+    if entry is None or entry[0] > latest:
+        count = unread_count(db, user_id, audiences, through=latest)
+    else:
+        since, cached = entry
+        count = min(UNREAD_CAP, cached + unread_count(db, user_id, audiences, after=since, through=latest))
+    _unread_cache.set(user_id, (latest, count))
+    return count
+
+def forget_unread(user_id):
+    _unread_cache.pop(user_id)
+
+def recent(db, user_id, audiences, limit=50, before=None):
+    """Newest notifications for a user (older than event id `before`), rendered, with their read state."""
+    cursor = read_through(db, user_id)
+    where = ("id < ?", (before,)) if before else ("1", ())
+    union, params = _audience_branches(audiences, where, limit=limit)
+    rows = db.execute(f'''
+        SELECT e.*, (e.id <= ? OR EXISTS (
+            SELECT 1 FROM notification_reads r WHERE r.user_id = ? AND r.event_id = e.id
+        )) AS is_read
+        FROM ({union}) e
+        ORDER BY e.id DESC LIMIT ?
+    ''', [cursor, user_id] + params + [limit]).fetchall()
+    return [dict(row, message=render(row)) for row in rows]
+
+def events_after(db, audiences, after, limit=50):
+    """A user's events with ids above `after`, oldest first and rendered; the newest `limit` if there are more."""
+    union, params = _audience_branches(audiences, ("id > ?", (after,)), limit=limit)
+    rows = db.execute(f"SELECT * FROM ({union}) ORDER BY id DESC LIMIT ?", params + [limit]).fetchall()
+    return [dict(row, message=render(row)) for row in reversed(rows)]
+
+def get_for_user(db, event_id, audiences):
+    """Return the event if it is addressed to one of the audiences, else None."""
+    union, params = _audience_branches(audiences, ("id = ?", (event_id,)))
+    return db.execute(f"SELECT * FROM ({union}) LIMIT 1", params).fetchone()
+
+def mark_read(db, user_id, event_id):
+    if event_id > read_through(db, user_id):
+        db.execute("INSERT OR IGNORE INTO notification_reads (user_id, event_id) VALUES (?, ?)", (user_id, event_id))
+
+def mark_issue_read(db, user_id, audiences, issue_id):
+    cursor = read_through(db, user_id)
+    union, params = _audience_branches(audiences, ("issue_id = ? AND id > ?", (issue_id, cursor)))
+    db.execute(f'''
+        INSERT OR IGNORE INTO notification_reads (user_id, event_id)
+        SELECT ?, id FROM ({union})
+    ''', [user_id] + params)
+
+def mark_all_read(db, user_id):
+    # Advancing the cursor makes the individual markers redundant
+    latest = db.execute("SELECT COALESCE(MAX(id), 0) FROM notification_events").fetchone()[0]
+    db.execute('''
+        INSERT INTO notification_cursors (user_id, read_through) VALUES (?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET read_through = MAX(read_through, excluded.read_through)
+    ''', (user_id, latest))
+    db.execute("DELETE FROM notification_reads WHERE user_id = ? AND event_id <= ?", (user_id, latest))
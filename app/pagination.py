@@ -0,0 +1,104 @@
+import base64
+import binascii
+
+# Keyset pagination, newest first by default. A page is fetched with a
+# row-value comparison against the last key of the previous page, so every
+# page is an index range scan of page size + 1 rows no matter how deep the
+# reader goes. The key is the sort's columns plus the id as a tiebreaker;
+# cursors are opaque URL-safe tokens for "<value>|...|<id>".
+
+DEFAULT_PER_PAGE = 25
+MAX_PER_PAGE = 100
+
+# Sort name -> the key columns before the id, each with the type its cursor value parses to
+SORT_KEYS = {
+    'newest': (('created_at', str),),
+    'votes': (('vote_count', int), ('created_at', str)),
+}
+
+
+def encode_cursor(row, sort='newest'):
+    values = [row[column] for column, _ in SORT_KEYS[sort]] + [row['id']]
+    raw = '|'.join(str(value) for value in values).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token, sort='newest'):
+    """Return the key values for a cursor token, or None if it is malformed."""
+    if not token:
+        return None
+    columns = SORT_KEYS[sort]
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        values = raw.split('|')
+        if len(values) != len(columns) + 1:
+            return None
+        return tuple(parse(value) for (_, parse), value in zip(columns + (('id', int),), values))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+def per_page_arg(args, default=DEFAULT_PER_PAGE):
+    return max(1, min(args.get('per_page', default, type=int) or default, MAX_PER_PAGE))
+
+def sort_arg(args):
+    sort = args.get('sort')
+    return sort if sort in SORT_KEYS else 'newest'
+
+
+class Page:
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def paginate(db, select, where, params, alias, args, per_page=None, sort='newest'):
+    """Fetch one page of `select` in `sort` order using the after/before cursors in args.
+
+    `where` is a list of SQL conditions ANDed together with `params`; `alias`
+    is the table alias whose key columns are compared. The caller's indexes
+    should cover (filter columns..., key columns) - SQLite appends the rowid
+    to every index, which makes id the tiebreaker for free.
+    """
+    per_page = per_page or per_page_arg(args)
+    after = decode_cursor(args.get('after'), sort)
+    before = None if after else decode_cursor(args.get('before'), sort)
+
+    conditions = list(where)
+    params = list(params)
+    columns = [f"{alias}.{column}" for column, _ in SORT_KEYS[sort]] + [f"{alias}.id"]
+    key = f"({', '.join(columns)})"
+    placeholders = f"({', '.join('?' * len(columns))})"
+    if after:
+        conditions.append(f"{key} < {placeholders}")
+        params.extend(after)
+    elif before:
+        conditions.append(f"{key} > {placeholders}")
+        params.extend(before)
+
+    order = 'ASC' if before else 'DESC'
+    sql = select
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += f" ORDER BY {', '.join(f'{column} {order}' for column in columns)} LIMIT ?"
+    rows = db.execute(sql, params + [per_page + 1]).fetchall()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+    if not rows:
+        return Page(rows, per_page)
+
+    if before:
+        # Walking backwards: there is always a newer-to-older page to return to
+        return Page(rows, per_page, next_cursor=encode_cursor(rows[-1], sort),
+                    prev_cursor=encode_cursor(rows[0], sort) if has_more else None)
+    return Page(rows, per_page, next_cursor=encode_cursor(rows[-1], sort) if has_more else None,
+                prev_cursor=encode_cursor(rows[0], sort) if after else None)
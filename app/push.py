@@ -0,0 +1,222 @@
+import collections
+import json
+import logging
+import os
+import threading
+import time
+from flask import current_app
+from app import notifications
+from app.db import _extension, get_read_pool
+
+logger = logging.getLogger(__name__)
+
+# Live notification push. Browsers poll /notifications/poll for the
+# notification events meant for them, and under a cooperative server they
+# hold a Server-Sent Events stream instead and receive each event as soon
+# as it commits.
+#
+# Each process runs one dispatcher thread, started by its first
+# subscriber; streams and long polls do not get threads of their own, only
+# a Subscription queue the dispatcher appends to. The dispatcher reads
+# notification_events past the last id it dispatched whenever the
+# database changed: routes call publish() after their write commits to
+# wake it at once, and every PUSH_POLL_INTERVAL seconds it checks PRAGMA
+# data_version, which moves on any commit by another connection - the
+# writer thread here or a worker in another process. Events carry their
+# ids, so a reconnecting client sends Last-Event-ID and is first sent what
+# it missed.
+#
+# A waiting stream or long poll still occupies the request that serves it,
+# and under a thread-pool server such as Waitress that is a whole thread:
+# a few open dashboards would hold every thread and stall page requests.
+# So streaming is off unless PUSH_STREAMING says the app is served by a
+# cooperative server (gunicorn with gevent workers), where the waits below
+# are greenlet switches. Without it the stream is not served, and polls
+# answer at once and ask the page to come back after
+# PUSH_CLIENT_POLL_SECONDS.
+
+DEFAULT_SETTINGS = {
+    # True only under a cooperative server, where a waiting request costs no thread
+    'PUSH_STREAMING': False,
+    'PUSH_CLIENT_POLL_SECONDS': 15,
+    'PUSH_POLL_INTERVAL': 1.0,
+    # Comment lines on idle streams, so proxies do not time them out
+    'PUSH_HEARTBEAT': 15,
+    # Reconnection delay suggested to EventSource clients
+    'PUSH_RETRY_MS': 3000,
+    'PUSH_STREAM_SECONDS': 300,
+    'PUSH_LONG_POLL_TIMEOUT': 25,
+}
+
+# Events a stream may fall behind by before it is closed to catch up by reconnecting
+MAX_PENDING = 100
+DISPATCH_BATCH = 500
+
+
+def event_payload(event):
+    return {'id': event['id'], 'issue_id': event['issue_id'], 'code': event['code'],
+            'message': event['message'], 'created_at': str(event['created_at'])}
+
+def format_sse(event):
+    return f"id: {event['id']}\nevent: notification\ndata: {json.dumps(event_payload(event))}\n\n"
+
+
+class Subscription:
+    """The events for one stream or long poll, queued by the dispatcher."""
+
+    def __init__(self, audiences, after=0):
+        self.audiences = audiences
+        # Highest event id delivered; the dispatcher may queue a backfilled event twice
+        self.after = after
+        self.overflowed = False
+        self._pending = collections.deque()
+        self._ready = threading.Event()
+
+    def matches(self, event):
+        return any(event['audience_type'] == audience_type and audience_key in (None, event['audience_key'])
+                   for audience_type, audience_key in self.audiences)
+
+    def put(self, event):
+        if len(self._pending) >= MAX_PENDING:
+            self.overflowed = True
+        else:
+            self._pending.append(event)
+        self._ready.set()
+
+    def take(self, events):
+        """Keep only the events not yet delivered, and advance past them."""
+        fresh = [event for event in events if event['id'] > self.after]
+        if fresh:
+            self.after = fresh[-1]['id']
+        return fresh
+
+    def get(self, timeout):
+        """Wait up to timeout seconds for events, and return those not yet delivered."""
+        if not self._pending:
+            self._ready.wait(timeout)
+        self._ready.clear()
+        events = []
+        while self._pending:
+            events.append(self._pending.popleft())
+        return self.take(events)
+
+
+class Hub:
+    """This process's open subscriptions and the dispatcher thread that feeds them."""
+
+    def __init__(self, app):
+        self.app = app
+        self.last_id = 0
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._subscriptions = set()
+                self._thread = threading.Thread(target=self._run, name='push-dispatcher', daemon=True)
+                self._thread.start()
+
+    def subscribe(self, audiences, after=0):
+        self.ensure_started()
+        subscription = Subscription(audiences, after)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self):
+        """Tell the dispatcher a write just committed, so it does not wait for its next poll."""
+        self._wake.set()
+
+    def dispatch(self, events):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for event in events:
+            for subscription in subscriptions:
+                if subscription.matches(event):
+                    subscription.put(event)
+
+    def poll(self, conn, seen):
+        """Dispatch whatever committed since data_version was `seen`; returns the new data_version."""
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == seen:
+            return seen
+        if not self._subscriptions:
+            # Nobody to tell: skip ahead rather than read the backlog later
+            self.last_id = notifications.latest_event_id(conn)
+            return version
+        while True:
+            rows = conn.execute("SELECT * FROM notification_events WHERE id > ? ORDER BY id LIMIT ?",
+                                (self.last_id, DISPATCH_BATCH)).fetchall()
+            if rows:
+                self.last_id = rows[-1]['id']
+                self.dispatch([dict(row, message=notifications.render(row)) for row in rows])
+            if len(rows) < DISPATCH_BATCH:
+                return version
+
+    def _run(self):
+        conn = None
+        seen = None
+        while True:
+            self._wake.wait(self.app.config['PUSH_POLL_INTERVAL'])
+            self._wake.clear()
+            try:
+                if conn is None:
+                    conn = get_read_pool(self.app).connect()
+                    # In this order a commit between the two reads is dispatched on the next poll
+                    seen = conn.execute("PRAGMA data_version").fetchone()[0]
+                    self.last_id = notifications.latest_event_id(conn)
+                seen = self.poll(conn, seen)
+            except Exception:
+                logger.exception('Notification dispatch failed')
+                if conn is not None:
+                    conn.close()
+                conn = None
+
+
+def get_hub(app=None):
+    # The dispatcher thread outlives the request, so it keeps the app itself rather than the proxy
+    return _extension('smartcampus_push_hub', Hub, app or current_app._get_current_object())
+
+def publish():
+    """Call after a write that notified someone has committed."""
+    get_hub().publish()
+
+def stream(hub, subscription, backlog, config):
+    """Yield the SSE stream for a subscription: backlog first, then live events and heartbeats.
+
+    Unsubscribes when the stream ends or the client goes away.
+    """
+    heartbeat = config['PUSH_HEARTBEAT']
+    deadline = time.monotonic() + config['PUSH_STREAM_SECONDS']
+    try:
+        yield f"retry: {config['PUSH_RETRY_MS']}\n\n"
+        for event in backlog:
+            yield format_sse(event)
+        # A stream that fell too far behind ends; the client reconnects and catches up from its last id
+        while not subscription.overflowed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            events = subscription.get(min(heartbeat, remaining))
+            if events:
+                yield ''.join(format_sse(event) for event in events)
+            else:
+                yield ': heartbeat\n\n'
+    finally:
+        hub.unsubscribe(subscription)
+
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
@@ -0,0 +1,267 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+import click
+from app.db import get_read_db, get_read_pool, run_write
+from app.utils import CLOSED_STATUSES, IST_OFFSET
+
+# Analytics rollups. Issues are aggregated into three tables that triggers
+# (migration 5) keep current on every insert, update and delete:
+#
+#   issue_rollup_daily   (day created, category, status, priority, location)
+#   issue_rollup_resolved (day resolved, category, priority, location)
+#   issue_rollup_totals  (category, status, priority, location), all time
+#
+# each holding an issue count, how many of those are resolved with a
+# resolved_at, and the summed resolution time in seconds. Days are IST
+# calendar days. The analytics page reads only these tables.
+
+# IST calendar date of a UTC timestamp column
+def ist_day(column):
+    return f"date({column}, '+5 hours', '+30 minutes')"
+
+RESOLVED_CONDITION = "status = 'Resolved' AND resolved_at IS NOT NULL"
+RESOLUTION_SECONDS = "(julianday(resolved_at) - julianday(created_at)) * 86400"
+
+DAILY_AGGREGATE = f'''
+    SELECT {ist_day('created_at')} AS day, category, coalesce(status, '') AS status,
+           coalesce(priority, '') AS priority, coalesce(location, '') AS location,
+           COUNT(*) AS issues,
+           SUM({RESOLVED_CONDITION}) AS resolved,
+           TOTAL(CASE WHEN {RESOLVED_CONDITION} THEN {RESOLUTION_SECONDS} END) AS resolution_seconds
+    FROM issues WHERE created_at >= ? AND created_at < ?
+    GROUP BY 1, 2, 3, 4, 5
+'''
+
+RESOLVED_AGGREGATE = f'''
+    SELECT {ist_day('resolved_at')} AS day, category,
+           coalesce(priority, '') AS priority, coalesce(location, '') AS location,
+           COUNT(*) AS resolved, TOTAL({RESOLUTION_SECONDS}) AS resolution_seconds
+    FROM issues WHERE status = 'Resolved' AND resolved_at >= ? AND resolved_at < ?
+    GROUP BY 1, 2, 3, 4
+'''
+
+DAILY_COLUMNS = ('day', 'category', 'status', 'priority', 'location', 'issues', 'resolved', 'resolution_seconds')
+RESOLVED_COLUMNS = ('day', 'category', 'priority', 'location', 'resolved', 'resolution_seconds')
+
+
+def utc_bounds(first_day, last_day):
+    """UTC timestamps bounding the IST days first_day..last_day (inclusive)."""
+    start = datetime.combine(first_day, datetime.min.time()) - IST_OFFSET
+    stop = datetime.combine(last_day + timedelta(days=1), datetime.min.time()) - IST_OFFSET
+    return start.strftime('%Y-%m-%d %H:%M:%S'), stop.strftime('%Y-%m-%d %H:%M:%S')
+
+def today_ist():
+    return (datetime.utcnow() + IST_OFFSET).date()
+
+def _range_rows(db, first_day, last_day):
+    bounds = utc_bounds(first_day, last_day)
+    daily = db.execute(DAILY_AGGREGATE, bounds).fetchall()
+    resolved = db.execute(RESOLVED_AGGREGATE, bounds).fetchall()
+    return [tuple(row) for row in daily], [tuple(row) for row in resolved]
+
+def _current_rollups(db, first_day, last_day):
+    days = (first_day.isoformat(), last_day.isoformat())
+    daily = db.execute(
+        f"SELECT {', '.join(DAILY_COLUMNS)} FROM issue_rollup_daily WHERE day BETWEEN ? AND ? ORDER BY 1, 2, 3, 4, 5",
+        days).fetchall()
+    resolved = db.execute(
+        f"SELECT {', '.join(RESOLVED_COLUMNS)} FROM issue_rollup_resolved WHERE day BETWEEN ? AND ? ORDER BY 1, 2, 3, 4",
+        days).fetchall()
+    return [tuple(row) for row in daily], [tuple(row) for row in resolved]
+
+def replace_range(db, first_day, last_day, rows=None):
+    """Replace the daily rollups for first_day..last_day, recomputing them unless rows are given."""
+    daily, resolved = rows or _range_rows(db, first_day, last_day)
+    days = (first_day.isoformat(), last_day.isoformat())
+    db.execute("DELETE FROM issue_rollup_daily WHERE day BETWEEN ? AND ?", days)
+    db.execute("DELETE FROM issue_rollup_resolved WHERE day BETWEEN ? AND ?", days)
+    db.executemany(
+        f"INSERT INTO issue_rollup_daily ({', '.join(DAILY_COLUMNS)}) VALUES ({', '.join('?' * len(DAILY_COLUMNS))})",
+        daily)
+    db.executemany(
+        f"INSERT INTO issue_rollup_resolved ({', '.join(RESOLVED_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(RESOLVED_COLUMNS))})",
+        resolved)
+
+def rebuild_totals(db):
+    db.execute("DELETE FROM issue_rollup_totals")
+    db.execute('''
+        INSERT INTO issue_rollup_totals (category, status, priority, location, issues, resolved, resolution_seconds)
+        SELECT category, status, priority, location, SUM(issues), SUM(resolved), TOTAL(resolution_seconds)
+        FROM issue_rollup_daily GROUP BY 1, 2, 3, 4 HAVING SUM(issues) != 0
+    ''')
+
+def rebuild_all(db):
+    """Recompute every rollup from issues inside the caller's transaction."""
+    db.execute("DELETE FROM issue_rollup_daily")
+    db.execute("DELETE FROM issue_rollup_resolved")
+    db.execute(f"INSERT INTO issue_rollup_daily ({', '.join(DAILY_COLUMNS)}) "
+               + DAILY_AGGREGATE.replace("WHERE created_at >= ? AND created_at < ?", ""))
+    db.execute(f"INSERT INTO issue_rollup_resolved ({', '.join(RESOLVED_COLUMNS)}) "
+               + RESOLVED_AGGREGATE.replace("resolved_at >= ? AND resolved_at < ?", "resolved_at IS NOT NULL"))
+    rebuild_totals(db)
+
+def day_ranges(first_day, last_day, days_per_range):
+    while first_day <= last_day:
+        stop = min(first_day + timedelta(days=days_per_range - 1), last_day)
+        yield first_day, stop
+        first_day = stop + timedelta(days=1)
+
+def rebuild(first_day=None, last_day=None, jobs=4, days_per_range=31):
+    """Rebuild the rollups for first_day..last_day (default: all history).
+
+    Ranges are aggregated in parallel on read-only connections, then each
+    is swapped in by one short write. The rollup rows a worker saw are
+    compared with the live ones under the write lock: if a trigger changed
+    the range in the meantime, that range is recomputed inside the write
+    instead. Returns the number of ranges rebuilt.
+    """
+    db = get_read_db()
+    whole_history = first_day is None and last_day is None
+    if first_day is None or last_day is None:
+        row = db.execute(
+            f"SELECT {ist_day('MIN(created_at)')}, {ist_day('MAX(created_at)')}, "
+            f"{ist_day('MAX(resolved_at)')} FROM issues").fetchone()
+        if row[0] is None:
+            run_write(rebuild_all)
+            return 0
+        first_day = first_day or date.fromisoformat(row[0])
+        last_day = last_day or max(date.fromisoformat(row[1]), date.fromisoformat(row[2] or row[1]), today_ist())
+
+    pool = get_read_pool()
+
+    def _aggregate(bounds):
+        conn = pool.acquire()
+        try:
+            # One read transaction so the aggregates and the rollups match
+            conn.execute("BEGIN")
+            return bounds, _range_rows(conn, *bounds), _current_rollups(conn, *bounds)
+        finally:
+            pool.release(conn)
+
+    def _apply(db, bounds, rows, seen):
+        if _current_rollups(db, *bounds) == seen:
+            replace_range(db, *bounds, rows=rows)
+        else:
+            replace_range(db, *bounds)
+
+    ranges = list(day_ranges(first_day, last_day, days_per_range))
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        for bounds, rows, seen in executor.map(_aggregate, ranges):
+            run_write(lambda db, bounds=bounds, rows=rows, seen=seen: _apply(db, bounds, rows, seen))
+
+    def _finish(db):
+        if whole_history:
+            # No issue falls outside the rebuilt days, so neither may a rollup row
+            days = (first_day.isoformat(), last_day.isoformat())
+            db.execute("DELETE FROM issue_rollup_daily WHERE day NOT BETWEEN ? AND ?", days)
+            db.execute("DELETE FROM issue_rollup_resolved WHERE day NOT BETWEEN ? AND ?", days)
+        rebuild_totals(db)
+
+    run_write(_finish)
+    return len(ranges)
+
+def _filters(category=None, priority=None):
+    where = []
+    params = []
+    if category:
+        where.append("category = ?")
+        params.append(category)
+    if priority:
+        where.append("priority = ?")
+        params.append(priority)
+    return where, params
+
+def rollup_rows(db, category=None, priority=None, since=None, until=None):
+    """Rollup rows (category, status, priority, location and the three measures) for the filters.
+
+    Without a date window they come straight from the all-time totals;
+    with one, the daily rows for those created days are summed.
+    """
+    where, params = _filters(category, priority)
+    if since is None and until is None:
+        where.append("issues != 0")
+        return db.execute(f'''
+            SELECT category, status, priority, location, issues, resolved, resolution_seconds
+            FROM issue_rollup_totals WHERE {' AND '.join(where)}
+        ''', params).fetchall()
+
+    where[:0] = ["day BETWEEN ? AND ?"]
+    params[:0] = [(since or date.min).isoformat(), (until or today_ist()).isoformat()]
+    return db.execute(f'''
+        SELECT category, status, priority, location,
+               SUM(issues) AS issues, SUM(resolved) AS resolved, TOTAL(resolution_seconds) AS resolution_seconds
+        FROM issue_rollup_daily WHERE {' AND '.join(where)}
+        GROUP BY 1, 2, 3, 4 HAVING SUM(issues) != 0
+    ''', params).fetchall()
+
+def summary(db, category=None, priority=None, since=None, until=None, top=3):
+    """Everything the analytics page shows, read from the rollup tables."""
+    categories = {}
+    statuses = {}
+    locations = {}
+    total = resolved = active_critical = 0
+    resolution_seconds = 0.0
+    for row in rollup_rows(db, category, priority, since, until):
+        categories[row['category']] = categories.get(row['category'], 0) + row['issues']
+        statuses[row['status']] = statuses.get(row['status'], 0) + row['issues']
+        if row['location']:
+            locations[row['location']] = locations.get(row['location'], 0) + row['issues']
+        if row['priority'] == 'High' and row['status'] not in CLOSED_STATUSES:
+            active_critical += row['issues']
+        total += row['issues']
+        resolved += row['resolved']
+        resolution_seconds += row['resolution_seconds']
+
+    where, params = _filters(category, priority)
+    resolved_today = db.execute(
+        "SELECT COALESCE(SUM(resolved), 0) FROM issue_rollup_resolved WHERE "
+        + ' AND '.join(["day = ?"] + where),
+        [today_ist().isoformat()] + params
+    ).fetchone()[0]
+
+    top_areas = sorted(locations.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        'categories': [{'category': name, 'cnt': cnt} for name, cnt in categories.items()],
+        'statuses': [{'status': name, 'cnt': cnt} for name, cnt in statuses.items()],
+        'top_areas': [{'location': name, 'cnt': cnt} for name, cnt in top_areas],
+        'total': total,
+        'resolved': resolved,
+        'resolved_today': resolved_today,
+        'active_critical': active_critical,
+        'resolution_rate': resolved / total * 100 if total else 0,
+        'avg_resolution_hours': resolution_seconds / resolved / 3600 if resolved else 0,
+    }
+
+def trend(db, since, until, category=None, priority=None):
+    """Issues created and resolved per IST day in since..until, zero-filled."""
+    where, params = _filters(category, priority)
+    where[:0] = ["day BETWEEN ? AND ?"]
+    params[:0] = [since.isoformat(), until.isoformat()]
+    condition = ' AND '.join(where)
+    created = dict(db.execute(
+        f"SELECT day, SUM(issues) FROM issue_rollup_daily WHERE {condition} GROUP BY day", params).fetchall())
+    resolved = dict(db.execute(
+        f"SELECT day, SUM(resolved) FROM issue_rollup_resolved WHERE {condition} GROUP BY day", params).fetchall())
+
+    days = []
+    day = since
+    while day <= until:
+        key = day.isoformat()
+        days.append({'day': key, 'created': created.get(key, 0), 'resolved': resolved.get(key, 0)})
+        day += timedelta(days=1)
+    return days
+
+
+@click.command('rollup-rebuild')
+@click.option('--since', type=click.DateTime(['%Y-%m-%d']), default=None, help='First IST day to rebuild.')
+@click.option('--until', type=click.DateTime(['%Y-%m-%d']), default=None, help='Last IST day to rebuild.')
+@click.option('--jobs', default=4, show_default=True, help='Date ranges aggregated in parallel.')
+@click.option('--days', 'days_per_range', default=31, show_default=True, help='Days per range.')
+def rollup_rebuild_command(since, until, jobs, days_per_range):
+    """Recompute the analytics rollup tables from the issues table."""
+    ranges = rebuild(since and since.date(), until and until.date(), jobs, days_per_range)
+    click.echo(f'Rebuilt analytics rollups ({ranges} date ranges).')
+
+def init_app(app):
+    app.cli.add_command(rollup_rebuild_command)
@@ -1,62 +1,162 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, session
-from datetime import datetime
-from app.db import get_db
+import gzip
+import hashlib
+import io
+from flask import Blueprint, render_template, request, flash, redirect, url_for, session, jsonify, abort, current_app
+from datetime import date, datetime, timedelta
+from app import assignment, columnar, counters, duplicates, events, exports, imports, notifications, push, rollups, sketches, sla, votes
+from app.cache import TTLCache
+from app.db import data_version, get_read_db, get_read_pool, run_write
+from app.pagination import paginate, per_page_arg, sort_arg
+from app.search import index_issues, page_arg, search_issues
 from app.utils import admin_required, login_required
+from werkzeug.utils import secure_filename
 
 bp = Blueprint('admin', __name__)
 
+# Issues one bulk action may change; bounds the transaction and the IN lists
+BULK_MAX_ISSUES = 500
+
 @bp.route('/admin/dashboard')
 @admin_required
 def dashboard():
-    db = get_db()
+    db = get_read_db()
     
     # Filters
     status = request.args.get('status')
     category = request.args.get('category')
+    q = request.args.get('q', '').strip()
+    sort = sort_arg(request.args)
     
-    query = '''
-        SELECT i.*, u.fullname as reporter_name 
-        FROM issues i JOIN users u ON i.reporter_id = u.id
-        WHERE 1=1
-    '''
+    where = []
     params = []
     
     if status:
-        query += " AND i.status = ?"
+        where.append("i.status = ?")
         params.append(status)
     if category:
-        query += " AND i.category = ?"
+        where.append("i.category = ?")
         params.append(category)
         
-    query += " ORDER BY i.created_at DESC"
-    
-    issues = db.execute(query, params).fetchall()
+    page_args = dict(status=status or None, category=category or None, q=q or None,
+                     sort=sort if sort != 'newest' else None)
+    if q:
+        # Ranked full-text matches, paged by number
+        issues = search_issues(db, q, where, params, page_arg(request.args), per_page_arg(request.args))
+        prev_url = issues.prev_cursor and url_for('admin.dashboard', page=issues.prev_cursor,
+                                                  per_page=issues.per_page, **page_args)
+        next_url = issues.next_cursor and url_for('admin.dashboard', page=issues.next_cursor,
+                                                  per_page=issues.per_page, **page_args)
+    else:
+        issues = paginate(db, '''
+            SELECT i.*, u.fullname as reporter_name 
+            FROM issues i JOIN users u ON i.reporter_id = u.id
+        ''', where, params, 'i', request.args, sort=sort)
+        prev_url = issues.prev_cursor and url_for('admin.dashboard', before=issues.prev_cursor,
+                                                  per_page=issues.per_page, **page_args)
+        next_url = issues.next_cursor and url_for('admin.dashboard', after=issues.next_cursor,
+                                                  per_page=issues.per_page, **page_args)
     
-    # Validation Code to ensure we don't crash if DB is empty
-    all_issues = db.execute("SELECT status FROM issues").fetchall()
-    total = len(all_issues)
-    submitted = sum(1 for i in all_issues if i['status'] == 'Submitted')
-    in_progress = sum(1 for i in all_issues if i['status'] == 'In Progress')
-    resolved = sum(1 for i in all_issues if i['status'] == 'Resolved')
+    counts = counters.counts(db, 'status')
+    total = sum(counts.values())
+    submitted = counts.get('Submitted', 0)
+    in_progress = counts.get('In Progress', 0)
+    resolved = counts.get('Resolved', 0)
     
     # Staff Workload
-    staff_workload = db.execute('''
-        SELECT assigned_to, COUNT(*) as active_count
-        FROM issues WHERE assigned_to IS NOT NULL AND status != 'Resolved'
-        GROUP BY assigned_to
-    ''').fetchall()
+    staff_workload = counters.workload(db)
+    sla_summary = sla.summary(db)
     
     # Fetch all staff for assignment dropdown, grouped by department if possible
     # We'll just pass all staff for now, template can filter if needed or we just listed them all
     # Improved: Fetch staff and their department
-    staff_list = db.execute("SELECT fullname, department FROM users WHERE role = 'staff'").fetchall()
+    staff_list = db.execute("SELECT id, fullname, department FROM users WHERE role = 'staff'").fetchall()
 
     return render_template('admin_dashboard.html', 
                          issues=issues, total=total, 
                          submitted=submitted, in_progress=in_progress, 
                          resolved_count=resolved, staff_workload=staff_workload,
-                         staff_list=staff_list,
-                         status_filter=status, category_filter=category)
+                         staff_list=staff_list, prev_url=prev_url, next_url=next_url,
+                         status_filter=status, category_filter=category, search_query=q, sort=sort,
+                         auto_assign=current_app.config['AUTO_ASSIGN'], sla_summary=sla_summary)
+
+@bp.route('/admin/search')
+@admin_required
+def search():
+    q = request.args.get('q', '').strip()
+    where = []
+    params = []
+    for column in ('status', 'category'):
+        if request.args.get(column):
+            where.append(f"i.{column} = ?")
+            params.append(request.args[column])
+
+    results = search_issues(get_read_db(), q, where, params, page_arg(request.args), per_page_arg(request.args))
+    return jsonify(
+        query=q,
+        results=[{
+            'id': issue['id'],
+            'title': issue['title'],
+            'category': issue['category'],
+            'status': issue['status'],
+            'priority': issue['priority'],
+            'reporter': issue['reporter_name'],
+            'created_at': issue['created_at'],
+            'snippet': str(issue['snippet']),
+            'url': url_for('student.issue_detail', issue_id=issue['id']),
+        } for issue in results],
+        next_page=results.next_cursor,
+        prev_page=results.prev_cursor,
+    )
+
+@bp.route('/admin/export')
+@admin_required
+def export_issues():
+    """Stream the issues matching the dashboard filters (plus since/until) as CSV or NDJSON; gzip=1 compresses."""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in exports.FORMATS:
+        abort(400, f"format must be one of {', '.join(exports.FORMATS)}")
+    try:
+        filters = exports.parse_filters(request.args)
+    except ValueError:
+        abort(400, 'Dates must be YYYY-MM-DD')
+    compress = request.args.get('gzip') == '1'
+
+    response = current_app.response_class(
+        exports.stream(get_read_pool(), filters, fmt, compress),
+        mimetype='application/gzip' if compress else exports.FORMATS[fmt][0])
+    response.headers['Content-Disposition'] = f'attachment; filename="{exports.filename(fmt, compress)}"'
+    response.cache_control.private = True
+    response.cache_control.no_store = True
+    return response
+
+@bp.route('/admin/import', methods=['POST'])
+@admin_required
+def import_issues():
+    """Import historical issues from an uploaded CSV (or .csv.gz); uploading the same file again resumes it."""
+    request.max_content_length = current_app.config['IMPORT_MAX_CONTENT_LENGTH']
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Choose a CSV file to import.', 'error')
+        return redirect(url_for('admin.dashboard'))
+
+    filename = secure_filename(upload.filename)
+    if filename.endswith('.gz'):
+        lines = gzip.open(upload.stream, 'rt', encoding='utf-8-sig', newline='')
+    else:
+        lines = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    try:
+        summary = imports.import_issues(lines, f'upload:{filename}', current_app.config,
+                                        create_reporters=request.form.get('create_reporters') == '1')
+    except (ValueError, OSError) as error:
+        # Batches committed before the failure stay; uploading the same file again resumes after them
+        flash(f'Import stopped: {error}', 'error')
+        return redirect(url_for('admin.dashboard'))
+
+    message = f"Imported {summary['imported']:,} issues; rejected {summary['rejected']:,} rows."
+    if summary['errors']:
+        message += ' ' + '; '.join(f'line {line}: {problem}' for line, problem in summary['errors'][:5])
+    flash(message, 'success' if summary['imported'] else 'error')
+    return redirect(url_for('admin.dashboard'))
 
 @bp.route('/admin/update_issue/<int:issue_id>', methods=['POST'])
 @login_required # Allow staff to update too eventually? For now admin_required mostly
@@ -67,71 +167,279 @@ def update_issue(issue_id):
          return redirect(url_for('student.dashboard'))
 
     status = request.form.get('status')
-    assigned_to = request.form.get('assigned_to')
-    
-    db = get_db()
-    issue = db.execute('SELECT * FROM issues WHERE id = ?', (issue_id,)).fetchone()
+    assignee_id = request.form.get('assignee_id', type=int)
+    actor_id = session['user_id']
+    auto_assign = current_app.config['AUTO_ASSIGN']
+
+    assignee_name = None
+    if assignee_id:
+        assignee = get_read_db().execute(
+            "SELECT fullname FROM users WHERE id = ? AND role = 'staff'", (assignee_id,)).fetchone()
+        if assignee is None:
+            flash('Staff member not found', 'error')
+            return redirect(request.referrer or url_for('admin.dashboard'))
+        assignee_name = assignee['fullname']
     
-    if not issue:
+    def _update(db, workloads):
+        issue = db.execute('SELECT * FROM issues WHERE id = ?', (issue_id,)).fetchone()
+        if not issue:
+            return None
+        if auto_assign:
+            workloads.sync(db)
+
+        updates = []
+        params = []
+
+        if status and status != issue['status']:
+            updates.append("status = ?")
+            params.append(status)
+            # Notify Reporter
+            notifications.notify(db, 'user', issue['reporter_id'], issue_id, 'status_changed', status=status)
+            events.record(db, issue_id, events.STATUS, status, actor_id)
+
+            if status == 'Resolved':
+                 updates.append("resolved_at = ?")
+                 params.append(datetime.utcnow())
+            if issue['status'] == duplicates.MERGED:
+                # Reopened: it is its own issue again
+                updates.append("merged_into = NULL")
+
+        if assignee_id and assignee_id != issue['assignee_id']:
+            updates.append("assignee_id = ?")
+            params.append(assignee_id)
+            # Notify Reporter
+            notifications.notify(db, 'user', issue['reporter_id'], issue_id, 'assigned', assignee=assignee_name)
+            events.record(db, issue_id, events.ASSIGNED, str(assignee_id), actor_id)
+
+        if updates and issue['acknowledged_at'] is None:
+            # The first staff action acknowledges the issue for SLA purposes
+            updates.append("acknowledged_at = CURRENT_TIMESTAMP")
+
+        if updates:
+            query = f"UPDATE issues SET {', '.join(updates)} WHERE id = ?"
+            params.append(issue_id)
+            db.execute(query, params)
+            # Resolving, reopening or reassigning moves the issue between sketch buckets and counters
+            updated = db.execute('SELECT * FROM issues WHERE id = ?', (issue_id,)).fetchone()
+            sketches.record_change(db, issue, updated)
+            counters.record_change(db, issue, updated)
+            duplicates.record_change(db, issue, updated)
+            if auto_assign:
+                workloads.record_change(db, issue, updated)
+        return bool(updates)
+
+    updated = assignment.run_write(_update)
+    if updated:
+        push.publish()
+
+    if updated is None:
         flash('Issue not found', 'error')
         return redirect(url_for('admin.dashboard'))
-        
-    updates = []
-    params = []
-    
-    if status and status != issue['status']:
-        updates.append("status = ?")
-        params.append(status)
-        # Notify Reporter
-        db.execute(
-            'INSERT INTO notifications (user_id, issue_id, message) VALUES (?, ?, ?)',
-            (issue['reporter_id'], issue_id, f"Issue #{issue_id} status updated to {status}")
-        )
-        
-        if status == 'Resolved':
-             updates.append("resolved_at = ?")
-             params.append(datetime.utcnow())
-
-    if assigned_to and assigned_to != issue['assigned_to']:
-        updates.append("assigned_to = ?")
-        params.append(assigned_to)
-        # Notify Reporter
-        db.execute(
-            'INSERT INTO notifications (user_id, issue_id, message) VALUES (?, ?, ?)',
-            (issue['reporter_id'], issue_id, f"Issue #{issue_id} assigned to {assigned_to}")
-        )
-        
-    if updates:
-        query = f"UPDATE issues SET {', '.join(updates)} WHERE id = ?"
-        params.append(issue_id)
-        db.execute(query, params)
-        db.commit()
+
+    if updated:
         flash('Issue updated successfully.', 'success')
         
     return redirect(request.referrer or url_for('admin.dashboard'))
 
+@bp.route('/admin/issues/bulk', methods=['POST'])
+@admin_required
+def bulk_update():
+    """Set the status and/or assignee of many issues in one transaction.
+
+    Takes issue_ids plus status and/or assignee_id, from the dashboard form
+    or as JSON. JSON callers get {"results": {id: "updated" | "unchanged" |
+    "not_found"}}; the form is sent back to the dashboard with a summary.
+    """
+    as_json = request.is_json
+    data = request.get_json(silent=True) if as_json else request.form
+    if as_json and not isinstance(data, dict):
+        return jsonify(error='The body must be a JSON object.'), 400
+    issue_ids = data.get('issue_ids') if as_json else data.getlist('issue_ids')
+    # A string would be read one digit at a time, and booleans are ints to Python
+    if as_json and not (isinstance(issue_ids, list)
+                        and all(isinstance(issue_id, int) and not isinstance(issue_id, bool)
+                                for issue_id in issue_ids)):
+        return jsonify(error='issue_ids must be a list of issue ids.'), 400
+    status = data.get('status') or None
+    assignee_id = data.get('assignee_id') or None
+    actor_id = session['user_id']
+    auto_assign = current_app.config['AUTO_ASSIGN']
+
+    def _reply(message, category, results=None, code=200):
+        if as_json:
+            if category == 'error':
+                return jsonify(error=message), code
+            return jsonify(results={str(issue_id): result for issue_id, result in results.items()})
+        flash(message, category)
+        return redirect(request.referrer or url_for('admin.dashboard'))
+
+    try:
+        issue_ids = list(dict.fromkeys(int(issue_id) for issue_id in issue_ids or ()))
+        assignee_id = int(assignee_id) if assignee_id is not None else None
+    except (TypeError, ValueError):
+        return _reply('Issue and staff ids must be numbers.', 'error', code=400)
+    if not issue_ids:
+        return _reply('Select the issues to update.', 'error', code=400)
+    if len(issue_ids) > BULK_MAX_ISSUES:
+        return _reply(f'At most {BULK_MAX_ISSUES} issues can be updated at once.', 'error', code=400)
+    if status is None and assignee_id is None:
+        return _reply('Choose a status or a staff member to apply.', 'error', code=400)
+    # Merging needs a target issue, so it is not a bulk action
+    if status is not None and status not in ('Submitted', 'In Progress', 'Resolved'):
+        return _reply(f'Unknown status {status!r}.', 'error', code=400)
+
+    assignee_name = None
+    if assignee_id:
+        assignee = get_read_db().execute(
+            "SELECT fullname FROM users WHERE id = ? AND role = 'staff'", (assignee_id,)).fetchone()
+        if assignee is None:
+            return _reply('Staff member not found', 'error', code=400)
+        assignee_name = assignee['fullname']
+
+    def _bulk(db, workloads):
+        before = {row['id']: row for row in db.execute(
+            f"SELECT * FROM issues WHERE id IN ({', '.join('?' * len(issue_ids))})", issue_ids)}
+        changed = [issue_id for issue_id, issue in before.items()
+                   if (status and status != issue['status']) or (assignee_id and assignee_id != issue['assignee_id'])]
+        results = {issue_id: 'not_found' if issue_id not in before else 'updated' if issue_id in changed
+                   else 'unchanged' for issue_id in issue_ids}
+        if not changed:
+            return results
+        if auto_assign:
+            workloads.sync(db)
+
+        # Every SET expression reads the row as it was before this UPDATE
+        now = datetime.utcnow()
+        marks = ', '.join('?' * len(changed))
+        db.execute(f'''
+            UPDATE issues SET
+                resolved_at = CASE WHEN ? = 'Resolved' AND status IS NOT 'Resolved' THEN ? ELSE resolved_at END,
+                merged_into = CASE WHEN ? IS NOT NULL AND status = ? THEN NULL ELSE merged_into END,
+                status = coalesce(?, status),
+                assignee_id = coalesce(?, assignee_id),
+                acknowledged_at = coalesce(acknowledged_at, CURRENT_TIMESTAMP)
+            WHERE id IN ({marks})
+        ''', (status, now, status, duplicates.MERGED, status, assignee_id, *changed))
+
+        history = []
+        notices = []
+        stamp = now.strftime('%Y-%m-%d %H:%M:%S')
+        for issue_id in changed:
+            issue = before[issue_id]
+            if status and status != issue['status']:
+                history.append((issue_id, events.STATUS, status, actor_id, stamp))
+                notices.append(('user', issue['reporter_id'], issue_id, 'status_changed', {'status': status}))
+            if assignee_id and assignee_id != issue['assignee_id']:
+                history.append((issue_id, events.ASSIGNED, str(assignee_id), actor_id, stamp))
+                notices.append(('user', issue['reporter_id'], issue_id, 'assigned', {'assignee': assignee_name}))
+        events.record_many(db, history)
+        notifications.notify_many(db, notices)
+
+        after = {row['id']: row for row in db.execute(f"SELECT * FROM issues WHERE id IN ({marks})", changed)}
+        changes = [(before[issue_id], after[issue_id]) for issue_id in changed]
+        sketches.record_changes(db, changes)
+        counters.record_changes(db, changes)
+        for old, new in changes:
+            duplicates.record_change(db, old, new)
+            if auto_assign:
+                workloads.record_change(db, old, new)
+        return results
+
+    results = assignment.run_write(_bulk)
+    updated = sum(result == 'updated' for result in results.values())
+    if updated:
+        push.publish()
+    missing = sum(result == 'not_found' for result in results.values())
+    message = f"Updated {updated} issue{'s' if updated != 1 else ''}"
+    if len(issue_ids) - updated - missing:
+        message += f'; {len(issue_ids) - updated - missing} already matched'
+    if missing:
+        message += f'; {missing} not found'
+    return _reply(message + '.', 'success', results)
+
+@bp.route('/admin/issue/<int:issue_id>/merge', methods=['POST'])
+@admin_required
+def merge_issue(issue_id):
+    """Close a duplicate into the issue it repeats, moving its comments, notifications and backers there."""
+    target_id = request.form.get('into', type=int)
+    actor_id = session['user_id']
+    auto_assign = current_app.config['AUTO_ASSIGN']
+    if not target_id or target_id == issue_id:
+        flash('Choose another issue to merge into.', 'error')
+        return redirect(url_for('student.issue_detail', issue_id=issue_id))
+
+    def _merge(db, workloads):
+        issue = db.execute('SELECT * FROM issues WHERE id = ?', (issue_id,)).fetchone()
+        target = db.execute('SELECT * FROM issues WHERE id = ?', (target_id,)).fetchone()
+        if not issue or not target:
+            return 'Issue not found'
+        if issue['status'] == duplicates.MERGED or target['status'] == duplicates.MERGED:
+            return 'Merged issues cannot be merged again'
+        if auto_assign:
+            workloads.sync(db)
+
+        db.execute('UPDATE comments SET issue_id = ? WHERE issue_id = ?', (target_id, issue_id))
+        db.execute('UPDATE notification_events SET issue_id = ? WHERE issue_id = ?', (target_id, issue_id))
+        # The duplicate's reporter and backers now back the canonical issue
+        votes.move(db, issue_id, target_id, exclude_user=target['reporter_id'])
+        if issue['reporter_id'] != target['reporter_id']:
+            votes.add(db, target_id, issue['reporter_id'], issue['created_at'])
+        # Moving comments does not fire the search triggers
+        index_issues(db, issue_id, issue_id)
+        index_issues(db, target_id, target_id)
+
+        db.execute('''
+            UPDATE issues SET status = ?, merged_into = ?, resolved_at = ?,
+                              acknowledged_at = coalesce(acknowledged_at, CURRENT_TIMESTAMP)
+            WHERE id = ?
+        ''', (duplicates.MERGED, target_id, datetime.utcnow(), issue_id))
+        events.record(db, issue_id, events.MERGED, str(target_id), actor_id)
+        events.record(db, target_id, events.DUPLICATE, str(issue_id), actor_id)
+        notifications.notify(db, 'user', issue['reporter_id'], target_id, 'merged', duplicate=issue_id)
+
+        updated = db.execute('SELECT * FROM issues WHERE id = ?', (issue_id,)).fetchone()
+        sketches.record_change(db, issue, updated)
+        counters.record_change(db, issue, updated)
+        duplicates.record_change(db, issue, updated)
+        if auto_assign:
+            workloads.record_change(db, issue, updated)
+        return None
+
+    error = assignment.run_write(_merge)
+    if not error:
+        push.publish()
+    if error:
+        flash(error, 'error')
+        return redirect(url_for('student.issue_detail', issue_id=issue_id))
+    flash(f'Issue #CMP-{issue_id} merged into #CMP-{target_id}.', 'success')
+    return redirect(url_for('student.issue_detail', issue_id=target_id))
+
 @bp.route('/admin/issue/<int:issue_id>/comment', methods=['POST'])
 @login_required
 def add_comment(issue_id):
     content = request.form.get('content')
     if content:
-        db = get_db()
-        db.execute(
-            'INSERT INTO comments (issue_id, user_id, content) VALUES (?, ?, ?)',
-            (issue_id, session['user_id'], content)
-        )
-        
-        # Notify relevant party
-        issue = db.execute('SELECT reporter_id FROM issues WHERE id = ?', (issue_id,)).fetchone()
-        
-        # If Admin commented, notify Student. If Student commented, notify Admin (in future)
-        if session['role'] in ['admin', 'staff'] and issue:
-             db.execute(
-                'INSERT INTO notifications (user_id, issue_id, message) VALUES (?, ?, ?)',
-                (issue['reporter_id'], issue_id, f"New comment on Issue #{issue_id}")
+        user_id = session['user_id']
+        role = session['role']
+
+        def _comment(db):
+            db.execute(
+                'INSERT INTO comments (issue_id, user_id, content) VALUES (?, ?, ?)',
+                (issue_id, user_id, content)
             )
-            
-        db.commit()
+
+            # Notify relevant party
+            issue = db.execute('SELECT reporter_id FROM issues WHERE id = ?', (issue_id,)).fetchone()
+
+            # If Admin commented, notify Student. If Student commented, notify Admin (in future)
+            if role in ['admin', 'staff'] and issue:
+                notifications.notify(db, 'user', issue['reporter_id'], issue_id, 'comment')
+                events.record(db, issue_id, events.COMMENT, actor_id=user_id)
+                db.execute("UPDATE issues SET acknowledged_at = CURRENT_TIMESTAMP WHERE id = ? AND acknowledged_at IS NULL",
+                           (issue_id,))
+
+        run_write(_comment)
+        push.publish()
         flash('Comment added.', 'success')
         
     return redirect(url_for('student.issue_detail', issue_id=issue_id))
@@ -139,18 +447,9 @@ def add_comment(issue_id):
 @bp.route('/analytics')
 @admin_required
 def analytics():
-    db = get_db()
-    
-    # 1. Categories Data - FIXED LOGIC
-    # Get all categories and their counts
-    categories_query = db.execute('''
-        SELECT category, COUNT(*) as cnt 
-        FROM issues 
-        GROUP BY category
-    ''').fetchall()
-    
-    # Convert Row objects to dicts for template
-    categories = [{'category': row['category'], 'cnt': row['cnt']} for row in categories_query]
+    # Every figure comes from the trigger-maintained rollup tables
+    _, stats = _cached_analytics('summary', {}, lambda db: rollups.summary(db))
+    categories = stats['categories']
     
     # Prepare data for Chart.js
     categories_labels = [c['category'] for c in categories]
@@ -159,77 +458,188 @@ def analytics():
     # Calculate max count for bar heights (legacy support if needed, but Chart.js handles scaling)
     max_cat_count = max([c['cnt'] for c in categories]) if categories else 0
     
-    # 2. Status Data
-    statuses_query = db.execute('''
-        SELECT status, COUNT(*) as cnt 
-        FROM issues 
-        GROUP BY status
-    ''').fetchall()
-    statuses = [{'status': row['status'], 'cnt': row['cnt']} for row in statuses_query]
-    
-    # 3. Top Locations
-    top_location = db.execute('''
-        SELECT location, COUNT(*) as cnt 
-        FROM issues 
-        WHERE location IS NOT NULL AND location != '' 
-        GROUP BY location 
-        ORDER BY cnt DESC LIMIT 1
-    ''').fetchone()
-    
-    top_areas = db.execute('''
-        SELECT location, COUNT(*) as cnt 
-        FROM issues 
-        WHERE location IS NOT NULL AND location != '' 
-        GROUP BY location 
-        ORDER BY cnt DESC LIMIT 3
-    ''').fetchall()
-
-    # 4. KPI Metrics
-    total = db.execute("SELECT COUNT(*) FROM issues").fetchone()[0]
-    
-    # Correct resolution rate and today's stats using IST if needed, but here simple date is fine if resolved_at is UTC
-    # Actually, to get 'today' in IST:
-    from app.utils import IST_OFFSET
-    now_ist = datetime.utcnow() + IST_OFFSET
-    today_ist_str = now_ist.strftime('%Y-%m-%d')
-    
-    resolved_today = db.execute(
-        "SELECT COUNT(*) FROM issues WHERE status = 'Resolved' AND date(resolved_at, '+5 hours', '+30 minutes') = ?",
-        (today_ist_str,)
-    ).fetchone()[0]
-    
-    active_critical = db.execute(
-        "SELECT COUNT(*) FROM issues WHERE priority = 'High' AND status != 'Resolved'"
-    ).fetchone()[0]
+    top_areas = stats['top_areas']
+    top_location = top_areas[0] if top_areas else None
 
-    resolution_rate = 0
-    avg_resolution_hours = 0
-    
-    resolved_issues = db.execute(
-        "SELECT created_at, resolved_at FROM issues WHERE status = 'Resolved' AND resolved_at IS NOT NULL"
-    ).fetchall()
-    
-    if total > 0:
-        resolution_rate = (len(resolved_issues) / total) * 100
-        
-    if resolved_issues:
-        total_seconds = 0
-        for issue in resolved_issues:
-            # SQLite TIMESTAMP are strings usually, but parse_decltypes might help. 
-            # If they are strings:
-            try:
-                c_at = issue['created_at'] if isinstance(issue['created_at'], datetime) else datetime.strptime(issue['created_at'], '%Y-%m-%d %H:%M:%S')
-                r_at = issue['resolved_at'] if isinstance(issue['resolved_at'], datetime) else datetime.strptime(issue['resolved_at'], '%Y-%m-%d %H:%M:%S')
-                total_seconds += (r_at - c_at).total_seconds()
-            except (ValueError, TypeError):
-                continue
-        
-        avg_resolution_hours = (total_seconds / len(resolved_issues)) / 3600
+    # Resolution-time percentiles over the selected window (default: all time)
+    window = request.args.get('window', type=int)
+    if window not in PERCENTILE_WINDOWS:
+        window = None
+    since = rollups.today_ist() - timedelta(days=window - 1) if window else None
+    _, percentiles = _cached_analytics(
+        'percentiles', {'since': since},
+        lambda db: {dimension: sketches.quantiles(db, dimension, since) for dimension in sketches.DIMENSIONS})
 
     return render_template('analytics.html',
                          categories=categories, max_cat_count=max_cat_count,
                          categories_labels=categories_labels, categories_data=categories_data,
-                         statuses=statuses, total=total,
+                         statuses=stats['statuses'], total=stats['total'],
                          top_location=top_location, top_areas=top_areas,
-                         resolved_today=resolved_today, active_critical=active_critical,
-                         resolution_rate=resolution_rate, avg_resolution_hours=avg_resolution_hours)
+                         resolved_today=stats['resolved_today'], active_critical=stats['active_critical'],
+                         resolution_rate=stats['resolution_rate'],
+                         avg_resolution_hours=stats['avg_resolution_hours'],
+                         percentiles=percentiles, window=window, percentile_windows=PERCENTILE_WINDOWS,
+                         columnar_enabled=columnar.available())
+
+
+# Analytics results keyed by (chart, filters, IST day) and stamped with the
+# issues data_version they were computed from; any issue write bumps the
+# version, so a stale entry is recomputed on its next use.
+_analytics_cache = TTLCache(ttl=300)
+
+ANALYTICS_MAX_DAYS = 366
+PERCENTILE_WINDOWS = (7, 30, 90)
+
+def _analytics_filters(args):
+    """Parse category/priority and an optional window (days=N or since/until) from args."""
+    filters = {}
+    for name in ('category', 'priority'):
+        if args.get(name):
+            filters[name] = args[name]
+    try:
+        if args.get('days'):
+            days = args.get('days', type=int)
+            if days is None or not 1 <= days <= ANALYTICS_MAX_DAYS:
+                abort(400, f'days must be between 1 and {ANALYTICS_MAX_DAYS}')
+            filters['until'] = rollups.today_ist()
+            filters['since'] = filters['until'] - timedelta(days=days - 1)
+        else:
+            for name in ('since', 'until'):
+                if args.get(name):
+                    filters[name] = date.fromisoformat(args[name])
+    except ValueError:
+        abort(400, 'Dates must be YYYY-MM-DD')
+    return filters
+
+def _cached_analytics(name, filters, compute, version=None):
+    """Return (version, payload), computing payload with compute(db) on a cache miss."""
+    db = get_read_db()
+    if version is None:
+        version = data_version(db, 'issues')
+    key = (name, tuple(sorted(filters.items())), rollups.today_ist())
+    entry = _analytics_cache.get(key)
+    if entry is not None and entry[0] == version:
+        return entry
+    entry = (version, compute(db))
+    _analytics_cache.set(key, entry)
+    return entry
+
+def _analytics_etag(name, filters, version):
+    raw = repr((name, sorted(filters.items()), rollups.today_ist(), version))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+def _chart_payload(chart, stats):
+    if chart == 'categories':
+        return {'labels': [c['category'] for c in stats['categories']],
+                'data': [c['cnt'] for c in stats['categories']]}
+    if chart == 'statuses':
+        return {'statuses': stats['statuses']}
+    if chart == 'locations':
+        return {'locations': stats['top_areas']}
+    return {key: stats[key] for key in ('total', 'resolved', 'resolved_today', 'active_critical',
+                                         'resolution_rate', 'avg_resolution_hours')}
+
+COLUMNAR_CHARTS = ('heatmap', 'backlog', 'crosstab')
+ANALYTICS_CHARTS = ('summary', 'categories', 'statuses', 'locations', 'trend', 'percentiles') + COLUMNAR_CHARTS
+
+@bp.route('/api/analytics/<chart>')
+@admin_required
+def analytics_api(chart):
+    if chart not in ANALYTICS_CHARTS:
+        abort(404)
+    filters = _analytics_filters(request.args)
+    if chart == 'locations':
+        filters['top'] = max(1, min(request.args.get('top', 3, type=int) or 3, 20))
+    if chart == 'percentiles':
+        # Each sketch covers one dimension; category/priority pick the dimension, not a filter
+        filters = {key: value for key, value in filters.items() if key in ('since', 'until')}
+        filters['dimension'] = request.args.get('dimension', 'category')
+        if filters['dimension'] not in sketches.DIMENSIONS:
+            abort(400, f"dimension must be one of {', '.join(sketches.DIMENSIONS)}")
+    if chart == 'trend':
+        filters.setdefault('until', rollups.today_ist())
+        filters.setdefault('since', filters['until'] - timedelta(days=29))
+        if (filters['until'] - filters['since']).days >= ANALYTICS_MAX_DAYS:
+            abort(400, f'The trend window is limited to {ANALYTICS_MAX_DAYS} days')
+
+    if chart in COLUMNAR_CHARTS:
+        return _columnar_chart(chart, filters)
+
+    # Revalidation is answered from the version alone, before any rollup is read
+    version = data_version(get_read_db(), 'issues')
+    etag = _analytics_etag(chart, filters, version)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        if chart == 'trend':
+            _, payload = _cached_analytics(chart, filters, lambda db: {'days': rollups.trend(db, **filters)},
+                                           version)
+        elif chart == 'percentiles':
+            _, payload = _cached_analytics(
+                chart, filters, lambda db: {'percentiles': sketches.quantiles(db, **filters)}, version)
+        else:
+            # The raw summary is cached, shared with the analytics page; each chart picks its part
+            _, stats = _cached_analytics('summary', filters, lambda db: rollups.summary(db, **filters), version)
+            payload = _chart_payload(chart, stats)
+        response = jsonify(payload)
+    return _revalidated(response, etag)
+
+def _revalidated(response, etag):
+    response.set_etag(etag)
+    # Admin-only data: browsers may keep it but must revalidate every time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def _columnar_chart(chart, filters):
+    """Heatmap, backlog and cross-tab charts computed with NumPy over the columnar snapshot."""
+    if not columnar.available():
+        abort(404)
+    # These charts cover every issue in the window; category/priority filters do not apply
+    since, until = filters.get('since'), filters.get('until')
+    if chart == 'backlog':
+        until = until or rollups.today_ist()
+        since = since or until - timedelta(days=89)
+    if chart == 'crosstab':
+        rows = request.args.get('rows', 'category')
+        cols = request.args.get('columns', 'location')
+        if rows not in columnar.DICTIONARY_COLUMNS or cols not in columnar.DICTIONARY_COLUMNS:
+            abort(400, f"rows and columns must be one of {', '.join(columnar.DICTIONARY_COLUMNS)}")
+        top = max(1, min(request.args.get('top', 10, type=int) or 10, 50))
+    params = {'since': since, 'until': until}
+    if chart == 'crosstab':
+        params.update(rows=rows, columns=cols, top=top)
+
+    # The snapshot generation versions these results instead of data_version
+    frame = columnar.get_store().get_frame()
+    etag = _analytics_etag(chart, params, frame.generation)
+    if request.if_none_match.contains(etag):
+        return _revalidated(current_app.response_class(status=304), etag)
+
+    start, stop = columnar.epoch_bounds(since, until)
+    if chart == 'heatmap':
+        payload = {'weekdays': ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'],
+                   'counts': columnar.hour_of_week(frame, start, stop).tolist()}
+    elif chart == 'backlog':
+        # Sample the open count at the end of each IST day
+        points, open_counts = columnar.backlog(frame, start + columnar.DAY - 1, stop - 1)
+        payload = {'days': [(since + timedelta(days=n)).isoformat() for n in range(len(points))],
+                   'open': open_counts.tolist()}
+    else:
+        row_labels, col_labels, table = columnar.crosstab(frame, rows, cols, top, start, stop)
+        payload = {'rows': row_labels, 'columns': col_labels, 'counts': table.tolist()}
+    return _revalidated(jsonify(payload), etag)
+
+@bp.route('/api/events')
+@admin_required
+def events_api():
+    """Replay the issue event log from `after` (an event id) in batches of up to `limit`."""
+    after = max(request.args.get('after', 0, type=int) or 0, 0)
+    limit = max(1, min(request.args.get('limit', events.REPLAY_BATCH, type=int) or events.REPLAY_BATCH,
+                       events.MAX_REPLAY_BATCH))
+    batch = events.replay(get_read_db(), after, limit)
+    return jsonify(
+        events=[dict(row) for row in batch],
+        next_after=batch[-1]['id'] if batch else after,
+        more=len(batch) == limit,
+    )
@@ -0,0 +1,228 @@
+import hashlib
+from datetime import datetime
+from flask import Blueprint, abort, current_app, jsonify, request, session, url_for
+from werkzeug.exceptions import HTTPException
+from app import notifications
+from app.db import get_read_db
+from app.pagination import MAX_PER_PAGE, paginate, per_page_arg, sort_arg
+from app.utils import api_login_required
+
+# Versioned JSON API for the campus mobile app, over the same data as the
+# pages. It uses the site's session cookie, so clients log in through
+# /login first. Issue lists are keyset-paginated with the dashboards'
+# opaque cursors (pass next_cursor back as `after`, prev_cursor as
+# `before`). Every issue endpoint takes `fields` (comma-separated) to pick
+# what it returns; list views leave out description and image_url unless
+# asked.
+#
+# Triggers bump an issue's version and stamp updated_at whenever it or its
+# comments change (migration 15). Single issues and comment threads carry
+# an ETag built from the version and Last-Modified from updated_at, so a
+# client revalidating an unchanged issue gets an empty 304 after one
+# primary-key lookup.
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+BATCH_MAX_IDS = 100
+
+# Field -> the SQL that selects it
+ISSUE_FIELDS = {
+    'id': 'i.id',
+    'title': 'i.title',
+    'description': 'i.description',
+    'category': 'i.category',
+    'location': 'i.location',
+    'priority': 'i.priority',
+    'status': 'i.status',
+    'image_url': 'i.image_path',
+    'reporter_id': 'i.reporter_id',
+    'reporter_name': 'r.fullname',
+    'assignee_id': 'i.assignee_id',
+    'assignee_name': 'a.fullname',
+    'vote_count': 'i.vote_count',
+    'merged_into': 'i.merged_into',
+    'created_at': 'i.created_at',
+    'acknowledged_at': 'i.acknowledged_at',
+    'resolved_at': 'i.resolved_at',
+    'updated_at': 'coalesce(i.updated_at, i.created_at)',
+    'version': 'i.version',
+}
+LIST_FIELDS = tuple(field for field in ISSUE_FIELDS if field not in ('description', 'image_url'))
+TIME_FIELDS = {'created_at', 'acknowledged_at', 'resolved_at', 'updated_at'}
+# Selected whatever was asked for: the pagination keys and the cache validators
+_ALWAYS = ('id', 'created_at', 'vote_count', 'version', 'updated_at')
+
+
+@bp.errorhandler(HTTPException)
+def _error(error):
+    return jsonify(error=error.description), error.code
+
+
+def _fields_arg(default):
+    raw = request.args.get('fields')
+    if not raw:
+        return default
+    fields = tuple(dict.fromkeys(field.strip() for field in raw.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in ISSUE_FIELDS]
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def _select(fields):
+    """SELECT ... FROM issues i, joining users only for the names asked for."""
+    columns = dict.fromkeys(_ALWAYS + fields)
+    sql = f"SELECT {', '.join(f'{ISSUE_FIELDS[field]} AS {field}' for field in columns)} FROM issues i"
+    if 'reporter_name' in fields:
+        sql += " JOIN users r ON r.id = i.reporter_id"
+    if 'assignee_name' in fields:
+        sql += " LEFT JOIN users a ON a.id = i.assignee_id"
+    return sql
+
+def _timestamp(value):
+    # Expressions such as coalesce() come back as text rather than datetimes
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value
+
+def _json_value(field, value):
+    if value is None:
+        return None
+    if field in TIME_FIELDS:
+        return _timestamp(value).isoformat(timespec='seconds') + 'Z'
+    if field == 'image_url':
+        return url_for('static', filename=value, _external=True)
+    return value
+
+def _issue_json(row, fields):
+    return {field: _json_value(field, row[field]) for field in fields}
+
+def _etag(*parts):
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+def _not_modified(etag, last_modified=None):
+    """True if the client's copy is current: If-None-Match decides when sent, else If-Modified-Since."""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    since = request.if_modified_since
+    return (since is not None and last_modified is not None
+            and _timestamp(last_modified).replace(microsecond=0) <= since.replace(tzinfo=None))
+
+def _revalidated(payload, etag, last_modified=None):
+    """The JSON response for payload, or an empty 304 if the client has it; payload is built lazily."""
+    if _not_modified(etag, last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(payload())
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _timestamp(last_modified)
+    # Per-user data: clients may keep it but must revalidate every time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+@bp.route('/issues')
+@api_login_required
+def list_issues():
+    """Issues newest (or most backed, sort=votes) first: every issue for admins, otherwise the caller's reports.
+
+    Admins can filter by status and category.
+    """
+    fields = _fields_arg(LIST_FIELDS)
+    sort = sort_arg(request.args)
+    where = []
+    params = []
+    if session.get('role') == 'admin':
+        for name in ('status', 'category'):
+            if request.args.get(name):
+                where.append(f"i.{name} = ?")
+                params.append(request.args[name])
+    else:
+        where.append("i.reporter_id = ?")
+        params.append(session['user_id'])
+
+    page = paginate(get_read_db(), _select(fields), where, params, 'i', request.args, sort=sort)
+    etag = _etag('issues', fields, [(row['id'], row['version']) for row in page], page.next_cursor, page.prev_cursor)
+    return _revalidated(lambda: {
+        'items': [_issue_json(row, fields) for row in page],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+    }, etag)
+
+@bp.route('/issues/<int:issue_id>')
+@api_login_required
+def get_issue(issue_id):
+    fields = _fields_arg(tuple(ISSUE_FIELDS))
+    row = get_read_db().execute(_select(fields) + " WHERE i.id = ?", (issue_id,)).fetchone()
+    if row is None:
+        abort(404, 'Issue not found.')
+    return _revalidated(lambda: _issue_json(row, fields),
+                        _etag('issue', issue_id, row['version'], fields), row['updated_at'])
+
+@bp.route('/issues/batch')
+@api_login_required
+def batch_issues():
+    """Many issues by id in one round trip: ids=1,2,3 (up to BATCH_MAX_IDS), in the order asked."""
+    try:
+        issue_ids = list(dict.fromkeys(int(issue_id) for issue_id in request.args.get('ids', '').split(',')
+                                       if issue_id.strip()))
+    except ValueError:
+        abort(400, 'ids must be a comma-separated list of issue ids')
+    if not issue_ids:
+        abort(400, 'ids is required')
+    if len(issue_ids) > BATCH_MAX_IDS:
+        abort(400, f'At most {BATCH_MAX_IDS} issues can be fetched at once')
+    fields = _fields_arg(LIST_FIELDS)
+
+    rows = {row['id']: row for row in get_read_db().execute(
+        _select(fields) + f" WHERE i.id IN ({', '.join('?' * len(issue_ids))})", issue_ids)}
+    etag = _etag('batch', fields, [(issue_id, rows[issue_id]['version'] if issue_id in rows else None)
+                                   for issue_id in issue_ids])
+    return _revalidated(lambda: {
+        'items': [_issue_json(rows[issue_id], fields) for issue_id in issue_ids if issue_id in rows],
+        'missing': [issue_id for issue_id in issue_ids if issue_id not in rows],
+    }, etag)
+
+@bp.route('/issues/<int:issue_id>/comments')
+@api_login_required
+def issue_comments(issue_id):
+    """An issue's comments, newest first; revalidated against the issue's version."""
+    db = get_read_db()
+    issue = db.execute("SELECT version, coalesce(updated_at, created_at) AS updated_at FROM issues WHERE id = ?",
+                       (issue_id,)).fetchone()
+    if issue is None:
+        abort(404, 'Issue not found.')
+
+    def _payload():
+        comments = db.execute('''
+            SELECT c.id, c.content, c.created_at, c.user_id, u.fullname, u.role
+            FROM comments c JOIN users u ON c.user_id = u.id
+            WHERE c.issue_id = ? ORDER BY c.created_at DESC
+        ''', (issue_id,)).fetchall()
+        return {'items': [{
+            'id': comment['id'], 'content': comment['content'],
+            'created_at': _json_value('created_at', comment['created_at']),
+            'author': {'id': comment['user_id'], 'name': comment['fullname'], 'role': comment['role']},
+        } for comment in comments]}
+
+    return _revalidated(_payload, _etag('comments', issue_id, issue['version']), issue['updated_at'])
+
+@bp.route('/notifications')
+@api_login_required
+def list_notifications():
+    """The caller's notifications, newest first; pass next_cursor back as `after` for older ones."""
+    per_page = per_page_arg(request.args, default=MAX_PER_PAGE // 2)
+    after = request.args.get('after', type=int)
+    db = get_read_db()
+    user_id = session['user_id']
+    audiences = notifications.current_audiences()
+    items = notifications.recent(db, user_id, audiences, limit=per_page, before=after)
+    return jsonify(
+        items=[{
+            'id': item['id'], 'issue_id': item['issue_id'], 'code': item['code'], 'message': item['message'],
+            'read': bool(item['is_read']), 'created_at': _json_value('created_at', item['created_at']),
+        } for item in items],
+        next_cursor=str(items[-1]['id']) if len(items) == per_page else None,
+        unread_count=notifications.cached_unread_count(db, user_id, audiences),
+    )
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from werkzeug.security import check_password_hash, generate_password_hash
-from app.db import get_db
+from app import notifications
+from app.db import get_db, run_write
 
 bp = Blueprint('auth', __name__)
 
@@ -52,11 +53,16 @@ def signup():
             error = 'Email is already registered.'
 
         if error is None:
-            db.execute(
-                'INSERT INTO users (fullname, email, password_hash, role) VALUES (?, ?, ?, ?)',
-                (fullname, email, generate_password_hash(password), role)
-            )
-            db.commit()
+            password_hash = generate_password_hash(password)
+
+            def _signup(db):
+                cur = db.execute(
+                    'INSERT INTO users (fullname, email, password_hash, role) VALUES (?, ?, ?, ?)',
+                    (fullname, email, password_hash, role)
+                )
+                notifications.start_cursor(db, cur.lastrowid)
+
+            run_write(_signup)
             flash('Account created successfully. Please log in.', 'success')
             return redirect(url_for('auth.login'))
 
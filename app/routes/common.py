@@ -1,5 +1,6 @@
-from flask import Blueprint, render_template, redirect, url_for, session, flash, request
-from app.db import get_db
+from flask import Blueprint, abort, render_template, redirect, url_for, session, flash, request, jsonify, current_app
+from app import notifications as notify, push
+from app.db import get_db, get_read_db, run_write
 from app.utils import login_required
 
 bp = Blueprint('common', __name__)
@@ -8,29 +9,102 @@ bp = Blueprint('common', __name__)
 @login_required
 def notifications():
     db = get_db()
-    notifications = db.execute('''
-        SELECT * FROM notifications 
-        WHERE user_id = ? 
-        ORDER BY created_at DESC
-    ''', (session['user_id'],)).fetchall()
+    items = notify.recent(db, session['user_id'], notify.current_audiences())
     
     # Mark all as read when viewing the list? 
     # Or just let user click them. Let's keep them unread until clicked or marked.
     
-    return render_template('notifications.html', notifications=notifications)
+    return render_template('notifications.html', notifications=items)
+
+@bp.route('/notifications/unread_count')
+@login_required
+def unread_count():
+    # Polled by the nav badge so pages themselves don't need the count
+    count = notify.cached_unread_count(get_db(), session['user_id'], notify.current_audiences())
+    response = jsonify(unread_count=count)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _subscribe(after):
+    """Subscribe the current user, then read what they missed since event id `after` (or nothing, if None).
+
+    Subscribing first means an event committed in between is in the
+    backlog, the subscription or both, never neither.
+    """
+    audiences = notify.current_audiences()
+    hub = push.get_hub()
+    subscription = hub.subscribe(audiences)
+    db = get_read_db()
+    if after is None:
+        subscription.after = notify.latest_event_id(db)
+        return hub, subscription, []
+    subscription.after = after
+    return hub, subscription, subscription.take(notify.events_after(db, audiences, after))
+
+@bp.route('/notifications/stream')
+@login_required
+def stream():
+    """Server-Sent Events: each new notification for the user, as it commits. Only with PUSH_STREAMING."""
+    if not current_app.config['PUSH_STREAMING']:
+        abort(404)
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is None:
+        after = request.args.get('after', type=int)
+    hub, subscription, backlog = _subscribe(after)
+    response = current_app.response_class(push.stream(hub, subscription, backlog, current_app.config),
+                                          mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Tell nginx not to buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@bp.route('/notifications/poll')
+@login_required
+def poll():
+    """The user's notification events past `after`, and the id to pass as `after` next time.
+
+    Without `after`, returns at once with the latest event id to start
+    from. With PUSH_STREAMING, waits up to PUSH_LONG_POLL_TIMEOUT seconds
+    for events and asks to be called again straight away; otherwise answers
+    at once and asks to be called again in PUSH_CLIENT_POLL_SECONDS.
+    """
+    config = current_app.config
+    after = request.args.get('after', type=int)
+    if config['PUSH_STREAMING']:
+        hub, subscription, events = _subscribe(after)
+        try:
+            if not events and after is not None:
+                events = subscription.get(config['PUSH_LONG_POLL_TIMEOUT'])
+        finally:
+            hub.unsubscribe(subscription)
+        last_id = subscription.after
+        retry_ms = 0
+    else:
+        db = get_read_db()
+        if after is None:
+            events = []
+            last_id = notify.latest_event_id(db)
+        else:
+            events = notify.events_after(db, notify.current_audiences(), after)
+            last_id = events[-1]['id'] if events else after
+        retry_ms = config['PUSH_CLIENT_POLL_SECONDS'] * 1000
+    response = jsonify(items=[push.event_payload(event) for event in events], last_id=last_id, retry_ms=retry_ms)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @bp.route('/notification/read/<int:notification_id>')
 @login_required
 def mark_read(notification_id):
     db = get_db()
     # verify ownership
-    notif = db.execute("SELECT * FROM notifications WHERE id = ?", (notification_id,)).fetchone()
-    if not notif or notif['user_id'] != session['user_id']:
+    notif = notify.get_for_user(db, notification_id, notify.current_audiences())
+    if not notif:
         flash("Notification not found", "error")
         return redirect(url_for('common.notifications'))
-        
-    db.execute("UPDATE notifications SET is_read = 1 WHERE id = ?", (notification_id,))
-    db.commit()
+
+    user_id = session['user_id']
+    run_write(lambda db: notify.mark_read(db, user_id, notification_id))
+    notify.forget_unread(user_id)
     
     if notif['issue_id']:
         # If admin, go to admin update? If student, go to issue detail.
@@ -46,8 +120,8 @@ def mark_read(notification_id):
 @bp.route('/notifications/clear')
 @login_required
 def clear_all():
-    db = get_db()
-    db.execute("UPDATE notifications SET is_read = 1 WHERE user_id = ?", (session['user_id'],))
-    db.commit()
+    user_id = session['user_id']
+    run_write(lambda db: notify.mark_all_read(db, user_id))
+    notify.forget_unread(user_id)
     flash("All notifications marked as read.", "success")
     return redirect(url_for('common.notifications'))
@@ -1,10 +1,12 @@
 import os
 import time
 from datetime import datetime
-from flask import Blueprint, render_template, request, flash, redirect, url_for, session, current_app
+from flask import Blueprint, render_template, request, flash, redirect, url_for, session, current_app, jsonify
 from werkzeug.utils import secure_filename
-from app.db import get_db
-from app.utils import login_required, allowed_file
+from app import assignment, counters, duplicates, events, jobs, notifications, push, votes
+from app.db import get_db, get_read_db, run_write
+from app.pagination import paginate, sort_arg
+from app.utils import login_required, allowed_file, status_counts
 
 bp = Blueprint('student', __name__)
 
@@ -12,18 +14,18 @@ bp = Blueprint('student', __name__)
 @login_required
 def dashboard():
     db = get_db()
-    issues = db.execute(
-        'SELECT * FROM issues WHERE reporter_id = ? ORDER BY created_at DESC',
-        (session['user_id'],)
-    ).fetchall()
+    sort = sort_arg(request.args)
+    issues = paginate(db, 'SELECT * FROM issues i', ['i.reporter_id = ?'],
+                      [session['user_id']], 'i', request.args, sort=sort)
     
-    total = len(issues)
-    in_progress = sum(1 for i in issues if i['status'] == 'In Progress')
-    resolved = sum(1 for i in issues if i['status'] == 'Resolved')
+    counts = status_counts(db, session['user_id'])
+    total = sum(counts.values())
+    in_progress = counts.get('In Progress', 0)
+    resolved = counts.get('Resolved', 0)
     
     return render_template('student_dashboard.html', 
                          issues=issues, total_issues=total, 
-                         in_progress=in_progress, resolved=resolved)
+                         in_progress=in_progress, resolved=resolved, sort=sort)
 
 @bp.route('/student/report', methods=('GET', 'POST'))
 @login_required
@@ -47,40 +49,86 @@ def report_issue():
             # Store relative path for template usage
             image_path = f"uploads/{filename}"
 
-        db = get_db()
-        cur = db.execute(
-            'INSERT INTO issues (title, category, description, location, priority, image_path, reporter_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
-            (title, category, description, location, priority, image_path, session['user_id'])
-        )
-        issue_id = cur.lastrowid
-        
-        # NOTIFICATION LOGIC
-        # 1. Notify Admins
-        admins = db.execute("SELECT id FROM users WHERE role = 'admin'").fetchall()
-        for admin in admins:
-            db.execute(
-                'INSERT INTO notifications (user_id, issue_id, message) VALUES (?, ?, ?)',
-                (admin['id'], issue_id, f"New {priority} priority issue reported: {title}")
-            )
-            
-        # 2. Notify Staff of this Category
-        staff_members = db.execute(
-            "SELECT id FROM users WHERE role = 'staff' AND (department = ? OR department = 'Others')",
-            (category,)
-        ).fetchall()
-        
-        for staff in staff_members:
-            db.execute(
-                'INSERT INTO notifications (user_id, issue_id, message) VALUES (?, ?, ?)',
-                (staff['id'], issue_id, f"New issue assigned to your department: {title}")
+        reporter_id = session['user_id']
+        auto_assign = current_app.config['AUTO_ASSIGN']
+
+        def _report(db, workloads):
+            assignee_id = None
+            if auto_assign:
+                workloads.sync(db)
+                assignee_id = workloads.pick(category)
+            cur = db.execute(
+                'INSERT INTO issues (title, category, description, location, priority, image_path, reporter_id, assignee_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (title, category, description, location, priority, image_path, reporter_id, assignee_id)
             )
-            
-        db.commit()
+            issue_id = cur.lastrowid
+            events.record(db, issue_id, events.REPORTED, actor_id=reporter_id)
+            # Hashing the text and photo for duplicate detection is left to a background job
+            jobs.enqueue(db, 'index_issue', {'issue_id': issue_id}, priority=jobs.HIGH)
+            if assignee_id:
+                events.record(db, issue_id, events.ASSIGNED, str(assignee_id))
+                notifications.notify(db, 'user', assignee_id, issue_id, 'auto_assigned', title=title)
+            issue = db.execute('SELECT * FROM issues WHERE id = ?', (issue_id,)).fetchone()
+            counters.record_change(db, None, issue)
+            if auto_assign:
+                workloads.record_change(db, None, issue)
+
+            # NOTIFICATION LOGIC: one event for all admins, one for the department's staff
+            notifications.notify(db, 'role', 'admin', issue_id, 'issue_reported', priority=priority, title=title)
+            notifications.notify(db, 'department', category, issue_id, 'department_issue', title=title)
+            return issue_id
+
+        assignment.run_write(_report)
+        jobs.wake()
+        push.publish()
         flash('Issue reported successfully!', 'success')
         return redirect(url_for('student.dashboard'))
         
     return render_template('report_issues.html')
 
+@bp.route('/student/report/duplicates', methods=['POST'])
+@login_required
+def check_duplicates():
+    """Open issues the report being written likely duplicates, checked before it is submitted."""
+    form = request.form
+    image = request.files.get('image')
+    entry = duplicates.entry(form.get('category', ''), form.get('location', ''), form.get('title', ''),
+                             form.get('description', ''),
+                             image.stream if image and allowed_file(image.filename) else None)
+    matches = duplicates.find(get_read_db(), entry, current_app.config)
+    for match in matches:
+        match['url'] = url_for('student.issue_detail', issue_id=match['id'])
+        match['me_too_url'] = url_for('student.me_too', issue_id=match['id'])
+    return jsonify(duplicates=matches)
+
+@bp.route('/issue/<int:issue_id>/me-too', methods=['POST'])
+@login_required
+def me_too(issue_id):
+    """Back an existing issue instead of reporting it again."""
+    user_id = session['user_id']
+
+    def _vote(db):
+        issue = db.execute('SELECT id, reporter_id, merged_into FROM issues WHERE id = ?', (issue_id,)).fetchone()
+        if issue is None:
+            return None, False
+        if issue['merged_into']:
+            # Votes for a merged duplicate go to the issue it was merged into
+            issue = db.execute('SELECT id, reporter_id, merged_into FROM issues WHERE id = ?',
+                               (issue['merged_into'],)).fetchone()
+        if issue['reporter_id'] == user_id:
+            return issue['id'], False
+        return issue['id'], votes.add(db, issue['id'], user_id)
+
+    target_id, added = run_write(_vote)
+    if target_id is None:
+        flash('Issue not found.', 'error')
+        return redirect(url_for('student.dashboard'))
+    if added:
+        flash(f'Thanks - you have been added to Issue #CMP-{target_id}.', 'success')
+    else:
+        flash(f'You are already following Issue #CMP-{target_id}.', 'success')
+    return redirect(url_for('student.issue_detail', issue_id=target_id))
+
 @bp.route('/issue/<int:issue_id>')
 @login_required
 def issue_detail(issue_id):
@@ -100,12 +148,17 @@ def issue_detail(issue_id):
         FROM comments c JOIN users u ON c.user_id = u.id
         WHERE c.issue_id = ? ORDER BY c.created_at DESC
     ''', (issue_id,)).fetchall()
+    timeline = events.timeline(db, issue_id)
+    voted = votes.has_voted(db, issue_id, session['user_id'])
+    vote_count = votes.current_count(db, issue)
+    # Merge candidates for admins
+    similar = duplicates.similar(db, issue_id, current_app.config) if session.get('role') == 'admin' else []
     
     # Mark notifications as read if visiting this issue
-    db.execute(
-        "UPDATE notifications SET is_read = 1 WHERE user_id = ? AND issue_id = ?",
-        (session['user_id'], issue_id)
-    )
-    db.commit()
+    user_id = session['user_id']
+    audiences = notifications.current_audiences()
+    run_write(lambda db: notifications.mark_issue_read(db, user_id, audiences, issue_id))
+    notifications.forget_unread(user_id)
     
-    return render_template('issue_tracking.html', issue=issue, comments=comments)
+    return render_template('issue_tracking.html', issue=issue, comments=comments, timeline=timeline,
+                           voted=voted, vote_count=vote_count, similar=similar)
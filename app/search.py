@@ -0,0 +1,141 @@
+import re
+import click
+from markupsafe import Markup, escape
+from app.db import get_read_db, run_write
+from app.pagination import Page
+
+# Full-text search over issues with an FTS5 table, issues_fts, whose rowid
+# is the issue id. Triggers (migration 4) keep it current as issues,
+# comments and reporter names change; rebuild() re-indexes an existing
+# database in id-range batches without taking the index offline.
+
+# Wrapped around matched terms by snippet(); replaced with <mark> after escaping
+_HIGHLIGHT_START = '\x02'
+_HIGHLIGHT_END = '\x03'
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+# Shorter words match whole terms only: "a*" would rank a large share of
+# the table, and that is what dominates query time on big databases
+MIN_PREFIX_LENGTH = 3
+# "42", "#42" and "#SCI-42" all mean issue 42
+_ISSUE_ID_RE = re.compile(r'^\s*#?(?:[A-Za-z]+-)?(\d+)\s*$')
+
+INDEX_SELECT = '''
+    SELECT i.id, i.title, i.description, i.location, u.fullname,
+           (SELECT group_concat(c.content, ' ') FROM comments c WHERE c.issue_id = i.id)
+    FROM issues i JOIN users u ON u.id = i.reporter_id
+'''
+
+
+def match_expression(q):
+    """Turn free text into an FTS5 query: every word must match, as a prefix
+    if it is at least MIN_PREFIX_LENGTH characters long.
+
+    Words are quoted so FTS5 operators and punctuation typed by the user
+    are searched for literally instead of being parsed.
+    """
+    tokens = _TOKEN_RE.findall(q or '')
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' if len(token) >= MIN_PREFIX_LENGTH else f'"{token}"'
+                    for token in tokens)
+
+def highlight(snippet):
+    if not snippet:
+        return ''
+    return Markup(str(escape(snippet))
+                  .replace(_HIGHLIGHT_START, '<mark>')
+                  .replace(_HIGHLIGHT_END, '</mark>'))
+
+def search_issues(db, q, where=(), params=(), page=1, per_page=25):
+    """Return a Page of issues matching q, best match first.
+
+    Each item is a dict of the issue row plus reporter_name and a
+    highlighted snippet. `where`/`params` add filters on the issues table
+    (alias i). A query that looks like an issue id puts that issue first.
+    next_cursor/prev_cursor hold page numbers.
+    """
+    page = max(page, 1)
+    offset = (page - 1) * per_page
+    filters = ''.join(f' AND {condition}' for condition in where)
+    items = []
+
+    id_match = _ISSUE_ID_RE.match(q or '')
+    exact_id = int(id_match.group(1)) if id_match else None
+    if exact_id is not None and page == 1:
+        row = db.execute(f'''
+            SELECT i.*, u.fullname AS reporter_name
+            FROM issues i JOIN users u ON u.id = i.reporter_id
+            WHERE i.id = ?{filters}
+        ''', [exact_id, *params]).fetchone()
+        if row is not None:
+            items.append(dict(row, snippet=escape(row['title'])))
+
+    has_more = False
+    expression = match_expression(q)
+    if expression is not None:
+        rows = db.execute(f'''
+            SELECT i.*, u.fullname AS reporter_name,
+                   snippet(issues_fts, -1, '{_HIGHLIGHT_START}', '{_HIGHLIGHT_END}', '…', 12) AS snippet
+            FROM issues_fts
+            JOIN issues i ON i.id = issues_fts.rowid
+            JOIN users u ON u.id = i.reporter_id
+            WHERE issues_fts MATCH ? AND i.id IS NOT ?{filters}
+            ORDER BY rank
+            LIMIT ? OFFSET ?
+        ''', [expression, exact_id, *params, per_page + 1, offset]).fetchall()
+        has_more = len(rows) > per_page
+        items.extend(dict(row, snippet=highlight(row['snippet'])) for row in rows[:per_page])
+
+    return Page(items, per_page,
+                next_cursor=page + 1 if has_more else None,
+                prev_cursor=page - 1 if page > 1 else None)
+
+def index_issues(db, first_id=None, last_id=None):
+    """(Re)index issues with ids in [first_id, last_id], dropping entries for deleted ones."""
+    bounds = ''
+    params = []
+    if first_id is not None:
+        bounds = ' WHERE i.id BETWEEN ? AND ?'
+        params = [first_id, last_id]
+    db.execute(f'''
+        INSERT OR REPLACE INTO issues_fts (rowid, title, description, location, reporter, comments)
+        {INDEX_SELECT}{bounds}
+    ''', params)
+    db.execute(f'''
+        DELETE FROM issues_fts
+        WHERE {'rowid BETWEEN ? AND ? AND' if bounds else ''} rowid NOT IN (SELECT id FROM issues)
+    ''', params)
+
+def rebuild(batch_size=5000, optimize=True):
+    """Re-index every issue in batches, each its own short write transaction.
+
+    The index stays searchable throughout and concurrent writes keep going
+    through the triggers. Returns the number of issues indexed.
+    """
+    db = get_read_db()
+    low, high, count = db.execute("SELECT MIN(id), MAX(id), COUNT(*) FROM issues").fetchone()
+    if low is not None:
+        for start in range(low, high + 1, batch_size):
+            stop = start + batch_size - 1
+            run_write(lambda db, start=start, stop=stop: index_issues(db, start, stop))
+    # Entries outside the current id range belong to deleted issues
+    run_write(lambda db: db.execute(
+        "DELETE FROM issues_fts WHERE rowid NOT BETWEEN ? AND ?", (low or 0, high or -1)))
+    if optimize:
+        run_write(lambda db: db.execute("INSERT INTO issues_fts (issues_fts) VALUES ('optimize')"))
+    return count
+
+def page_arg(args):
+    return max(args.get('page', 1, type=int) or 1, 1)
+
+
+@click.command('search-rebuild')
+@click.option('--batch-size', default=5000, show_default=True, help='Issues per write transaction.')
+@click.option('--no-optimize', is_flag=True, help='Skip merging the index segments afterwards.')
+def search_rebuild_command(batch_size, no_optimize):
+    """Rebuild the full-text search index from the issues and comments tables."""
+    count = rebuild(batch_size, optimize=not no_optimize)
+    click.echo(f'Indexed {count} issues.')
+
+def init_app(app):
+    app.cli.add_command(search_rebuild_command)
@@ -0,0 +1,165 @@
+import math
+from datetime import datetime
+import click
+from app.db import run_write
+from app.utils import IST_OFFSET
+
+# Resolution-time quantile sketches. Each resolved issue adds one count to
+# a logarithmic bucket (DDSketch style: bucket i covers durations in
+# (gamma^(i-1), gamma^i] seconds) in resolution_sketch, per IST resolved
+# day and per dimension key: the overall 'all' row plus the issue's
+# category, priority and assignee user id. Sketches merge by adding counts,
+# so a percentile over any window or key is a GROUP BY over at most a few
+# hundred buckets per day and never touches the issues table. Any quantile
+# is within RELATIVE_ACCURACY of the true value.
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(GAMMA)
+
+DIMENSIONS = ('all', 'category', 'priority', 'assignee')
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _timestamp(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    for fmt in ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+def bucket_for(seconds):
+    # Everything up to a second shares bucket 0
+    if seconds <= 1:
+        return 0
+    return math.ceil(math.log(seconds) / _LOG_GAMMA)
+
+def bucket_value(bucket):
+    """Representative duration of a bucket: within RELATIVE_ACCURACY of all its members."""
+    if bucket <= 0:
+        return 0.0
+    return 2 * GAMMA ** bucket / (GAMMA + 1)
+
+def contribution(issue):
+    """Return (day, bucket, {dimension: key}) for a resolved issue, or None.
+
+    `issue` is any mapping with status, created_at, resolved_at, category,
+    priority and assignee_id.
+    """
+    if issue['status'] != 'Resolved':
+        return None
+    created_at = _timestamp(issue['created_at'])
+    resolved_at = _timestamp(issue['resolved_at'])
+    if created_at is None or resolved_at is None:
+        return None
+    keys = {'all': '', 'category': issue['category'], 'priority': issue['priority'] or '',
+            'assignee': '' if issue['assignee_id'] is None else str(issue['assignee_id'])}
+    day = (resolved_at + IST_OFFSET).date().isoformat()
+    return day, bucket_for((resolved_at - created_at).total_seconds()), keys
+
+def _rows(contribution, sign):
+    day, bucket, keys = contribution
+    return [(day, dimension, key, bucket, sign) for dimension, key in keys.items()]
+
+_UPSERT = '''
+    INSERT INTO resolution_sketch (day, dimension, key, bucket, count) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (day, dimension, key, bucket) DO UPDATE SET count = count + excluded.count
+'''
+
+def record_change(db, before, after):
+    """Move an issue's sketch counts from its `before` state to its `after` state.
+
+    Call inside the write transaction that changes the issue; either side
+    may be None for an insert or delete.
+    """
+    record_changes(db, [(before, after)])
+
+def record_changes(db, changes):
+    """record_change() for many (before, after) pairs, with one upsert per bucket touched."""
+    counts = {}
+    for before, after in changes:
+        old = before and contribution(before)
+        new = after and contribution(after)
+        if old == new:
+            continue
+        for found, sign in ((old, -1), (new, 1)):
+            if found:
+                for day, dimension, key, bucket, _ in _rows(found, sign):
+                    counts[day, dimension, key, bucket] = counts.get((day, dimension, key, bucket), 0) + sign
+    db.executemany(_UPSERT, [(*key, count) for key, count in counts.items() if count])
+
+def rebuild(db):
+    """Recompute every sketch from the resolved issues in the caller's transaction."""
+    db.execute("DELETE FROM resolution_sketch")
+    issues = db.execute('''
+        SELECT status, created_at, resolved_at, category, priority, assignee_id
+        FROM issues WHERE status = 'Resolved' AND resolved_at IS NOT NULL
+    ''')
+    counts = {}
+    for issue in issues:
+        found = contribution(issue)
+        if found:
+            for day, dimension, key, bucket, _ in _rows(found, 1):
+                counts[day, dimension, key, bucket] = counts.get((day, dimension, key, bucket), 0) + 1
+    db.executemany(_UPSERT, [(*key, count) for key, count in counts.items()])
+    return sum(count for (_, dimension, _, _), count in counts.items() if dimension == 'all')
+
+def quantiles(db, dimension='all', since=None, until=None, qs=DEFAULT_QUANTILES):
+    """Return {key: {'count': n, 'p50': hours, ...}} for every key of a dimension.
+
+    Durations are in hours; since/until bound the IST resolved day. Assignee
+    keys are staff names.
+    """
+    where = ["dimension = ?"]
+    params = [dimension]
+    if since is not None:
+        where.append("day >= ?")
+        params.append(since.isoformat())
+    if until is not None:
+        where.append("day <= ?")
+        params.append(until.isoformat())
+    rows = db.execute(f'''
+        SELECT key, bucket, SUM(count) AS count FROM resolution_sketch
+        WHERE {' AND '.join(where)}
+        GROUP BY key, bucket HAVING SUM(count) > 0
+        ORDER BY key, bucket
+    ''', params).fetchall()
+
+    buckets = {}
+    for row in rows:
+        buckets.setdefault(row['key'], []).append((row['bucket'], row['count']))
+
+    results = {}
+    for key, histogram in buckets.items():
+        total = sum(count for _, count in histogram)
+        stats = {'count': total}
+        for q in qs:
+            # Rank of the q-quantile, then the bucket where the running count reaches it
+            rank = q * (total - 1)
+            seen = 0
+            for bucket, count in histogram:
+                seen += count
+                if seen > rank:
+                    break
+            stats[f'p{round(q * 100):g}'] = bucket_value(bucket) / 3600
+        results[key] = stats
+
+    if dimension == 'assignee' and results:
+        # Keyed by user id; report staff by name
+        names = {str(row['id']): row['fullname']
+                 for row in db.execute("SELECT id, fullname FROM users WHERE role = 'staff'")}
+        results = {names.get(key, key): stats for key, stats in results.items()}
+    return results
+
+
+@click.command('sketch-rebuild')
+def sketch_rebuild_command():
+    """Recompute the resolution-time sketches from the issues table."""
+    count = run_write(rebuild)
+    click.echo(f'Rebuilt resolution sketches from {count} resolved issues.')
+
+def init_app(app):
+    app.cli.add_command(sketch_rebuild_command)
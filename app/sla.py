@@ -0,0 +1,241 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from app import events, leases, notifications, sketches
+from app.db import _extension, get_read_db, run_write
+
+logger = logging.getLogger(__name__)
+
+# SLA tracking. Every open issue has two targets, counted from when it was
+# reported: time to acknowledge (first action by staff, which sets
+# issues.acknowledged_at) and time to resolve. Targets are set per priority
+# and can be overridden per (category, priority).
+#
+# A background scanner runs every SLA_SCAN_INTERVAL seconds in whichever
+# worker process holds the 'sla-scanner' lease. It is incremental: for each
+# target it remembers the created_at cutoff it has scanned through, and on
+# each pass reads only issues whose age crossed the target since the last
+# pass - an index range on (status, priority, created_at). A breaching
+# issue is recorded in sla_breaches, raised one priority step and reported
+# to admins. Targets should tighten as priority rises, so an escalated
+# issue is not checked against a window the scanner has already passed.
+
+DEFAULT_SETTINGS = {
+    'SLA_SCANNER': True,
+    'SLA_SCAN_INTERVAL': 60,
+    # priority -> (minutes to acknowledge, minutes to resolve)
+    'SLA_TARGETS': {
+        'High': (60, 24 * 60),
+        'Medium': (4 * 60, 3 * 24 * 60),
+        'Low': (24 * 60, 7 * 24 * 60),
+    },
+    # (category, priority) -> (minutes to acknowledge, minutes to resolve)
+    'SLA_CATEGORY_TARGETS': {},
+    # Open issues past this share of a target count as at risk
+    'SLA_AT_RISK_FRACTION': 0.75,
+}
+
+ACKNOWLEDGE = 'acknowledge'
+RESOLVE = 'resolve'
+OPEN_STATUSES = ('Submitted', 'In Progress')
+ESCALATION = {'Low': 'Medium', 'Medium': 'High'}
+LEASE = 'sla-scanner'
+
+
+def _timestamp(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+def target_groups(config):
+    """Yield (category, priority, acknowledge_minutes, resolve_minutes, excluded_categories).
+
+    A category of None is the per-priority default, which applies to every
+    category without its own override.
+    """
+    overrides = config['SLA_CATEGORY_TARGETS']
+    for priority, (acknowledge, resolve) in config['SLA_TARGETS'].items():
+        excluded = sorted(category for category, overridden in overrides if overridden == priority)
+        yield None, priority, acknowledge, resolve, excluded
+    for (category, priority), (acknowledge, resolve) in overrides.items():
+        yield category, priority, acknowledge, resolve, ()
+
+def _category_filter(category, excluded):
+    if category is not None:
+        return " AND category = ?", [category]
+    if excluded:
+        return f" AND category NOT IN ({', '.join('?' * len(excluded))})", list(excluded)
+    return "", []
+
+def _state(db):
+    return {row['key']: row['value'] for row in db.execute("SELECT key, value FROM sla_state")}
+
+def _set_state(db, values):
+    db.executemany('''
+        INSERT INTO sla_state (key, value) VALUES (?, ?)
+        ON CONFLICT (key) DO UPDATE SET value = excluded.value
+    ''', list(values.items()))
+
+def _breach(db, issue_id, kinds):
+    """Record new breaches of an open issue and escalate it. Returns True if escalated."""
+    issue = db.execute('SELECT * FROM issues WHERE id = ?', (issue_id,)).fetchone()
+    if issue is None or issue['status'] not in OPEN_STATUSES:
+        return False
+    new = [kind for kind in kinds if db.execute(
+        "INSERT OR IGNORE INTO sla_breaches (issue_id, kind) VALUES (?, ?)", (issue_id, kind)).rowcount]
+    if not new:
+        return False
+
+    priority = ESCALATION.get(issue['priority'])
+    if priority:
+        db.execute("UPDATE issues SET priority = ? WHERE id = ?", (priority, issue_id))
+        events.record(db, issue_id, events.ESCALATED, priority)
+        sketches.record_change(db, issue, db.execute('SELECT * FROM issues WHERE id = ?', (issue_id,)).fetchone())
+    notifications.notify(db, 'role', 'admin', issue_id, 'sla_breached',
+                         target=' and '.join(new), priority=priority or issue['priority'])
+    return bool(priority)
+
+def scan(db, config, now=None):
+    """One incremental pass in the caller's write transaction.
+
+    Returns (breaching issues found, issues escalated). The first pass for
+    a target only records how far it has looked: issues that were already
+    overdue when tracking started are counted but not escalated en masse.
+    """
+    now = now or datetime.utcnow()
+    state = _state(db)
+    marks = {}
+    found = {}
+    for category, priority, acknowledge, resolve, excluded in target_groups(config):
+        extra, extra_params = _category_filter(category, excluded)
+        for kind, minutes in ((ACKNOWLEDGE, acknowledge), (RESOLVE, resolve)):
+            key = f"mark:{kind}:{priority}:{category or ''}"
+            cutoff = _timestamp(now - timedelta(minutes=minutes))
+            mark = state.get(key)
+            if mark is not None and mark >= cutoff:
+                continue
+            marks[key] = cutoff
+            if mark is None:
+                continue
+
+            statuses = ('Submitted',) if kind == ACKNOWLEDGE else OPEN_STATUSES
+            sql = f'''
+                SELECT id FROM issues
+                WHERE status IN ({', '.join('?' * len(statuses))}) AND priority = ?
+                  AND created_at <= ? AND created_at > ?{extra}
+            '''
+            if kind == ACKNOWLEDGE:
+                sql += " AND acknowledged_at IS NULL"
+            for row in db.execute(sql, [*statuses, priority, cutoff, mark, *extra_params]):
+                found.setdefault(row['id'], []).append(kind)
+
+    escalated = sum(_breach(db, issue_id, kinds) for issue_id, kinds in found.items())
+    _set_state(db, marks)
+    return len(found), escalated
+
+def compute_summary(db, config, now=None):
+    """Count open issues past a target (breaching) or past SLA_AT_RISK_FRACTION of one (at risk)."""
+    now = now or datetime.utcnow()
+    fraction = config['SLA_AT_RISK_FRACTION']
+    breaching = at_risk = 0
+    for category, priority, acknowledge, resolve, excluded in target_groups(config):
+        extra, extra_params = _category_filter(category, excluded)
+        cutoffs = [_timestamp(now - timedelta(minutes=minutes))
+                   for minutes in (resolve, acknowledge, resolve * fraction, acknowledge * fraction)]
+        # Unacknowledged issues are held to both targets, the rest only to the resolve target
+        overdue = "(created_at <= ? OR (acknowledged_at IS NULL AND status = 'Submitted' AND created_at <= ?))"
+        row = db.execute(f'''
+            SELECT COALESCE(SUM({overdue}), 0), COALESCE(SUM(NOT {overdue} AND {overdue}), 0)
+            FROM issues
+            WHERE status IN ('Submitted', 'In Progress') AND priority = ? AND created_at <= ?{extra}
+        ''', [*cutoffs[:2], *cutoffs, priority, max(cutoffs[2:]), *extra_params]).fetchone()
+        breaching += row[0]
+        at_risk += row[1]
+    return {'breaching': breaching, 'at_risk': at_risk, 'scanned_at': _timestamp(now)}
+
+def summary(db):
+    """The counts stored by the last scan, or None if the scanner has not run."""
+    state = _state(db)
+    if 'scanned_at' not in state:
+        return None
+    return {'breaching': int(state['breaching']), 'at_risk': int(state['at_risk']),
+            'scanned_at': state['scanned_at']}
+
+def run_scan(holder=None):
+    """Scan if this process holds (or can take) the scanner lease.
+
+    Returns (found, escalated), or None when another process holds the lease.
+    """
+    config = current_app.config
+    holder = holder or leases.holder_id()
+    ttl = 3 * config['SLA_SCAN_INTERVAL']
+
+    def _scan(db):
+        if not leases.acquire(db, LEASE, holder, ttl):
+            return None
+        return scan(db, config)
+
+    result = run_write(_scan)
+    if result is not None:
+        # Counting reads every open, ageing issue, so it stays out of the write transaction
+        counts = compute_summary(get_read_db(), config)
+        run_write(lambda db: _set_state(db, counts))
+    return result
+
+
+class Scanner:
+    """Background thread calling run_scan() every SLA_SCAN_INTERVAL seconds.
+
+    Started by the first request of each worker process; every worker runs
+    one, and the lease decides which of them actually scans.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='sla-scanner', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    run_scan()
+            except Exception:
+                logger.exception('SLA scan failed')
+            time.sleep(self.app.config['SLA_SCAN_INTERVAL'])
+
+
+def get_scanner(app=None):
+    return _extension('smartcampus_sla_scanner', Scanner, app)
+
+
+@click.command('sla-scan')
+def sla_scan_command():
+    """Run one SLA scan now (only if no other process holds the scanner lease)."""
+    result = run_scan()
+    if result is None:
+        raise click.ClickException('Another process holds the SLA scanner lease.')
+    found, escalated = result
+    click.echo(f'{found} issues newly breached their SLA; {escalated} escalated.')
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+    app.cli.add_command(sla_scan_command)
+
+    @app.before_request
+    def _start_scanner():
+        if app.config['SLA_SCANNER']:
+            get_scanner(app).ensure_started()
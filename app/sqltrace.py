@@ -0,0 +1,202 @@
+import logging
+import re
+import sqlite3
+import time
+from collections import Counter
+from flask import g, has_request_context, request
+
+# Per-query SQL instrumentation. Pooled connections are created with
+# TracedConnection as their factory; every statement becomes a QueryRecord
+# holding the normalized SQL, rows fetched, wall time (execute + fetch) and
+# the endpoint that issued it. Records for the current request are kept on
+# g so after_request can report counts and spot N+1 patterns. The writer
+# thread has no request, so it points trace_records at the submitting
+# request's list (and trace_endpoint at its endpoint) while it runs that
+# request's write.
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger(__name__ + '.slow')
+
+DEFAULT_SETTINGS = {
+    'SQL_TRACE': True,
+    'SQL_SLOW_QUERY_MS': 100,
+    'SQL_SLOW_LOG': None,
+    'SQL_N_PLUS_ONE_THRESHOLD': 5,
+    'SQL_TRACE_HEADERS': False,
+}
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+_CONTROL_PREFIXES = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'PRAGMA')
+
+def normalize_sql(sql):
+    """Collapse whitespace and replace literals so equivalent statements compare equal."""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('(?+)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+class QueryRecord:
+    __slots__ = ('sql', 'endpoint', 'rows', 'elapsed', 'slow_ms', 'done')
+
+    def __init__(self, sql, endpoint, slow_ms):
+        self.sql = normalize_sql(sql)
+        self.endpoint = endpoint
+        self.rows = 0
+        self.elapsed = 0.0
+        self.slow_ms = slow_ms
+        self.done = False
+
+    @property
+    def is_control(self):
+        return self.sql.upper().startswith(_CONTROL_PREFIXES)
+
+    def finish(self):
+        if self.done:
+            return
+        self.done = True
+        if self.slow_ms is not None and self.elapsed * 1000 >= self.slow_ms:
+            slow_logger.warning('%.1fms rows=%d endpoint=%s sql=%s',
+                                self.elapsed * 1000, self.rows, self.endpoint or '-', self.sql)
+
+
+class TracedCursor(sqlite3.Cursor):
+    record = None
+
+    def _timed(self, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            if self.record is not None:
+                self.record.elapsed += time.perf_counter() - start
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if self.record is not None:
+            if row is None:
+                self.record.finish()
+            else:
+                self.record.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._timed(super().fetchmany, size)
+        if self.record is not None:
+            self.record.rows += len(rows)
+            if len(rows) < size:
+                self.record.finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        if self.record is not None:
+            self.record.rows += len(rows)
+            self.record.finish()
+        return rows
+
+    def __next__(self):
+        try:
+            row = self._timed(super().__next__)
+        except StopIteration:
+            if self.record is not None:
+                self.record.finish()
+            raise
+        if self.record is not None:
+            self.record.rows += 1
+        return row
+
+
+class TracedConnection(sqlite3.Connection):
+    slow_ms = None
+    trace_endpoint = None
+    trace_records = None
+    _last_record = None
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def _run(self, method, sql, params):
+        # A new statement means the caller is done reading the previous one
+        if self._last_record is not None:
+            self._last_record.finish()
+
+        records = self.trace_records
+        if records is not None:
+            endpoint = self.trace_endpoint
+        else:
+            endpoint = request.endpoint if has_request_context() else None
+            if has_request_context():
+                records = g.setdefault('sql_queries', [])
+        record = self._last_record = QueryRecord(sql, endpoint, self.slow_ms)
+        if records is not None:
+            records.append(record)
+
+        cur = self.cursor()
+        cur.record = record
+        start = time.perf_counter()
+        try:
+            getattr(cur, method)(sql, params)
+        finally:
+            record.elapsed += time.perf_counter() - start
+        if cur.description is None:
+            # Not a SELECT: count affected rows and close the record now
+            record.rows = max(cur.rowcount, 0)
+            record.finish()
+        return cur
+
+    def execute(self, sql, params=()):
+        return self._run('execute', sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._run('executemany', sql, seq_of_params)
+
+
+def request_summary():
+    """Return (query count, total ms, Counter of statements) for the current request."""
+    records = g.get('sql_queries', [])
+    statements = Counter(r.sql for r in records if not r.is_control)
+    total_ms = sum(r.elapsed for r in records) * 1000
+    return len(records), total_ms, statements
+
+def _after_request(response):
+    from flask import current_app
+    records = g.get('sql_queries')
+    if not records:
+        return response
+
+    for record in records:
+        record.finish()
+
+    count, total_ms, statements = request_summary()
+    g.sql_query_count = count
+    logger.debug('%s: %d queries in %.1fms', request.endpoint, count, total_ms)
+
+    threshold = current_app.config['SQL_N_PLUS_ONE_THRESHOLD']
+    if current_app.debug and threshold:
+        for sql, times in statements.items():
+            if times >= threshold:
+                logger.warning('Possible N+1 in %s: statement ran %d times: %s',
+                               request.endpoint, times, sql)
+
+    if current_app.config['SQL_TRACE_HEADERS'] or current_app.debug:
+        response.headers['X-SQL-Query-Count'] = str(count)
+        response.headers['X-SQL-Query-Time-Ms'] = f'{total_ms:.1f}'
+    return response
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+
+    if app.config['SQL_SLOW_LOG']:
+        handler = logging.FileHandler(app.config['SQL_SLOW_LOG'], encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_logger.addHandler(handler)
+    if app.debug:
+        logger.setLevel(logging.DEBUG)
+
+    app.after_request(_after_request)
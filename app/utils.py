@@ -1,9 +1,12 @@
 from datetime import datetime, timedelta
-from flask import session, flash, redirect, url_for
+from flask import session, flash, redirect, url_for, jsonify
 from functools import wraps
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
 
+# Statuses that take an issue off everyone's plate; merged issues live on in their canonical issue
+CLOSED_STATUSES = ('Resolved', 'Merged')
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -16,6 +19,15 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated
 
+def api_login_required(f):
+    """login_required for JSON endpoints: a 401 instead of a redirect to the login page."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify(error='Log in first.'), 401
+        return f(*args, **kwargs)
+    return decorated
+
 def admin_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -28,6 +40,15 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated
 
+def status_counts(db, reporter_id=None):
+    """Return {status: count} for all issues, or for one reporter's issues."""
+    if reporter_id is None:
+        rows = db.execute("SELECT status, COUNT(*) AS cnt FROM issues GROUP BY status")
+    else:
+        rows = db.execute(
+            "SELECT status, COUNT(*) AS cnt FROM issues WHERE reporter_id = ? GROUP BY status", (reporter_id,))
+    return {row['status']: row['cnt'] for row in rows}
+
 
 # Timezone Offset for IST (UTC+5:30)
 IST_OFFSET = timedelta(hours=5, minutes=30)
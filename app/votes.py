@@ -0,0 +1,144 @@
+import logging
+import os
+import threading
+import time
+import click
+from app.db import _extension, get_read_db, run_write
+
+logger = logging.getLogger(__name__)
+
+# "Me too" votes. Each vote is one issue_votes row keyed by (issue, user),
+# so voting twice is a no-op. The count shown on dashboards and used for
+# sorting is issues.vote_count, which votes never touch directly: a vote
+# appends a +1 to issue_vote_deltas, and a background flusher folds the
+# pending deltas into vote_count every VOTE_FLUSH_INTERVAL seconds with one
+# UPDATE per issue. A burst of votes on one issue is then a run of inserts
+# into two append-mostly tables instead of a queue of updates to the same
+# issues row, and the dashboards lag the true count by at most one interval.
+# The issue page adds the pending deltas for its own issue, so a voter sees
+# their vote counted straight away.
+#
+# Flushing only changes vote_count, which the issues data_version trigger
+# ignores (migration 13), so it does not invalidate analytics caches.
+
+DEFAULT_SETTINGS = {
+    'VOTE_FLUSHER': True,
+    'VOTE_FLUSH_INTERVAL': 5,
+}
+
+
+def _delta(db, issue_id, delta):
+    if delta:
+        db.execute("INSERT INTO issue_vote_deltas (issue_id, delta) VALUES (?, ?)", (issue_id, delta))
+
+def add(db, issue_id, user_id, created_at=None):
+    """Record user_id's vote for issue_id in the caller's write transaction. Returns True if it is new."""
+    added = db.execute(
+        "INSERT OR IGNORE INTO issue_votes (issue_id, user_id, created_at) VALUES (?, ?, coalesce(?, CURRENT_TIMESTAMP))",
+        (issue_id, user_id, created_at)).rowcount
+    _delta(db, issue_id, added)
+    return bool(added)
+
+def move(db, from_id, to_id, exclude_user=None):
+    """Move every vote for from_id to to_id, except exclude_user's (who reported to_id)."""
+    moved = db.execute('''
+        INSERT OR IGNORE INTO issue_votes (issue_id, user_id, created_at)
+        SELECT ?, user_id, created_at FROM issue_votes WHERE issue_id = ? AND user_id IS NOT ?
+    ''', (to_id, from_id, exclude_user)).rowcount
+    removed = db.execute("DELETE FROM issue_votes WHERE issue_id = ?", (from_id,)).rowcount
+    _delta(db, to_id, moved)
+    _delta(db, from_id, -removed)
+
+def has_voted(db, issue_id, user_id):
+    return db.execute("SELECT 1 FROM issue_votes WHERE issue_id = ? AND user_id = ?",
+                      (issue_id, user_id)).fetchone() is not None
+
+def current_count(db, issue):
+    """An issue's vote count including deltas not yet flushed."""
+    pending = db.execute("SELECT COALESCE(SUM(delta), 0) FROM issue_vote_deltas WHERE issue_id = ?",
+                         (issue['id'],)).fetchone()[0]
+    return issue['vote_count'] + pending
+
+def flush(db):
+    """Fold every pending delta into issues.vote_count. Returns the number of issues updated."""
+    rows = db.execute('''
+        SELECT issue_id, SUM(delta) AS delta FROM issue_vote_deltas GROUP BY issue_id HAVING SUM(delta) != 0
+    ''').fetchall()
+    db.executemany("UPDATE issues SET vote_count = vote_count + ? WHERE id = ?",
+                   [(row['delta'], row['issue_id']) for row in rows])
+    db.execute("DELETE FROM issue_vote_deltas")
+    return len(rows)
+
+def rebuild(db):
+    """Recount every issue's votes from issue_votes in the caller's transaction."""
+    db.execute("DELETE FROM issue_vote_deltas")
+    db.execute('''
+        UPDATE issues SET vote_count = (SELECT COUNT(*) FROM issue_votes v WHERE v.issue_id = issues.id)
+        WHERE vote_count != (SELECT COUNT(*) FROM issue_votes v WHERE v.issue_id = issues.id)
+    ''')
+    return db.execute("SELECT COUNT(*) FROM issue_votes").fetchone()[0]
+
+def flush_pending():
+    """Flush if there is anything to flush; the check is a read, so an idle flusher never writes."""
+    if get_read_db().execute("SELECT 1 FROM issue_vote_deltas LIMIT 1").fetchone() is None:
+        return 0
+    return run_write(flush)
+
+
+class Flusher:
+    """Background thread calling flush_pending() every VOTE_FLUSH_INTERVAL seconds.
+
+    Started by the first request of each worker process. Flushes from
+    different processes serialize on the writer lock and each one empties
+    the deltas table, so running one per process is harmless.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='vote-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.app.config['VOTE_FLUSH_INTERVAL'])
+            try:
+                with self.app.app_context():
+                    flush_pending()
+            except Exception:
+                logger.exception('Vote flush failed')
+
+
+def get_flusher(app=None):
+    return _extension('smartcampus_vote_flusher', Flusher, app)
+
+
+@click.command('votes-flush')
+@click.option('--rebuild', 'recount', is_flag=True, help='Recount every issue from the individual votes.')
+def votes_flush_command(recount):
+    """Fold pending "me too" votes into the issue vote counts."""
+    if recount:
+        count = run_write(rebuild)
+        click.echo(f'Recounted {count} votes.')
+    else:
+        count = run_write(flush)
+        click.echo(f'Updated vote counts on {count} issues.')
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+    app.cli.add_command(votes_flush_command)
+
+    @app.before_request
+    def _start_flusher():
+        if app.config['VOTE_FLUSHER']:
+            get_flusher(app).ensure_started()
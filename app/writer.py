@@ -0,0 +1,168 @@
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def is_busy(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+def begin_immediate(conn, retries, delay):
+    """BEGIN IMMEDIATE, retrying lock contention that outlasts busy_timeout."""
+    for attempt in range(retries + 1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as e:
+            if not is_busy(e) or attempt == retries:
+                raise
+            time.sleep(delay * (2 ** attempt))
+
+
+class WriteQueue:
+    """In-process single writer with group commit.
+
+    Request threads submit transaction bodies (callables taking the
+    connection) and get a Future back. One background thread owns the only
+    write connection in this process: it drains whatever is queued, runs
+    each body under its own SAVEPOINT inside a single BEGIN IMMEDIATE
+    transaction, commits once, and only then resolves the futures. A body
+    that raises is rolled back to its savepoint without affecting the rest
+    of the batch.
+
+    On a traced connection each body's statements are recorded against the
+    endpoint that submitted it, in the future's sql_queries list, so the
+    submitting request can count them as its own.
+    """
+
+    def __init__(self, connect, max_batch=64, retries=5, retry_delay=0.05):
+        self.connect = connect
+        self.max_batch = max_batch
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pid = None
+        # Counters for monitoring and benchmarking
+        self.commits = 0
+        self.writes = 0
+        self.largest_batch = 0
+
+    @property
+    def in_writer_thread(self):
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            # A forked worker inherits a dead thread and a stale queue
+            if self._pid != os.getpid():
+                self._queue = queue.SimpleQueue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, fn, endpoint=None):
+        future = Future()
+        future.sql_queries = []
+        self._ensure_started()
+        self._queue.put((fn, future, endpoint))
+        return future
+
+    def stop(self, timeout=5):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is _STOP:
+            return None
+        batch = [item]
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        conn = self.connect()
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                self._commit_batch(conn, batch)
+        finally:
+            conn.close()
+
+    def _commit_batch(self, conn, batch):
+        outcomes = []
+        try:
+            begin_immediate(conn, self.retries, self.retry_delay)
+            traced = hasattr(conn, 'trace_records')
+            for fn, future, endpoint in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if traced:
+                    conn.trace_endpoint, conn.trace_records = endpoint, future.sql_queries
+                conn.execute("SAVEPOINT write_item")
+                try:
+                    result = fn(conn)
+                except BaseException as e:
+                    conn.execute("ROLLBACK TO write_item")
+                    conn.execute("RELEASE write_item")
+                    outcomes.append((future, None, e))
+                else:
+                    conn.execute("RELEASE write_item")
+                    outcomes.append((future, result, None))
+                finally:
+                    if traced:
+                        conn.trace_endpoint = conn.trace_records = None
+            conn.execute("COMMIT")
+        except BaseException as e:
+            logger.exception('Group commit of %d writes failed', len(batch))
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for fn, future, endpoint in batch:
+                if future.running():
+                    future.set_exception(e)
+            return
+
+        self.commits += 1
+        self.writes += len(outcomes)
+        self.largest_batch = max(self.largest_batch, len(outcomes))
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+def create_write_queue(pool, config):
+    writer = WriteQueue(
+        pool.connect,
+        max_batch=config['DB_WRITER_MAX_BATCH'],
+        retries=config['DB_WRITE_RETRIES'],
+        retry_delay=config['DB_WRITE_RETRY_DELAY'],
+    )
+    atexit.register(writer.stop)
+    return writer
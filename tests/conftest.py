@@ -0,0 +1,26 @@
+import pytest
+from app import create_app
+from app.db import init_db
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test',
+        'DATABASE': str(tmp_path / 'smartcampus.sqlite'),
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        # Background threads are started by hand in the tests that need them
+        'SLA_SCANNER': False,
+        'VOTE_FLUSHER': False,
+        'JOBS_WORKER_THREADS': 0,
+    })
+    with app.app_context():
+        init_db()
+    return app
+
+@pytest.fixture
+def admin(app):
+    client = app.test_client()
+    client.post('/login', data={'email': 'admin@campus.edu', 'password': 'admin123', 'role': 'admin'})
+    return client
@@ -0,0 +1,15 @@
+from app.routes import admin as admin_routes
+
+
+def test_summary_api_then_page_share_the_cache(admin):
+    admin_routes._analytics_cache.clear()
+
+    response = admin.get('/api/analytics/summary')
+    assert response.status_code == 200
+    assert set(response.json) == {'total', 'resolved', 'resolved_today', 'active_critical',
+                                  'resolution_rate', 'avg_resolution_hours'}
+
+    assert admin.get('/analytics').status_code == 200
+    # And the page filling the cache does not change what the API serves
+    assert admin.get('/api/analytics/summary').json == response.json
+    assert set(admin.get('/api/analytics/categories').json) == {'labels', 'data'}
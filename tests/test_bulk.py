@@ -0,0 +1,44 @@
+from app.db import get_read_db
+
+
+def _report(app, count):
+    client = app.test_client()
+    client.post('/signup', data={'fullname': 'Stu Dent', 'email': 's@uni.edu', 'password': 'p', 'role': 'student'})
+    client.post('/login', data={'email': 's@uni.edu', 'password': 'p', 'role': 'student'})
+    for n in range(count):
+        client.post('/student/report', data={'title': f'Broken fan {n}', 'category': 'IT Support',
+                                             'description': 'It does not spin', 'location': f'Room {n}',
+                                             'priority': 'Low'})
+
+def _statuses(app):
+    with app.app_context():
+        return dict(get_read_db().execute("SELECT id, status FROM issues").fetchall())
+
+
+def test_bulk_rejects_json_that_is_not_an_object(admin):
+    response = admin.post('/admin/issues/bulk', json=[1, 2])
+    assert response.status_code == 400
+
+def test_bulk_rejects_issue_ids_that_are_not_a_list_of_ints(app, admin):
+    _report(app, 3)
+    for issue_ids in ('123', [1, '2'], [True], 5):
+        response = admin.post('/admin/issues/bulk', json={'issue_ids': issue_ids, 'status': 'Resolved'})
+        assert response.status_code == 400
+    assert set(_statuses(app).values()) == {'Submitted'}
+
+def test_bulk_updates_the_issues_given(app, admin):
+    _report(app, 3)
+    response = admin.post('/admin/issues/bulk', json={'issue_ids': [1, 3, 99], 'status': 'In Progress'})
+    assert response.json == {'results': {'1': 'updated', '3': 'updated', '99': 'not_found'}}
+    assert _statuses(app) == {1: 'In Progress', 2: 'Submitted', 3: 'In Progress'}
+
+def test_bulk_publishes_only_when_something_changed(app, admin, monkeypatch):
+    from app import push
+    published = []
+    monkeypatch.setattr(push, 'publish', lambda: published.append(True))
+    _report(app, 1)
+    published.clear()
+    admin.post('/admin/issues/bulk', json={'issue_ids': [1, 99], 'status': 'Submitted'})
+    assert published == []
+    admin.post('/admin/issues/bulk', json={'issue_ids': [1], 'status': 'Resolved'})
+    assert published == [True]
@@ -0,0 +1,20 @@
+import io
+from app import exports, imports
+from app.db import get_read_db, get_read_pool
+
+
+def test_reimporting_an_export_keeps_text_that_looks_like_a_formula(app):
+    client = app.test_client()
+    client.post('/signup', data={'fullname': 'Stu Dent', 'email': 's@uni.edu', 'password': 'p', 'role': 'student'})
+    client.post('/login', data={'email': 's@uni.edu', 'password': 'p', 'role': 'student'})
+    client.post('/student/report', data={'title': '-5°C in lab', 'category': 'Facilities',
+                                         'description': '=HYPERLINK("x") on the screen', 'location': "'Lab 2'",
+                                         'priority': 'Low'})
+
+    with app.app_context():
+        exported = b''.join(exports.stream(get_read_pool(), {})).decode()
+        assert "'-5°C in lab" in exported
+        summary = imports.import_issues(io.StringIO(exported, newline=''), 'roundtrip', app.config)
+        assert summary['imported'] == 1
+        rows = get_read_db().execute("SELECT title, description, location FROM issues ORDER BY id").fetchall()
+    assert [tuple(row) for row in rows] == [('-5°C in lab', '=HYPERLINK("x") on the screen', "'Lab 2'")] * 2
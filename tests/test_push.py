@@ -0,0 +1,41 @@
+import time
+
+
+def _student(app):
+    client = app.test_client()
+    client.post('/signup', data={'fullname': 'Stu Dent', 'email': 's@uni.edu', 'password': 'p', 'role': 'student'})
+    client.post('/login', data={'email': 's@uni.edu', 'password': 'p', 'role': 'student'})
+    return client
+
+def _report(client):
+    client.post('/student/report', data={'title': 'Broken fan', 'category': 'IT Support',
+                                         'description': 'It does not spin', 'location': 'Room 1', 'priority': 'Low'})
+
+
+def test_without_streaming_pages_poll_and_polls_answer_at_once(app, admin):
+    assert not app.config['PUSH_STREAMING']
+    assert b'data-stream="' not in admin.get('/admin/dashboard').data
+    assert admin.get('/notifications/stream').status_code == 404
+
+    start = admin.get('/notifications/poll').json
+    assert start['items'] == [] and start['retry_ms'] == app.config['PUSH_CLIENT_POLL_SECONDS'] * 1000
+    began = time.monotonic()
+    assert admin.get(f"/notifications/poll?after={start['last_id']}").json['items'] == []
+    assert time.monotonic() - began < 1
+
+    _report(_student(app))
+    polled = admin.get(f"/notifications/poll?after={start['last_id']}").json
+    assert [item['code'] for item in polled['items']] == ['issue_reported']
+    assert polled['last_id'] == polled['items'][-1]['id']
+
+def test_streaming_serves_the_event_stream(app, admin):
+    app.config['PUSH_STREAMING'] = True
+    assert b'data-stream="' in admin.get('/admin/dashboard').data
+    _report(_student(app))
+
+    response = admin.get('/notifications/stream?after=0', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b'retry:')
+    assert b'event: notification' in next(chunks)
+    response.close()
@@ -0,0 +1,13 @@
+from flask import g
+
+
+def test_writes_on_the_writer_thread_are_traced_in_the_request(app):
+    assert app.config['DB_WRITER_THREAD']
+    client = app.test_client()
+    with client:
+        client.post('/signup', data={'fullname': 'Stu Dent', 'email': 's@uni.edu', 'password': 'p',
+                                     'role': 'student'})
+        inserts = [record for record in g.sql_queries if record.sql.startswith('INSERT INTO users')]
+    assert len(inserts) == 1
+    assert inserts[0].endpoint == 'auth.signup'
+    assert inserts[0].rows == 1